@@ -1,17 +1,26 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, File, Form, UploadFile, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
-from typing import List, Optional
+from dataclasses import astuple
+from typing import List, Dict, Optional
 import os
+import asyncio
+import tempfile
+import hashlib
+import json
+import time
 import uuid
 from dotenv import load_dotenv
 from config_file import Configuration
-from utils import load_and_chunk_folder, store_chat_history, retrieve_chat_history
-from retrieval import HybridRetriever, Reranker, MetadataExtractor, MetadataInferrer, combine_metadata
-from models import GeminiModel
-from prompts import AdvancedPrompts
-import shutil
-from langchain_community.vectorstores import Chroma
-from langchain_community.retrievers import BM25Retriever
+from components import Components
+from retrieval import HybridRetriever
+from pipeline import QueryPipeline, PipelineOptions, StageTimer
+from metrics import REGISTRY, REQUEST_SECONDS, span
+from ingestion import SourceFile
+from batch import BatchQA
+from scheduler import SchedulerOverloaded
 
 
 import logging
@@ -22,8 +31,27 @@ logger = logging.getLogger(__name__)
 # Load environment variables
 load_dotenv()
 
+# Services are created lazily; the lifespan starts chat history and a background warm-up
+components = Components()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await components.start()
+    yield
+    await components.stop()
+
 # Initialize FastAPI app
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
+
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    start = time.perf_counter()
+    response = await call_next(request)
+    # Label by route template, not raw path, so job ids do not create new series
+    route = request.scope.get("route")
+    REQUEST_SECONDS.observe(time.perf_counter() - start, route=getattr(route, "path", "unmatched"),
+                            status=response.status_code)
+    return response
 
 # Pydantic models for request/response
 class UserRegistration(BaseModel):
@@ -34,107 +62,317 @@ class QueryInput(BaseModel):
     chatID: str
     question: str
     top_k: Optional[int] = Configuration.TOP_K
+    # Optional pipeline stages, each of which costs an LLM call or a model pass
+    history_check: bool = True
+    metadata_extraction: bool = True
+    query_rewrite: bool = True
+    metadata_filter: bool = True
+    rerank: bool = True
+    use_cache: bool = True
+    include_timings: bool = False  # Return per-stage milliseconds in QueryOutput.timings
+
+class BatchQueryInput(BaseModel):
+    userID: str
+    chatID: str
+    questions: List[str]
+    top_k: Optional[int] = Configuration.TOP_K
+    rerank: bool = True
 
 class QueryOutput(BaseModel):
     answer: str
     sources: List[str]
+    timings: Optional[Dict[str, float]] = None  # Milliseconds per pipeline stage, if requested
 
-# Initialize components
-gemini = GeminiModel()
-vectorstore = None  # Will be initialized after PDF upload
-docs = []  # Global variable to store loaded and chunked documents
-
-# Health check endpoint
+# Health check endpoints
 @app.get("/health")
 def health_check():
     return {"status": "ok"}
 
+@app.get("/health/live")
+def liveness():
+    return {"status": "ok"}
+
+@app.get("/health/ready")
+def readiness():
+    status = components.status()
+    return JSONResponse(status_code=200 if status["ready"] else 503, content=status)
+
 # User registration endpoint
 @app.post("/register")
 def register_user(user: UserRegistration):
     userID = str(uuid.uuid4())
     return {"userID": userID, "username": user.username}
 
+def save_upload(file: UploadFile, path: str) -> str:
+    """Stream an uploaded file to disk and return its SHA-256 fingerprint."""
+    digest = hashlib.sha256()
+    with open(path, "wb") as buffer:
+        while True:
+            block = file.file.read(1024 * 1024)
+            if not block:
+                break
+            digest.update(block)
+            buffer.write(block)
+    return digest.hexdigest()
+
 # Upload and embed PDFs endpoint
 @app.post("/upload")
-async def upload_and_embed(files: List[UploadFile] = File(...)):
+async def upload_and_embed(userID: str = Form(...), chatID: str = Form(...), files: List[UploadFile] = File(...)):
     try:
-        # Save uploaded files to a temporary folder
-        temp_folder = "temp_pdfs"
-        os.makedirs(temp_folder, exist_ok=True)
+        # Stream uploaded files into a per-job temporary folder
+        temp_folder = tempfile.mkdtemp(prefix="upload_")
+        sources = []
         for file in files:
-            file_path = os.path.join(temp_folder, file.filename)
-            with open(file_path, "wb") as buffer:
-                shutil.copyfileobj(file.file, buffer)
+            name = os.path.basename(file.filename)
+            file_path = os.path.join(temp_folder, name)
+            fingerprint = await asyncio.to_thread(save_upload, file, file_path)
+            sources.append(SourceFile(path=file_path, name=name, fingerprint=fingerprint))
 
-        # Load and chunk PDFs
-        global docs
-        docs = load_and_chunk_folder(temp_folder)
+        # Parse, chunk and embed in the background; unchanged files and chunks are skipped
+        corpora = await components.aget("corpora")
+        corpus = await asyncio.to_thread(corpora.get, userID, chatID, True)
+        ingestion = await components.aget("ingestion")
+        job = ingestion.submit(corpus, sources, cleanup_dir=temp_folder)
+        return {"job_id": job.job_id, "message": f"Ingestion of {len(sources)} files started."}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Ingestion job status endpoint
+@app.get("/upload/{job_id}")
+def upload_status(job_id: str):
+    job = components.ingestion.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown ingestion job: {job_id}")
+    return job.to_dict()
+
+# List the documents of a chat
+@app.get("/documents")
+def list_documents(userID: str, chatID: str):
+    corpus = components.corpora.get(userID, chatID)
+    if corpus is None:
+        raise HTTPException(status_code=404, detail="No documents uploaded for this chat.")
+    return corpus.describe()
+
+# Delete one document from a chat
+@app.delete("/documents")
+def delete_document(userID: str, chatID: str, source: str):
+    corpus = components.corpora.get(userID, chatID)
+    if corpus is None:
+        raise HTTPException(status_code=404, detail=f"Unknown document: {source}")
+    with corpus.writer() as writer:
+        deleted = writer.delete_source(source)
+        writer.publish()
+    if not deleted:
+        raise HTTPException(status_code=404, detail=f"Unknown document: {source}")
+    return {"message": f"Deleted {source}."}
+
+# Prometheus metrics endpoint
+@app.get("/metrics")
+def metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
 
-        # Initialize vector store with the uploaded documents
-        global vectorstore
-        vectorstore = Chroma.from_documents(docs, gemini.embeddings, persist_directory=Configuration.CHROMA_PERSIST_DIR)
+# Cache statistics endpoint
+@app.get("/cache/stats")
+def cache_stats():
+    stats = {"answers": components.answer_cache.stats(), "history": components.history.stats()}
+    if hasattr(components.gemini.embeddings, "stats"):
+        stats["embeddings"] = components.gemini.embeddings.stats()
+    return stats
 
-        # Clean up temporary folder
-        shutil.rmtree(temp_folder)
+def too_many_requests(e: SchedulerOverloaded) -> HTTPException:
+    return HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(max(1, round(e.retry_after)))})
 
-        return {"message": f"Uploaded and embedded {len(docs)} documents."}
+async def admit():
+    """Reject with 429 up front when the generation queue is already full, before doing any work."""
+    gemini = await components.aget("gemini")
+    scheduler = getattr(gemini.llm, "scheduler", None)
+    if scheduler is not None:
+        try:
+            scheduler.check_admission()
+        except SchedulerOverloaded as e:
+            raise too_many_requests(e)
+
+async def open_corpus(query):
+    """Current snapshot of the chat's corpus; one request uses one generation throughout."""
+    corpora = await components.aget("corpora")
+    corpus = await asyncio.to_thread(corpora.get, query.userID, query.chatID)
+    if corpus is not None and corpus.migrating:
+        raise HTTPException(status_code=503, detail="The documents of this chat are being re-indexed; retry shortly.",
+                            headers={"Retry-After": "30"})
+    snapshot = await asyncio.to_thread(corpus.snapshot) if corpus is not None else None
+    if snapshot is None or len(snapshot) == 0:
+        raise HTTPException(status_code=400, detail="No documents uploaded yet. Please upload PDFs first.")
+    return snapshot
+
+async def load_history(query: QueryInput) -> List[Dict[str, str]]:
+    try:
+        return await components.history.recent(query.userID, query.chatID, Configuration.HISTORY_LIMIT)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        logger.error(f"Error retrieving chat history: {e}")
+        return []
+
+async def save_exchange(query: QueryInput, answer: str):
+    await components.history.append(query.userID, query.chatID, "user", query.question)
+    await components.history.append(query.userID, query.chatID, "assistant", answer)
+
+async def build_pipeline(corpus) -> QueryPipeline:
+    # The reranker may still be loading if the warm-up has not finished; wait for it off the event loop
+    reranker = await components.aget("reranker")
+    gemini = await components.aget("gemini")
+    return QueryPipeline(
+        llm=gemini.llm,
+        retriever=HybridRetriever(corpus.vectorstore, corpus.bm25_index),
+        reranker=reranker,
+        statistics=corpus.statistics,
+    )
+
+def pipeline_options(query: QueryInput) -> PipelineOptions:
+    return PipelineOptions(
+        history_check=query.history_check,
+        metadata_extraction=query.metadata_extraction,
+        query_rewrite=query.query_rewrite,
+        metadata_filter=query.metadata_filter,
+        rerank=query.rerank,
+    )
+
+def answer_cache_scope(corpus, query: QueryInput, chat_history: List[Dict[str, str]]) -> tuple:
+    """Answers depend on the documents, the pipeline settings and the conversation so far.
+
+    The corpus is identified by content, so chats over the same files share
+    entries; a follow-up question only hits after the same earlier turns.
+    """
+    history = hashlib.sha256(json.dumps(chat_history).encode("utf-8")).hexdigest() if chat_history else None
+    return (corpus.fingerprint, query.top_k, astuple(pipeline_options(query)), history)
+
+def sse_event(event: str, data) -> str:
+    """Format one Server-Sent Event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
 
 # Chat endpoint
 @app.post("/chat", response_model=QueryOutput)
 async def chat(query: QueryInput):
     try:
-        if vectorstore is None:
-            raise HTTPException(status_code=400, detail="No documents uploaded yet. Please upload PDFs first.")
+        await admit()
+        corpus = await open_corpus(query)
 
-        # Retrieve chat history
-        # chat_history = retrieve_chat_history(query.userID, query.chatID)
-        try:
-            chat_history = retrieve_chat_history(query.userID, query.chatID)
-        except Exception as e:
-            logger.error(f"Error retrieving chat history: {e}")
-            chat_history = []
-
-        # Check if the query can be answered from chat history
-        if AdvancedPrompts.can_answer_from_history_prompt(query.question, chat_history)=="yes":
-            prompt = AdvancedPrompts.answer_from_history_prompt(chat_history, query.question)
-            response = gemini.llm.invoke(prompt).content
-            return QueryOutput(answer=response, sources=["chat_history"])
-
-        # Enhance query with chat history
-        enhanced_query = AdvancedPrompts.enhance_query_with_history_prompt(query.question, chat_history)
-
-        # Extract metadata
-        query_metadata = MetadataExtractor.extract_from_query(enhanced_query)
-        document_metadata = MetadataInferrer.infer_from_documents(docs)
-        combined_metadata = combine_metadata(query_metadata, document_metadata)
-
-        # Rewrite query with metadata
-        rewritten_query = gemini.llm.invoke(AdvancedPrompts.retrieval_prompt(enhanced_query)).content
-        enhanced_query_with_metadata = gemini.llm.invoke(AdvancedPrompts.metadata_filter_prompt(rewritten_query, combined_metadata)).content
-
-        # Retrieve and rerank documents
-        bm25_retriever = BM25Retriever.from_documents(docs)
-        hybrid_retriever = HybridRetriever(vectorstore, bm25_retriever)
-        reranker = Reranker()
-        retrieved_docs = hybrid_retriever.retrieve(enhanced_query_with_metadata, top_k=query.top_k)
-        reranked_docs = reranker.rerank(enhanced_query_with_metadata, retrieved_docs)
-
-        # Generate answer
-        context = "\n\n".join([doc.page_content for doc in reranked_docs])
-        prompt = AdvancedPrompts.generation_prompt(context, query.question)
-        response = gemini.llm.invoke(prompt).content
+        timer = StageTimer()
+        chat_history = await timer.run("history_lookup", load_history(query))
+
+        # Serve repeated questions against the same documents and conversation from the cache
+        use_cache = Configuration.ANSWER_CACHE_ENABLED and query.use_cache
+        cache_scope = answer_cache_scope(corpus, query, chat_history)
+        answer_cache = await components.aget("answer_cache") if use_cache else None
+        if use_cache:
+            cached = await timer.run("answer_cache", asyncio.to_thread(
+                answer_cache.get, cache_scope, query.question))
+            if cached is not None:
+                await save_exchange(query, cached["answer"])
+                return QueryOutput(**cached, timings=timer.timings if query.include_timings else None)
+
+        # Run the query pipeline
+        pipeline = await build_pipeline(corpus)
+        result = await pipeline.run(query.question, chat_history, top_k=query.top_k, options=pipeline_options(query))
+        timer.timings.update(result.timings)
 
         # Store chat history
-        store_chat_history(query.userID, query.chatID, "user", query.question)
-        store_chat_history(query.userID, query.chatID, "assistant", response)
+        await save_exchange(query, result.answer)
 
-        return QueryOutput(answer=response, sources=[doc.metadata.get("source", "unknown") for doc in reranked_docs])
+        if use_cache and result.sources != ["chat_history"]:
+            await asyncio.to_thread(answer_cache.put, cache_scope, query.question,
+                                    {"answer": result.answer, "sources": result.sources})
+
+        return QueryOutput(answer=result.answer, sources=result.sources,
+                           timings=timer.timings if query.include_timings else None)
+    except HTTPException:
+        raise
+    except SchedulerOverloaded as e:
+        raise too_many_requests(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# Streaming chat endpoint (Server-Sent Events)
+@app.post("/chat/stream")
+async def chat_stream(query: QueryInput):
+    """Stream the answer as SSE: a ``sources`` event, ``token`` events, then ``done``.
+
+    Chat history is written in a background task once the stream has ended.
+    """
+    await admit()
+    corpus = await open_corpus(query)
+    use_cache = Configuration.ANSWER_CACHE_ENABLED and query.use_cache
+    exchange = {}
+
+    async def events():
+        try:
+            with span("history_lookup"):
+                chat_history = await load_history(query)
+            cache_scope = answer_cache_scope(corpus, query, chat_history)
+            answer_cache = await components.aget("answer_cache") if use_cache else None
+            if use_cache:
+                cached = await asyncio.to_thread(answer_cache.get, cache_scope, query.question)
+                if cached is not None:
+                    exchange["answer"] = cached["answer"]
+                    yield sse_event("sources", cached["sources"])
+                    yield sse_event("token", cached["answer"])
+                    yield sse_event("done", {"answer": cached["answer"], "sources": cached["sources"]})
+                    return
+
+            pipeline = await build_pipeline(corpus)
+            async for event, data in pipeline.stream(
+                    query.question, chat_history, top_k=query.top_k, options=pipeline_options(query)):
+                if event == "done":
+                    exchange["answer"] = data.answer
+                    if use_cache and data.sources != ["chat_history"]:
+                        await asyncio.to_thread(answer_cache.put, cache_scope, query.question,
+                                                {"answer": data.answer, "sources": data.sources})
+                    data = {"answer": data.answer, "sources": data.sources,
+                            "timings": data.timings if query.include_timings else None}
+                yield sse_event(event, data)
+        except Exception as e:
+            logger.error(f"Error streaming chat response: {e}")
+            yield sse_event("error", {"detail": str(e)})
+
+    async def persist_history():
+        if "answer" in exchange:
+            try:
+                await save_exchange(query, exchange["answer"])
+            except Exception as e:
+                logger.error(f"Error storing chat history: {e}")
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=BackgroundTask(persist_history),
+    )
+
+# Batch question answering endpoint (newline-delimited JSON, one line per answer as it completes)
+@app.post("/chat/batch")
+async def chat_batch(batch: BatchQueryInput):
+    if len(batch.questions) > Configuration.BATCH_MAX_QUESTIONS:
+        raise HTTPException(status_code=400,
+                            detail=f"At most {Configuration.BATCH_MAX_QUESTIONS} questions per batch.")
+    await admit()
+    corpus = await open_corpus(batch)
+    reranker = await components.aget("reranker")
+    gemini = await components.aget("gemini")
+    batch_qa = BatchQA(
+        llm=gemini.llm,
+        embeddings=gemini.embeddings,
+        retriever=HybridRetriever(corpus.vectorstore, corpus.bm25_index),
+        reranker=reranker,
+    )
+
+    async def lines():
+        try:
+            async for answer in batch_qa.run(batch.questions, top_k=batch.top_k, rerank=batch.rerank):
+                yield json.dumps(answer.to_dict()) + "\n"
+        except Exception as e:
+            logger.error(f"Error answering batch: {e}")
+            yield json.dumps({"error": str(e)}) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
 # Run the FastAPI app
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,98 @@
+import asyncio
+from dataclasses import dataclass, field, asdict
+from typing import AsyncIterator, List, Dict, Optional
+from langchain.schema import Document
+from config_file import Configuration
+from prompts import AdvancedPrompts
+from cache import embed_queries
+from context import ContextBuilder
+from metrics import span
+
+
+@dataclass
+class BatchAnswer:
+    index: int  # Position of the question in the request
+    question: str
+    answer: Optional[str] = None
+    sources: List[str] = field(default_factory=list)
+    error: Optional[str] = None
+
+    def to_dict(self) -> Dict:
+        return asdict(self)
+
+
+class BatchQA:
+    """Answers many questions against one corpus, sharing work across them.
+
+    All questions are embedded in one call, and both arms score them as
+    matrices against the chat's snapshot: BM25 over its postings, the vector
+    arm over its ``DenseIndex`` (or the quantized codes of a
+    ``QuantizedDenseIndex``, rescored in float32). Every (question, chunk)
+    pair then goes through the reranker in shared batches. Only
+    generation is per question, with at most ``concurrency`` calls in flight,
+    and answers are yielded in completion order.
+
+    Batch questions are answered independently: there is no chat history,
+    metadata extraction or query rewriting, which would each cost an extra LLM
+    call per question.
+    """
+
+    def __init__(self, llm, embeddings, retriever, reranker, context_builder: Optional[ContextBuilder] = None,
+                 concurrency: int = Configuration.BATCH_GENERATION_CONCURRENCY):
+        self.llm = llm
+        self.embeddings = embeddings
+        self.retriever = retriever
+        self.reranker = reranker
+        self.context_builder = context_builder or ContextBuilder()
+        self.concurrency = concurrency
+
+    def retrieve(self, questions: List[str], top_k: int = Configuration.TOP_K, rerank: bool = True,
+                 filters: Optional[Dict] = None) -> List[List[Document]]:
+        """Context documents for every question, computed in batches."""
+        with span("batch_embedding"):
+            if hasattr(self.embeddings, "embed_queries"):
+                query_embeddings = self.embeddings.embed_queries(questions)
+            else:
+                query_embeddings = embed_queries(self.embeddings, questions)
+        with span("batch_retrieval"):
+            candidates = self.retriever.retrieve_batch(questions, query_embeddings, top_k, filters)
+        document_lists = [[doc for doc, _ in results] for results in candidates]
+        if not rerank:
+            return [docs[:Configuration.TOP_N] for docs in document_lists]
+        with span("batch_rerank"):
+            return self.reranker.rerank_batch(questions, document_lists)
+
+    async def _answer(self, index: int, question: str, documents: List[Document],
+                      semaphore: asyncio.Semaphore) -> BatchAnswer:
+        context, passages = self.context_builder.build(documents)
+        result = BatchAnswer(index=index, question=question, sources=[p.citation for p in passages])
+        try:
+            async with semaphore:
+                with span("batch_generation"):
+                    message = await self.llm.ainvoke(AdvancedPrompts.generation_prompt(context, question))
+            result.answer = message.content
+        except Exception as e:
+            result.error = str(e)
+        return result
+
+    async def run(self, questions: List[str], top_k: int = Configuration.TOP_K,
+                  rerank: bool = True) -> AsyncIterator[BatchAnswer]:
+        """Yield one ``BatchAnswer`` per question as soon as its generation finishes."""
+        if not questions:
+            return
+        document_lists = await asyncio.to_thread(self.retrieve, questions, top_k, rerank)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        tasks = [asyncio.ensure_future(self._answer(i, question, documents, semaphore))
+                 for i, (question, documents) in enumerate(zip(questions, document_lists))]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def answer_all(self, questions: List[str], top_k: int = Configuration.TOP_K,
+                         rerank: bool = True) -> List[BatchAnswer]:
+        """Convenience wrapper returning every answer in question order."""
+        answers = [answer async for answer in self.run(questions, top_k, rerank)]
+        return sorted(answers, key=lambda answer: answer.index)
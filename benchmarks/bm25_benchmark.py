@@ -0,0 +1,101 @@
+"""Compare BM25 query latency: per-request rebuild vs the persistent BM25Index.
+
+Usage:
+    python benchmarks/bm25_benchmark.py --sizes 10000 100000 1000000
+
+The baseline mirrors the old /chat behaviour (``BM25Retriever.from_documents``
+on every request); it is skipped above ``--baseline-max`` chunks because a
+single rebuild at 1M chunks takes minutes.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain.schema import Document
+from retrieval import BM25Index
+
+
+def synthetic_corpus(n_chunks: int, vocab_size: int = 50000, words_per_chunk: int = 150, seed: int = 0):
+    """Generate chunks whose word frequencies follow a Zipf distribution."""
+    rng = np.random.default_rng(seed)
+    vocabulary = np.array([f"w{i}" for i in range(vocab_size)])
+    for start in range(0, n_chunks, 10000):
+        size = min(10000, n_chunks - start)
+        word_ids = np.minimum(rng.zipf(1.2, size=(size, words_per_chunk)), vocab_size) - 1
+        for row in word_ids:
+            yield Document(page_content=" ".join(vocabulary[row]), metadata={"source": "synthetic"})
+
+
+def synthetic_queries(n_queries: int, vocab_size: int = 50000, seed: int = 1):
+    rng = np.random.default_rng(seed)
+    return [" ".join(f"w{i}" for i in rng.integers(0, vocab_size // 10, size=6)) for _ in range(n_queries)]
+
+
+def build_index(docs):
+    index = BM25Index()
+    index.add_documents(docs)
+    return index
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, (time.perf_counter() - start) * 1000
+
+
+def run(size: int, n_queries: int, top_k: int, baseline_max: int):
+    docs = list(synthetic_corpus(size))
+    queries = synthetic_queries(n_queries)
+
+    index, build_ms = timed(build_index, docs)
+    with tempfile.TemporaryDirectory() as path:
+        _, save_ms = timed(index.save, path)
+        _, load_ms = timed(BM25Index.load, path)
+    index_latencies = [timed(index.get_relevant_documents, q, top_k)[1] for q in queries]
+
+    row = {
+        "chunks": size,
+        "index_build_ms": build_ms,
+        "index_save_ms": save_ms,
+        "index_load_ms": load_ms,
+        "index_query_p50_ms": float(np.percentile(index_latencies, 50)),
+        "index_query_p99_ms": float(np.percentile(index_latencies, 99)),
+        "rebuild_query_p50_ms": None,
+    }
+
+    if size <= baseline_max:
+        from langchain_community.retrievers import BM25Retriever
+
+        def rebuild_and_query(query):
+            retriever = BM25Retriever.from_documents(docs, k=top_k)
+            return retriever.get_relevant_documents(query)
+
+        rebuild_latencies = [timed(rebuild_and_query, q)[1] for q in queries[: max(1, n_queries // 10)]]
+        row["rebuild_query_p50_ms"] = float(np.percentile(rebuild_latencies, 50))
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--baseline-max", type=int, default=100000)
+    args = parser.parse_args()
+
+    print(f"{'chunks':>9} {'build ms':>10} {'load ms':>9} {'index p50':>10} {'index p99':>10} {'rebuild p50':>12}")
+    for size in args.sizes:
+        row = run(size, args.queries, args.top_k, args.baseline_max)
+        rebuild = f"{row['rebuild_query_p50_ms']:.1f}" if row["rebuild_query_p50_ms"] is not None else "skipped"
+        print(f"{row['chunks']:>9} {row['index_build_ms']:>10.0f} {row['index_load_ms']:>9.0f} "
+              f"{row['index_query_p50_ms']:>10.2f} {row['index_query_p99_ms']:>10.2f} {rebuild:>12}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""Measure import time of the API modules in fresh interpreters.
+
+Usage:
+    python benchmarks/cold_start_benchmark.py --runs 5
+    python benchmarks/cold_start_benchmark.py --runs 1 --top 15
+
+Every measurement runs in a new subprocess so nothing is served from
+``sys.modules``. ``--top`` additionally prints the slowest imports under
+``app`` according to ``python -X importtime``, which is the quickest way to
+find the module that brought a heavy dependency back onto the import path.
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULES = ["config_file", "utils", "retrieval", "corpus", "pipeline", "components", "app"]
+HEAVY = ["torch", "transformers", "sklearn", "langchain_google_genai", "motor"]
+
+PROBE = """
+import sys, time
+start = time.perf_counter()
+import {module}
+elapsed = (time.perf_counter() - start) * 1000
+heavy = [name for name in {heavy!r} if name in sys.modules]
+print(elapsed, ",".join(heavy))
+"""
+
+
+def measure(module: str):
+    output = subprocess.run(
+        [sys.executable, "-c", PROBE.format(module=module, heavy=HEAVY)],
+        cwd=ROOT, capture_output=True, text=True, check=True,
+    ).stdout.strip().splitlines()[-1]
+    elapsed, _, heavy = output.partition(" ")
+    return float(elapsed), heavy
+
+
+def slowest_imports(module: str, top: int):
+    """Parse ``-X importtime`` output into (cumulative us, module name), slowest first."""
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, capture_output=True, text=True, check=True,
+    ).stderr
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        rows.append((int(cumulative), name.strip()))
+    return sorted(rows, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--modules", nargs="+", default=MODULES)
+    parser.add_argument("--top", type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"{'module':>12} {'p50 ms':>9} {'max ms':>9}  heavy dependencies loaded")
+    for module in args.modules:
+        results = [measure(module) for _ in range(args.runs)]
+        latencies = [elapsed for elapsed, _ in results]
+        print(f"{module:>12} {np.percentile(latencies, 50):>9.0f} {max(latencies):>9.0f}  {results[-1][1] or '-'}")
+
+    if args.top:
+        print("\nSlowest imports under app (cumulative ms):")
+        for cumulative, name in slowest_imports("app", args.top):
+            print(f"{cumulative / 1000:>9.1f}  {name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+"""Offline end-to-end benchmark of the FastAPI app with local stand-ins for every external service.
+
+Usage:
+    python benchmarks/e2e_benchmark.py --files 20 --pages 10 --users 1 8 32 --questions 20 --output results.json
+
+The real app, ingestion pipeline, corpus snapshots, BM25 index, fusion and answer cache
+run in-process behind an ASGI client. Gemini is replaced by ``FakeLLM`` with
+``--llm-delay`` seconds per call, embeddings by ``HashEmbeddings`` and MongoDB
+by the in-memory history backend. The reranker is a ``FakeReranker`` unless
+``--real-reranker`` is given. Scenarios:
+
+    upload    one bulk /upload of the synthetic corpus, until the job completes
+    chat      N concurrent users asking --questions questions each via /chat
+    batch     --batch-size questions answered by one /chat/batch request
+    reupload  the same files again (all unchanged), then with one file edited, then
+              a renamed copy of one file (its chunks are collapsed as duplicates)
+
+Results (throughput, p50/p95/p99 latency, peak RSS) are printed and, with
+``--output``, written as JSON together with the git revision so runs can be
+compared across versions.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+from app import app, components
+from corpus import CorpusRegistry
+from history import ChatHistory, MemoryHistoryBackend
+from metrics import InstrumentedLLM
+from benchmarks.fakes import FakeGemini, FakeLLM, FakeReranker, HashEmbeddings
+from benchmarks.synthetic_pdf import make_pdf, synthetic_documents, synthetic_questions, write_corpus
+
+USER_ID = "bench-user"
+CHAT_ID = "bench-chat"
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process and of its reaped children (the parsing pool), in MB."""
+    to_mb = 1 / (1024 * 1024) if sys.platform == "darwin" else 1 / 1024  # ru_maxrss is bytes on macOS, KiB on Linux
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return round(own * to_mb, 1), round(children * to_mb, 1)
+
+
+def summarize(latencies_ms, elapsed_s: float, operations: int) -> dict:
+    latencies = np.asarray(latencies_ms) if latencies_ms else np.zeros(1)
+    return {
+        "operations": operations,
+        "elapsed_s": round(elapsed_s, 3),
+        "throughput_per_s": round(operations / elapsed_s, 2) if elapsed_s else None,
+        "p50_ms": round(float(np.percentile(latencies, 50)), 2),
+        "p95_ms": round(float(np.percentile(latencies, 95)), 2),
+        "p99_ms": round(float(np.percentile(latencies, 99)), 2),
+    }
+
+
+async def upload(client: httpx.AsyncClient, paths, poll_interval: float = 0.05) -> dict:
+    """POST the files to /upload and wait for the ingestion job to finish."""
+    files = []
+    for path in paths:
+        with open(path, "rb") as f:
+            files.append(("files", (os.path.basename(path), f.read(), "application/pdf")))
+    response = await client.post("/upload", data={"userID": USER_ID, "chatID": CHAT_ID}, files=files)
+    response.raise_for_status()
+    job_id = response.json()["job_id"]
+    while True:
+        job = (await client.get(f"/upload/{job_id}")).json()
+        if job["status"] in ("completed", "failed"):
+            return job
+        await asyncio.sleep(poll_interval)
+
+
+async def scenario_upload(client, paths) -> dict:
+    start = time.perf_counter()
+    job = await upload(client, paths)
+    elapsed = time.perf_counter() - start
+    if job["status"] != "completed":
+        raise RuntimeError(f"Upload failed: {job['error']}")
+    result = summarize([elapsed * 1000], elapsed, 1)
+    result.update({"files": job["files"], "pages": job["pages"], "chunks": job["chunks"],
+                   "pages_per_s": round(job["pages"] / elapsed, 2), "chunks_per_s": round(job["chunks"] / elapsed, 2)})
+    return result
+
+
+async def scenario_chat(client, users: int, questions_per_user: int, use_cache: bool) -> dict:
+    questions = synthetic_questions(users * questions_per_user)
+    latencies, errors = [], 0
+
+    async def user(index: int):
+        nonlocal errors
+        for question in questions[index::users]:
+            start = time.perf_counter()
+            response = await client.post("/chat", json={
+                "userID": USER_ID, "chatID": CHAT_ID, "question": question, "use_cache": use_cache})
+            latencies.append((time.perf_counter() - start) * 1000)
+            if response.status_code != 200:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(user(i) for i in range(users)))
+    result = summarize(latencies, time.perf_counter() - start, len(latencies))
+    result.update({"users": users, "errors": errors})
+    return result
+
+
+async def scenario_batch(client, size: int) -> dict:
+    questions = synthetic_questions(size, seed=2)
+    latencies, errors = [], 0
+    start = time.perf_counter()
+    async with client.stream("POST", "/chat/batch", json={
+            "userID": USER_ID, "chatID": CHAT_ID, "questions": questions}) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if not line:
+                continue
+            latencies.append((time.perf_counter() - start) * 1000)  # time until each answer arrives
+            if json.loads(line).get("error"):
+                errors += 1
+    result = summarize(latencies, time.perf_counter() - start, len(latencies))
+    result.update({"questions": size, "errors": errors})
+    return result
+
+
+async def scenario_reupload(client, paths, pages: int) -> dict:
+    results = {}
+    start = time.perf_counter()
+    job = await upload(client, paths)
+    elapsed = time.perf_counter() - start
+    results["unchanged"] = dict(summarize([elapsed * 1000], elapsed, 1), files_unchanged=job["files_unchanged"],
+                                embedded=job["embedded"])
+
+    # Edit one page of the first file: only that file is re-parsed and only its changed chunks embedded
+    edited = synthetic_documents(1, pages, seed=0)[0]
+    edited[0] = edited[0] + " This paragraph was added in a revision."
+    with open(paths[0], "wb") as f:
+        f.write(make_pdf(edited))
+    start = time.perf_counter()
+    job = await upload(client, paths)
+    elapsed = time.perf_counter() - start
+    results["one_file_edited"] = dict(summarize([elapsed * 1000], elapsed, 1), files_parsed=job["files_parsed"],
+                                      embedded=job["embedded"], chunks_unchanged=job["chunks_unchanged"])
+
+    copy_path = os.path.join(os.path.dirname(paths[0]), "renamed_copy.pdf")
+    shutil.copyfile(paths[1], copy_path)
+    start = time.perf_counter()
+    job = await upload(client, [copy_path])
+    elapsed = time.perf_counter() - start
+    results["renamed_copy"] = dict(summarize([elapsed * 1000], elapsed, 1), chunks=job["chunks"],
+                                   embedded=job["embedded"], chunks_collapsed=job["chunks_collapsed"])
+    return results
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return "unknown"
+
+
+async def run(args) -> dict:
+    workdir = tempfile.mkdtemp(prefix="e2e_benchmark_")
+    llm = FakeLLM(delay=args.llm_delay, answer="no, the policy does not say", token_delay=args.token_delay)
+    embeddings = HashEmbeddings(dim=args.dim, delay=args.embed_delay)
+    components.override("gemini", FakeGemini(InstrumentedLLM(llm), embeddings))
+    components.override("corpora", CorpusRegistry(embeddings, root_dir=os.path.join(workdir, "corpora")))
+    components.override("history", ChatHistory(MemoryHistoryBackend()))
+    if not args.real_reranker:
+        components.override("reranker", FakeReranker(delay=args.rerank_delay))
+
+    paths = write_corpus(os.path.join(workdir, "pdfs"), args.files, args.pages)
+    results = {"scenarios": {}}
+    await components.start()
+    try:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+            results["scenarios"]["upload"] = await scenario_upload(client, paths)
+            results["scenarios"]["chat"] = [
+                await scenario_chat(client, users, args.questions, args.cache) for users in args.users]
+            results["scenarios"]["batch"] = await scenario_batch(client, args.batch_size)
+            results["scenarios"]["reupload"] = await scenario_reupload(client, paths, args.pages)
+    finally:
+        await components.stop()
+    results["llm_calls"] = llm.calls
+    results["embedding_calls"] = embeddings.calls
+    results["peak_rss_mb"], results["peak_rss_children_mb"] = peak_rss_mb()
+    return results
+
+
+def print_report(results: dict):
+    upload_result = results["scenarios"]["upload"]
+    print(f"upload    {upload_result['files']} files, {upload_result['pages']} pages, {upload_result['chunks']} chunks "
+          f"in {upload_result['elapsed_s']}s ({upload_result['pages_per_s']} pages/s)")
+    print(f"{'users':>9} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7}")
+    for row in results["scenarios"]["chat"]:
+        print(f"{row['users']:>9} {row['throughput_per_s']:>8} {row['p50_ms']:>9} {row['p95_ms']:>9} "
+              f"{row['p99_ms']:>9} {row['errors']:>7}")
+    batch = results["scenarios"]["batch"]
+    print(f"batch     {batch['questions']} questions in {batch['elapsed_s']}s "
+          f"({batch['throughput_per_s']} answers/s, p50 {batch['p50_ms']} ms, {batch['errors']} errors)")
+    reupload = results["scenarios"]["reupload"]
+    print(f"reupload  unchanged in {reupload['unchanged']['elapsed_s']}s, "
+          f"one file edited in {reupload['one_file_edited']['elapsed_s']}s "
+          f"({reupload['one_file_edited']['embedded']} chunks embedded), "
+          f"renamed copy in {reupload['renamed_copy']['elapsed_s']}s "
+          f"({reupload['renamed_copy']['chunks_collapsed']} of {reupload['renamed_copy']['chunks']} chunks collapsed)")
+    print(f"peak RSS  {results['peak_rss_mb']} MB (parsing workers {results['peak_rss_children_mb']} MB)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=20)
+    parser.add_argument("--pages", type=int, default=10)
+    parser.add_argument("--users", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--questions", type=int, default=20, help="Questions per user")
+    parser.add_argument("--batch-size", type=int, default=100, help="Questions in the /chat/batch scenario")
+    parser.add_argument("--llm-delay", type=float, default=0.2)
+    parser.add_argument("--token-delay", type=float, default=0.0)
+    parser.add_argument("--embed-delay", type=float, default=0.05)
+    parser.add_argument("--rerank-delay", type=float, default=0.02)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--cache", action="store_true", help="Let /chat use the answer cache")
+    parser.add_argument("--real-reranker", action="store_true")
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    results.update({"revision": git_revision(), "python": platform.python_version(), "parameters": vars(args)})
+    print_report(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
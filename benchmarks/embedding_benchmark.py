@@ -0,0 +1,95 @@
+"""Measure local embedding throughput per runtime, thread count and batching strategy.
+
+Usage:
+    python benchmarks/embedding_benchmark.py --chunks 2000 --runtimes torch int8 onnx --threads 1 4
+
+For each runtime and thread count, synthetic chunks of varied length are
+embedded in one call, with length-sorted token-budgeted batches (the default)
+and with fixed batches padded to their longest member (``--unsorted``
+baseline), reporting chunks per second. Query latency is measured alone and
+with ``--concurrency`` threads embedding queries at once, which the query
+batcher coalesces into shared forward passes.
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import LocalEmbeddings
+from benchmarks.synthetic_pdf import synthetic_documents, synthetic_questions
+
+
+def synthetic_chunks(n: int, seed: int = 0):
+    """Chunks of 20 to 250 words cut from synthetic pages."""
+    rng = np.random.default_rng(seed)
+    words = " ".join(page for pages in synthetic_documents(max(1, n // 50), 10, seed) for page in pages).split()
+    chunks = []
+    for _ in range(n):
+        size = int(rng.integers(20, 250))
+        start = int(rng.integers(0, max(1, len(words) - size)))
+        chunks.append(" ".join(words[start:start + size]))
+    return chunks
+
+
+def unsorted_batches(embeddings: LocalEmbeddings, lengths):
+    """Fixed-size batches in input order: the baseline without length sorting."""
+    order = list(range(len(lengths)))
+    return [order[start:start + embeddings.batch_size] for start in range(0, len(order), embeddings.batch_size)]
+
+
+def documents_per_second(embeddings: LocalEmbeddings, chunks) -> float:
+    start = time.perf_counter()
+    embeddings.embed_documents(chunks)
+    return len(chunks) / (time.perf_counter() - start)
+
+
+def query_latency_ms(embeddings: LocalEmbeddings, questions, concurrency: int) -> float:
+    latencies = []
+
+    def ask(question):
+        start = time.perf_counter()
+        embeddings.embed_query(question)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(ask, questions))
+    return float(np.percentile(latencies, 50))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--runtimes", nargs="+", default=["torch", "int8"])
+    parser.add_argument("--threads", type=int, nargs="+", default=[0])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--unsorted", action="store_true", help="Also run the unsorted fixed-batch baseline")
+    args = parser.parse_args()
+
+    chunks = synthetic_chunks(args.chunks)
+    questions = synthetic_questions(args.queries)
+    print(f"{'runtime':>8} {'threads':>8} {'batching':>9} {'chunks/s':>10} {'query p50 ms':>13} "
+          f"{'x' + str(args.concurrency) + ' p50 ms':>13}")
+    for runtime in args.runtimes:
+        for threads in args.threads:
+            embeddings = LocalEmbeddings(runtime=runtime, threads=threads)
+            embeddings.embed_documents(chunks[:32])  # warm-up
+            variants = [("sorted", embeddings._batches)]
+            if args.unsorted:
+                variants.append(("fixed", lambda lengths, e=embeddings: unsorted_batches(e, lengths)))
+            for name, batches in variants:
+                embeddings._batches = batches
+                throughput = documents_per_second(embeddings, chunks)
+                single = query_latency_ms(embeddings, questions[:50], 1)
+                concurrent = query_latency_ms(embeddings, questions, args.concurrency)
+                print(f"{runtime:>8} {threads or 'default':>8} {name:>9} {throughput:>10.1f} {single:>13.1f} "
+                      f"{concurrent:>13.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""Deterministic local stand-ins for the external services used by the API."""
+import asyncio
+import hashlib
+import re
+import time
+from typing import List, Dict, Optional
+
+import numpy as np
+from langchain.schema import Document
+from langchain.schema.embeddings import Embeddings
+
+
+class FakeMessage:
+    def __init__(self, content: str):
+        self.content = content
+
+
+class FakeLLM:
+    """Chat model stand-in that sleeps for ``delay`` seconds per call.
+
+    ``astream`` waits ``delay`` before the first token and ``token_delay``
+    between tokens, like a hosted model streaming its answer.
+    """
+
+    def __init__(self, delay: float = 0.2, answer: str = "no", token_delay: float = 0.0):
+        self.delay = delay
+        self.answer = answer
+        self.token_delay = token_delay
+        self.calls = 0
+
+    def _respond(self, prompt: str) -> FakeMessage:
+        self.calls += 1
+        return FakeMessage("{}" if "Metadata (JSON)" in prompt else self.answer)
+
+    def invoke(self, prompt: str) -> FakeMessage:
+        time.sleep(self.delay)
+        return self._respond(prompt)
+
+    async def ainvoke(self, prompt: str) -> FakeMessage:
+        message = self._respond(prompt)
+        await asyncio.sleep(self.delay + self.token_delay * message.content.count(" "))
+        return message
+
+    async def astream(self, prompt: str):
+        await asyncio.sleep(self.delay)
+        for i, token in enumerate(self._respond(prompt).content.split(" ")):
+            if i:
+                await asyncio.sleep(self.token_delay)
+            yield FakeMessage(token if i == 0 else " " + token)
+
+
+class ResourceExhausted(Exception):
+    """Same name as the quota error Google's client raises, so schedulers treat it alike."""
+
+
+class QuotaLLM(FakeLLM):
+    """``FakeLLM`` that enforces a provider-style quota.
+
+    More than ``requests_per_second`` calls started within one second, or more
+    than ``max_concurrency`` calls in flight, fail with ``ResourceExhausted``.
+    """
+
+    def __init__(self, requests_per_second: int, max_concurrency: int, delay: float = 0.2, answer: str = "no"):
+        super().__init__(delay=delay, answer=answer)
+        self.requests_per_second = requests_per_second
+        self.max_concurrency = max_concurrency
+        self.started: List[float] = []
+        self.in_flight = 0
+        self.rejected = 0
+
+    def _admit(self):
+        now = time.monotonic()
+        self.started = [t for t in self.started if now - t < 1.0]
+        if len(self.started) >= self.requests_per_second or self.in_flight >= self.max_concurrency:
+            self.rejected += 1
+            raise ResourceExhausted("429 Resource has been exhausted (e.g. check quota).")
+        self.started.append(now)
+
+    async def ainvoke(self, prompt: str) -> FakeMessage:
+        self._admit()
+        self.in_flight += 1
+        try:
+            return await super().ainvoke(prompt)
+        finally:
+            self.in_flight -= 1
+
+
+class FakeRetriever:
+    def __init__(self, documents: List[Document], delay: float = 0.01):
+        self.documents = documents
+        self.delay = delay
+
+    def retrieve(self, query: str, top_k: int = 5, filters: Optional[Dict] = None) -> List[Document]:
+        time.sleep(self.delay)
+        return self.documents[:top_k]
+
+
+class FakeReranker:
+    def __init__(self, delay: float = 0.02):
+        self.delay = delay
+
+    def rerank(self, query: str, documents: List[Document], top_n: int = 3) -> List[Document]:
+        time.sleep(self.delay)
+        return documents[:top_n]
+
+    def rerank_batch(self, queries: List[str], document_lists: List[List[Document]],
+                     top_n: int = 3) -> List[List[Document]]:
+        time.sleep(self.delay)
+        return [documents[:top_n] for documents in document_lists]
+
+
+class HashEmbeddings(Embeddings):
+    """Deterministic bag-of-words embedder: each token is hashed into one of ``dim`` signed buckets.
+
+    Texts sharing words get similar vectors, which is enough for retrieval to
+    behave realistically without a model or network. ``delay`` is charged per
+    call to mimic a remote embedding API.
+    """
+
+    _TOKEN = re.compile(r"\w+")
+
+    def __init__(self, dim: int = 256, delay: float = 0.0):
+        self.dim = dim
+        self.delay = delay
+        self.calls = 0
+
+    def _embed(self, text: str) -> List[float]:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for token in self._TOKEN.findall(text.lower()):
+            digest = int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "little")
+            vector[digest % self.dim] += 1.0 if digest & (1 << 63) else -1.0
+        return (vector / max(float(np.linalg.norm(vector)), 1e-12)).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls += 1
+        time.sleep(self.delay)
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        self.calls += 1
+        time.sleep(self.delay)
+        return self._embed(text)
+
+
+class FakeGemini:
+    """Stand-in for ``GeminiModel``: the same ``llm`` and ``embeddings`` attributes, no network."""
+
+    def __init__(self, llm, embeddings: Embeddings):
+        self.llm = llm
+        self.embeddings = embeddings
@@ -0,0 +1,72 @@
+"""Recall@k vs latency of HierarchicalIndex (IVF) against brute-force search.
+
+Usage:
+    python benchmarks/ivf_benchmark.py --chunks 100000 --dim 768 --nprobe 1 2 4 8 16 32
+
+Vectors are drawn from a Gaussian mixture so they cluster the way real
+embeddings do; brute force is an exact dot product over the full matrix.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain.schema import Document
+from retrieval import HierarchicalIndex, _normalize
+
+
+def synthetic_embeddings(n: int, dim: int, n_topics: int = 200, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    topics = rng.normal(size=(n_topics, dim)).astype(np.float32)
+    vectors = topics[rng.integers(0, n_topics, size=n)] + 2.0 * rng.normal(size=(n, dim)).astype(np.float32)
+    return _normalize(vectors)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--n-clusters", type=int, default=0)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    args = parser.parse_args()
+
+    vectors = synthetic_embeddings(args.chunks + args.queries, args.dim)
+    corpus, queries = vectors[:args.chunks], vectors[args.chunks:]
+    documents = [Document(page_content=str(i)) for i in range(args.chunks)]
+
+    start = time.perf_counter()
+    index = HierarchicalIndex(documents, embedding_model=None, n_clusters=args.n_clusters, embeddings=corpus)
+    print(f"built {len(index.centroids)} clusters in {time.perf_counter() - start:.1f}s")
+    with tempfile.TemporaryDirectory() as path:
+        index.save(path)
+        index = HierarchicalIndex.load(path, embedding_model=None)
+
+        exact, brute_ms = [], []
+        for query in queries:
+            start = time.perf_counter()
+            scores = corpus @ query
+            exact.append(set(np.argpartition(-scores, args.k - 1)[:args.k].tolist()))
+            brute_ms.append((time.perf_counter() - start) * 1000)
+        print(f"{'search':>12} {'recall@' + str(args.k):>10} {'p50 ms':>8} {'p99 ms':>8}")
+        print(f"{'brute force':>12} {1.0:>10.3f} {np.percentile(brute_ms, 50):>8.2f} {np.percentile(brute_ms, 99):>8.2f}")
+
+        for nprobe in args.nprobe:
+            recalls, latencies = [], []
+            for query, truth in zip(queries, exact):
+                start = time.perf_counter()
+                hits = index.search_by_vector(query, k=args.k, nprobe=nprobe)
+                latencies.append((time.perf_counter() - start) * 1000)
+                recalls.append(len(truth & {i for i, _ in hits}) / args.k)
+            print(f"{'nprobe=' + str(nprobe):>12} {np.mean(recalls):>10.3f} "
+                  f"{np.percentile(latencies, 50):>8.2f} {np.percentile(latencies, 99):>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""Compare /chat pipeline latency: sequential blocking calls vs QueryPipeline.
+
+Usage:
+    python benchmarks/pipeline_benchmark.py --llm-delay 0.3 --requests 50 --concurrency 10
+
+Both variants use the same fake LLM, retriever and reranker, so the numbers only
+reflect how the calls are scheduled, not network or model cost.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain.schema import Document
+from pipeline import QueryPipeline
+from prompts import AdvancedPrompts
+from benchmarks.fakes import FakeLLM, FakeRetriever, FakeReranker
+
+HISTORY = [{"role": "user", "content": "What is the review cycle?"}, {"role": "assistant", "content": "Yearly."}]
+QUESTION = "How are promotions decided?"
+
+
+async def sequential_chat(llm, retriever, reranker):
+    """The pre-pipeline /chat flow: five blocking LLM calls in a row."""
+    llm.invoke(AdvancedPrompts.can_answer_from_history_prompt(QUESTION, HISTORY))
+    enhanced_query = AdvancedPrompts.enhance_query_with_history_prompt(QUESTION, HISTORY)
+    llm.invoke(enhanced_query)
+    rewritten = llm.invoke(AdvancedPrompts.retrieval_prompt(enhanced_query)).content
+    query = llm.invoke(AdvancedPrompts.metadata_filter_prompt(rewritten, {})).content
+    documents = reranker.rerank(query, retriever.retrieve(query))
+    llm.invoke(AdvancedPrompts.generation_prompt("\n\n".join(d.page_content for d in documents), QUESTION))
+
+
+async def pipeline_chat(llm, retriever, reranker):
+    await QueryPipeline(llm, retriever, reranker).run(QUESTION, HISTORY)
+
+
+async def load(variant, n_requests, concurrency, llm, retriever, reranker):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one():
+        async with semaphore:
+            start = time.perf_counter()
+            await variant(llm, retriever, reranker)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(n_requests)))
+    return latencies, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--llm-delay", type=float, default=0.3)
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=10)
+    args = parser.parse_args()
+
+    documents = [Document(page_content=f"chunk {i}", metadata={"source": "synthetic"}) for i in range(10)]
+    print(f"{'variant':>12} {'p50 ms':>10} {'p99 ms':>10} {'req/s':>8}")
+    for name, variant in (("sequential", sequential_chat), ("pipeline", pipeline_chat)):
+        llm = FakeLLM(delay=args.llm_delay)
+        latencies, elapsed = asyncio.run(
+            load(variant, args.requests, args.concurrency, llm, FakeRetriever(documents), FakeReranker()))
+        print(f"{name:>12} {np.percentile(latencies, 50):>10.0f} {np.percentile(latencies, 99):>10.0f} "
+              f"{args.requests / elapsed:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
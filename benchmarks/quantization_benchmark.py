@@ -0,0 +1,73 @@
+"""Memory per million chunks and recall@k of quantized dense search against exact float32 search.
+
+Usage:
+    python benchmarks/quantization_benchmark.py --chunks 200000 --dim 384 --rescore 2 4 8 16
+
+The float32 matrix is saved and memory-mapped the way snapshots store it.
+"scan MB/1M" is the size of the arrays read by the full first-pass scan per
+million chunks, which is what has to stay resident for fast queries; the
+float32 rows are only read for the rescored shortlist. Vectors are drawn from
+a Gaussian mixture so they cluster the way real embeddings do.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain.schema import Document
+from retrieval import DenseIndex, QuantizedDenseIndex, quantize_vectors
+from benchmarks.ivf_benchmark import synthetic_embeddings
+
+
+def measure(index, queries, k: int, exact):
+    recalls, latencies = [], []
+    for query, truth in zip(queries, exact):
+        start = time.perf_counter()
+        hits = index.search_by_vector(query, k=k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        recalls.append(len(truth & {i for i, _ in hits}) / k)
+    return np.mean(recalls), np.percentile(latencies, 50), np.percentile(latencies, 99)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=200000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--methods", nargs="+", default=["int8", "binary"])
+    parser.add_argument("--rescore", type=int, nargs="+", default=[2, 4, 8, 16])
+    args = parser.parse_args()
+
+    vectors = synthetic_embeddings(args.chunks + args.queries, args.dim)
+    corpus, queries = vectors[:args.chunks], vectors[args.chunks:]
+    documents = [Document(page_content=str(i)) for i in range(args.chunks)]
+    per_million = 1e6 / args.chunks / 2 ** 20
+
+    with tempfile.TemporaryDirectory() as path:
+        np.save(os.path.join(path, "embeddings.npy"), corpus)
+        mapped = np.load(os.path.join(path, "embeddings.npy"), mmap_mode="r")
+        baseline = DenseIndex(documents, mapped, embedding_model=None)
+        exact = [{i for i, _ in baseline.search_by_vector(query, args.k)} for query in queries]
+
+        print(f"{'index':>16} {'scan MB/1M':>11} {'recall@' + str(args.k):>10} {'p50 ms':>8} {'p99 ms':>8}")
+        recall, p50, p99 = measure(baseline, queries, args.k, exact)
+        print(f"{'float32':>16} {corpus.nbytes * per_million:>11.0f} {recall:>10.3f} {p50:>8.2f} {p99:>8.2f}")
+        for method in args.methods:
+            quantized = quantize_vectors(corpus, method)
+            scan_bytes = sum(array.nbytes for array in quantized.values())
+            for rescore in args.rescore:
+                index = QuantizedDenseIndex(documents, mapped, quantized["codes"], quantized.get("scale"),
+                                            embedding_model=None, rescore=rescore)
+                recall, p50, p99 = measure(index, queries, args.k, exact)
+                print(f"{method + ' x' + str(rescore):>16} {scan_bytes * per_million:>11.0f} {recall:>10.3f} "
+                      f"{p50:>8.2f} {p99:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""Compare reranking latency: per-request load vs the shared, batched reranker.
+
+Usage:
+    python benchmarks/reranker_benchmark.py --candidates 10 50 --backends torch int8 onnx
+
+The baseline reproduces the old /chat behaviour: construct ``Reranker`` on every
+request and score all pairs in one padded forward pass with autograd enabled.
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from transformers import AutoTokenizer, AutoModelForSequenceClassification
+from langchain.schema import Document
+from config_file import Configuration
+from retrieval import Reranker
+
+
+def synthetic_candidates(n: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    words = ["career", "talent", "review", "promotion", "manager", "skills", "goal", "team", "policy", "training"]
+    return [
+        Document(page_content=" ".join(rng.choice(words, size=int(rng.integers(20, 200)))))
+        for _ in range(n)
+    ]
+
+
+def legacy_rerank(query, documents, top_n):
+    tokenizer = AutoTokenizer.from_pretrained(Configuration.RERANKER_MODEL)
+    model = AutoModelForSequenceClassification.from_pretrained(Configuration.RERANKER_MODEL)
+    features = tokenizer([(query, doc.page_content) for doc in documents], padding=True, truncation=True, return_tensors="pt")
+    scores = model(**features).logits
+    return [documents[i] for i in scores.argsort(descending=True)[:top_n]]
+
+
+def measure(fn, repeats):
+    latencies = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return float(np.percentile(latencies, 50)), float(np.percentile(latencies, 99))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--candidates", type=int, nargs="+", default=[10, 50])
+    parser.add_argument("--backends", nargs="+", default=["torch", "int8"])
+    parser.add_argument("--repeats", type=int, default=10)
+    parser.add_argument("--legacy-repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    query = "How are promotions decided for team managers?"
+    print(f"{'variant':>16} {'candidates':>10} {'p50 ms':>10} {'p99 ms':>10}")
+    for n in args.candidates:
+        documents = synthetic_candidates(n)
+        p50, p99 = measure(lambda: legacy_rerank(query, documents, Configuration.TOP_N), args.legacy_repeats)
+        print(f"{'legacy':>16} {n:>10} {p50:>10.1f} {p99:>10.1f}")
+        for backend in args.backends:
+            reranker = Reranker(backend=backend)
+            reranker.rerank(query, documents)  # warm-up
+            p50, p99 = measure(lambda: reranker.rerank(query, documents), args.repeats)
+            print(f"{'shared-' + backend:>16} {n:>10} {p50:>10.1f} {p99:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
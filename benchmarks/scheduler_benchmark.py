@@ -0,0 +1,89 @@
+"""Burst of chat requests against a quota-limited fake LLM, with and without the request scheduler.
+
+Usage:
+    python benchmarks/scheduler_benchmark.py --requests 300 --distinct 30 --quota 50 --provider-concurrency 20
+
+Each simulated request makes the two LLM calls of a /chat with query
+rewriting: a ``retrieval_prompt`` rewrite of its question, drawn from
+``--distinct`` questions so concurrent requests repeat it, and a generation
+call with its own context. ``QuotaLLM`` refuses calls beyond ``--quota`` per
+second or ``--provider-concurrency`` in flight, as a hosted API does.
+
+"direct" sends every call straight to the model, as before the scheduler;
+"scheduled" goes through ``ScheduledLLM``. Requests rejected by the scheduler
+are what the API returns as 429; "errors" are provider refusals that would
+surface as 500s.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from metrics import InstrumentedLLM, SCHEDULER_COALESCED
+from prompts import AdvancedPrompts
+from scheduler import RequestScheduler, ScheduledLLM, SchedulerOverloaded
+from benchmarks.fakes import QuotaLLM
+from benchmarks.synthetic_pdf import synthetic_questions
+
+
+async def simulated_request(llm, question: str, context: str) -> float:
+    start = time.perf_counter()
+    rewritten = (await llm.ainvoke(AdvancedPrompts.retrieval_prompt(question))).content
+    await llm.ainvoke(AdvancedPrompts.generation_prompt(context, rewritten + " " + question))
+    return (time.perf_counter() - start) * 1000
+
+
+async def burst(llm, questions, spread: float):
+    """Start one request per question, spread uniformly over ``spread`` seconds."""
+    async def delayed(i, question):
+        await asyncio.sleep(spread * i / len(questions))
+        return await simulated_request(llm, question, f"context for request {i}")
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(delayed(i, q) for i, q in enumerate(questions)), return_exceptions=True)
+    return results, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--distinct", type=int, default=30, help="Distinct questions in the burst")
+    parser.add_argument("--spread", type=float, default=1.0, help="Seconds over which the burst arrives")
+    parser.add_argument("--llm-delay", type=float, default=0.2)
+    parser.add_argument("--quota", type=int, default=50, help="Provider calls allowed per second")
+    parser.add_argument("--provider-concurrency", type=int, default=20)
+    parser.add_argument("--max-concurrency", type=int, default=16)
+    parser.add_argument("--max-queue", type=int, default=400)
+    parser.add_argument("--retries", type=int, default=3)
+    args = parser.parse_args()
+
+    pool = synthetic_questions(args.distinct)
+    questions = [pool[i % len(pool)] for i in range(args.requests)]
+
+    print(f"{'mode':>10} {'ok':>5} {'429':>5} {'errors':>7} {'calls':>6} {'refused':>8} {'coalesced':>10} "
+          f"{'p50 ms':>8} {'p99 ms':>8} {'wall s':>7}")
+    for mode in ("direct", "scheduled"):
+        provider = QuotaLLM(args.quota, args.provider_concurrency, delay=args.llm_delay)
+        llm = InstrumentedLLM(provider)
+        if mode == "scheduled":
+            scheduler = RequestScheduler("benchmark", args.max_concurrency, args.max_queue,
+                                         requests_per_minute=args.quota * 60 * 0.9, burst=args.max_concurrency,
+                                         max_retries=args.retries, backoff=0.25, backoff_max=2.0)
+            llm = ScheduledLLM(llm, scheduler)
+        results, wall = asyncio.run(burst(llm, questions, args.spread))
+        latencies = [r for r in results if isinstance(r, float)]
+        rejected = sum(isinstance(r, SchedulerOverloaded) for r in results)
+        errors = len(results) - len(latencies) - rejected
+        coalesced = SCHEDULER_COALESCED.value(scheduler="benchmark") if mode == "scheduled" else 0
+        p50, p99 = (np.percentile(latencies, 50), np.percentile(latencies, 99)) if latencies else (0.0, 0.0)
+        print(f"{mode:>10} {len(latencies):>5} {rejected:>5} {errors:>7} {provider.calls:>6} {provider.rejected:>8} "
+              f"{coalesced:>10.0f} {p50:>8.0f} {p99:>8.0f} {wall:>7.1f}")
+
+
+if __name__ == "__main__":
+    main()
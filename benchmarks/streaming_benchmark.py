@@ -0,0 +1,64 @@
+"""Compare time-to-first-token of QueryPipeline.stream with time-to-answer of QueryPipeline.run.
+
+Usage:
+    python benchmarks/streaming_benchmark.py --llm-delay 0.3 --token-delay 0.02 --tokens 200
+
+The fake LLM waits ``--llm-delay`` before its first token and ``--token-delay``
+between tokens, so ``run`` pays for the whole answer before returning while
+``stream`` hands the first token over as soon as it is produced.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain.schema import Document
+from pipeline import QueryPipeline
+from benchmarks.fakes import FakeLLM, FakeRetriever, FakeReranker
+
+HISTORY = [{"role": "user", "content": "What is the review cycle?"}, {"role": "assistant", "content": "Yearly."}]
+QUESTION = "How are promotions decided?"
+
+
+async def measure_run(pipeline):
+    start = time.perf_counter()
+    await pipeline.run(QUESTION, HISTORY)
+    elapsed = (time.perf_counter() - start) * 1000
+    return elapsed, elapsed
+
+
+async def measure_stream(pipeline):
+    start = time.perf_counter()
+    first_token = None
+    async for event, _ in pipeline.stream(QUESTION, HISTORY):
+        if event == "token" and first_token is None:
+            first_token = (time.perf_counter() - start) * 1000
+    return first_token, (time.perf_counter() - start) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--llm-delay", type=float, default=0.3)
+    parser.add_argument("--token-delay", type=float, default=0.02)
+    parser.add_argument("--tokens", type=int, default=200)
+    parser.add_argument("--requests", type=int, default=10)
+    args = parser.parse_args()
+
+    documents = [Document(page_content=f"chunk {i}", metadata={"source": "synthetic"}) for i in range(10)]
+    answer = " ".join(f"token{i}" for i in range(args.tokens))
+    print(f"{'variant':>8} {'first token p50 ms':>19} {'complete p50 ms':>16}")
+    for name, measure in (("run", measure_run), ("stream", measure_stream)):
+        llm = FakeLLM(delay=args.llm_delay, answer=answer, token_delay=args.token_delay)
+        pipeline = QueryPipeline(llm, FakeRetriever(documents), FakeReranker())
+        rows = [asyncio.run(measure(pipeline)) for _ in range(args.requests)]
+        first_token, complete = zip(*rows)
+        print(f"{name:>8} {np.percentile(first_token, 50):>19.0f} {np.percentile(complete, 50):>16.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""Deterministic synthetic PDF corpus for benchmarks.
+
+The PDFs are written by hand (one Helvetica text stream per page), so no PDF
+library is needed to create them and pypdf extracts exactly the generated text.
+"""
+import os
+from typing import List
+
+import numpy as np
+
+TOPICS = ["onboarding", "performance review", "promotion", "compensation", "training", "mentoring",
+          "succession planning", "leadership", "feedback", "career path", "retention", "recruiting"]
+WORDS = ["employee", "manager", "team", "goal", "skill", "quarter", "objective", "policy", "process", "role",
+         "growth", "plan", "budget", "review", "criteria", "level", "competency", "program", "session", "outcome",
+         "report", "survey", "benchmark", "calibration", "rating", "cycle", "promotion", "bonus", "salary", "coach"]
+LINE_WIDTH = 90
+LINES_PER_PAGE = 60
+
+
+def _escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def _wrap(text: str) -> List[str]:
+    lines, line = [], ""
+    for word in text.split():
+        if line and len(line) + 1 + len(word) > LINE_WIDTH:
+            lines.append(line)
+            line = word
+        else:
+            line = f"{line} {word}" if line else word
+    if line:
+        lines.append(line)
+    return lines
+
+
+def make_pdf(pages: List[str]) -> bytes:
+    """Build a minimal valid PDF with one page per string."""
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_ids = []
+    for text in pages:
+        lines = _wrap(text)[:LINES_PER_PAGE]
+        stream = "BT /F1 10 Tf 12 TL 40 800 Td " + " ".join(f"({_escape(line)}) '" for line in lines) + " ET"
+        stream = stream.encode("latin-1", errors="replace")
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        content_id = len(objects)
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                       b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_id)
+        page_ids.append(len(objects))
+    kids = " ".join(f"{page_id} 0 R" for page_id in page_ids).encode()
+    objects[1] = b"<< /Type /Pages /Kids [" + kids + b"] /Count %d >>" % len(page_ids)
+
+    output = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(output)
+    output += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    output += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    output += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(output)
+
+
+def synthetic_page(rng: np.random.Generator, topic: str, words: int = 400) -> str:
+    """A page of pseudo-prose about ``topic``; word frequencies are Zipf-like."""
+    ranks = np.minimum(rng.zipf(1.3, size=words), len(WORDS)) - 1
+    sentences, sentence = [], []
+    for rank in ranks:
+        sentence.append(WORDS[rank])
+        if len(sentence) >= 12:
+            sentences.append(f"The {topic} " + " ".join(sentence) + ".")
+            sentence = []
+    return " ".join(sentences)
+
+
+def synthetic_documents(n_files: int, pages_per_file: int, seed: int = 0) -> List[List[str]]:
+    """Page texts for ``n_files`` documents, each centred on one topic."""
+    rng = np.random.default_rng(seed)
+    return [[synthetic_page(rng, TOPICS[i % len(TOPICS)]) for _ in range(pages_per_file)] for i in range(n_files)]
+
+
+def write_corpus(directory: str, n_files: int, pages_per_file: int, seed: int = 0) -> List[str]:
+    """Write the synthetic corpus as PDFs and return their paths."""
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for i, pages in enumerate(synthetic_documents(n_files, pages_per_file, seed)):
+        path = os.path.join(directory, f"synthetic_{i:04d}.pdf")
+        with open(path, "wb") as f:
+            f.write(make_pdf(pages))
+        paths.append(path)
+    return paths
+
+
+def synthetic_questions(n: int, seed: int = 1) -> List[str]:
+    rng = np.random.default_rng(seed)
+    return [f"What does the {TOPICS[rng.integers(len(TOPICS))]} {WORDS[rng.integers(len(WORDS))]} policy say "
+            f"about {WORDS[rng.integers(len(WORDS))]}?" for _ in range(n)]
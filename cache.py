@@ -0,0 +1,286 @@
+import asyncio
+import hashlib
+import inspect
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Hashable, List, Dict, Optional, Tuple
+import numpy as np
+from langchain.schema.embeddings import Embeddings
+from utils import logger
+from metrics import CACHE_LOOKUPS
+
+
+def embedding_key(model_name: str, kind: str, text: str) -> str:
+    """Cache key for an embedding: hash of model, embedding kind and text."""
+    return hashlib.sha256(f"{model_name}\0{kind}\0{text}".encode("utf-8")).hexdigest()
+
+
+def embed_queries(embeddings: Embeddings, texts: List[str]) -> List[List[float]]:
+    """Embed ``texts`` as queries, in one batched request when the model supports it."""
+    if hasattr(embeddings, "embed_queries"):
+        return embeddings.embed_queries(texts)
+    if "task_type" in inspect.signature(embeddings.embed_documents).parameters:
+        # Gemini embeds queries and documents differently; ask for query embeddings in a single batch
+        return embeddings.embed_documents(texts, task_type="retrieval_query")
+    return [embeddings.embed_query(text) for text in texts]
+
+
+class LRUEmbeddingCache:
+    """In-memory LRU tier."""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        found = {}
+        with self._lock:
+            for key in keys:
+                vector = self._entries.get(key)
+                if vector is not None:
+                    self._entries.move_to_end(key)
+                    found[key] = vector
+        return found
+
+    def put_many(self, entries: Dict[str, List[float]]):
+        with self._lock:
+            for key, vector in entries.items():
+                self._entries[key] = vector
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+
+class SQLiteEmbeddingCache:
+    """Persistent tier storing float32 vectors as blobs in SQLite."""
+
+    _BATCH = 500  # Stay well below SQLite's bound-parameter limit
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+        self._lock = threading.Lock()
+
+    def get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), self._BATCH):
+                batch = keys[start:start + self._BATCH]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+        return found
+
+    def put_many(self, entries: Dict[str, List[float]]):
+        rows = [(key, np.asarray(vector, dtype=np.float32).tobytes()) for key, vector in entries.items()]
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)", rows)
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that serves repeated texts from an LRU and a persistent cache.
+
+    Lookups go memory -> disk -> model; only texts missing from both tiers are
+    sent to the wrapped model, in a single batched call.
+    """
+
+    def __init__(self, embeddings: Embeddings, model_name: str, memory_size: int = 10000,
+                 store: Optional[SQLiteEmbeddingCache] = None):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.memory = LRUEmbeddingCache(memory_size)
+        self.store = store
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+
+    def _lookup(self, keys: List[str]) -> Dict[str, List[float]]:
+        found = self.memory.get_many(keys)
+        memory_hits = len(found)
+        disk_hits = 0
+        if self.store is not None and len(found) < len(set(keys)):
+            from_disk = self.store.get_many([key for key in set(keys) if key not in found])
+            disk_hits = len(from_disk)
+            self.memory.put_many(from_disk)
+            found.update(from_disk)
+        with self._stats_lock:
+            self.memory_hits += memory_hits
+            self.disk_hits += disk_hits
+        CACHE_LOOKUPS.inc(memory_hits, cache="embedding", result="memory")
+        CACHE_LOOKUPS.inc(disk_hits, cache="embedding", result="disk")
+        return found
+
+    def _store(self, entries: Dict[str, List[float]]):
+        self.memory.put_many(entries)
+        if self.store is not None:
+            try:
+                self.store.put_many(entries)
+            except Exception as e:
+                logger.error(f"Error writing embedding cache: {e}")
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [embedding_key(self.model_name, "document", text) for text in texts]
+        found = self._lookup(keys)
+        missing = {key: text for key, text in zip(keys, texts) if key not in found}
+        if missing:
+            with self._stats_lock:
+                self.misses += len(missing)
+            CACHE_LOOKUPS.inc(len(missing), cache="embedding", result="miss")
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            computed = dict(zip(missing.keys(), vectors))
+            self._store(computed)
+            found.update(computed)
+        return [found[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        key = embedding_key(self.model_name, "query", text)
+        found = self._lookup([key])
+        if key in found:
+            return found[key]
+        with self._stats_lock:
+            self.misses += 1
+        CACHE_LOOKUPS.inc(cache="embedding", result="miss")
+        vector = self.embeddings.embed_query(text)
+        self._store({key: vector})
+        return vector
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """Embed many queries with one cache lookup and at most one model call."""
+        keys = [embedding_key(self.model_name, "query", text) for text in texts]
+        found = self._lookup(keys)
+        missing = {key: text for key, text in zip(keys, texts) if key not in found}
+        if missing:
+            with self._stats_lock:
+                self.misses += len(missing)
+            CACHE_LOOKUPS.inc(len(missing), cache="embedding", result="miss")
+            computed = dict(zip(missing.keys(), embed_queries(self.embeddings, list(missing.values()))))
+            self._store(computed)
+            found.update(computed)
+        return [found[key] for key in keys]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await asyncio.to_thread(self.embed_documents, texts)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return await asyncio.to_thread(self.embed_query, text)
+
+    def stats(self) -> Dict[str, int]:
+        """Hit/miss counters since process start."""
+        return {"memory_hits": self.memory_hits, "disk_hits": self.disk_hits, "misses": self.misses}
+
+
+@dataclass
+class _AnswerEntry:
+    value: Any
+    vector: Optional[np.ndarray]
+    expires_at: float
+
+
+class AnswerCache:
+    """Cache of final answers, keyed by a caller-defined scope and the question.
+
+    Lookups try an exact match on the normalised question first, then (if an
+    embedding model is configured) the most similar cached question in the same
+    scope above ``similarity_threshold``; if embedding the question fails, the
+    lookup is a miss. Entries expire after ``ttl`` seconds and the least
+    recently used are evicted beyond ``max_entries``.
+    """
+
+    _PUNCTUATION = re.compile(r"[^\w\s]")
+    _WHITESPACE = re.compile(r"\s+")
+
+    def __init__(self, embeddings: Optional[Embeddings] = None, max_entries: int = 1000, ttl: float = 3600,
+                 similarity_threshold: float = 0.95):
+        self.embeddings = embeddings
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self._entries: "OrderedDict[Tuple[Hashable, str], _AnswerEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    @classmethod
+    def normalize(cls, question: str) -> str:
+        """Lowercase, drop punctuation and collapse whitespace."""
+        return cls._WHITESPACE.sub(" ", cls._PUNCTUATION.sub(" ", question.lower())).strip()
+
+    def _embed(self, normalized: str) -> Optional[np.ndarray]:
+        """Normalised question embedding, or None if there is no model or it failed (e.g. out of quota)."""
+        if self.embeddings is None:
+            return None
+        try:
+            vector = np.asarray(self.embeddings.embed_query(normalized), dtype=np.float32)
+        except Exception as e:
+            logger.warning(f"Answer cache skipping semantic lookup: {e}")
+            return None
+        return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+    def get(self, scope: Hashable, question: str) -> Optional[Any]:
+        """Return the cached value for ``question`` in ``scope``, or None."""
+        normalized = self.normalize(question)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get((scope, normalized))
+            if entry is not None and entry.expires_at > now:
+                self._entries.move_to_end((scope, normalized))
+                self.exact_hits += 1
+                CACHE_LOOKUPS.inc(cache="answer", result="exact")
+                return entry.value
+        vector = self._embed(normalized)
+        if vector is not None:
+            with self._lock:
+                candidates = [(key, entry) for key, entry in self._entries.items()
+                              if key[0] == scope and entry.vector is not None and entry.expires_at > now]
+                if candidates:
+                    similarities = np.stack([entry.vector for _, entry in candidates]) @ vector
+                    best = int(np.argmax(similarities))
+                    if similarities[best] >= self.similarity_threshold:
+                        key, entry = candidates[best]
+                        self._entries.move_to_end(key)
+                        self.semantic_hits += 1
+                        CACHE_LOOKUPS.inc(cache="answer", result="semantic")
+                        return entry.value
+        with self._lock:
+            self.misses += 1
+        CACHE_LOOKUPS.inc(cache="answer", result="miss")
+        return None
+
+    def put(self, scope: Hashable, question: str, value: Any):
+        normalized = self.normalize(question)
+        entry = _AnswerEntry(value=value, vector=self._embed(normalized), expires_at=time.time() + self.ttl)
+        with self._lock:
+            self._entries[(scope, normalized)] = entry
+            self._entries.move_to_end((scope, normalized))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, predicate: Callable[[Hashable], bool]):
+        """Drop every entry whose scope matches ``predicate``."""
+        with self._lock:
+            for key in [key for key in self._entries if predicate(key[0])]:
+                del self._entries[key]
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.exact_hits + self.semantic_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "exact_hits": self.exact_hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "hit_rate": (self.exact_hits + self.semantic_hits) / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,134 @@
+import asyncio
+import threading
+import time
+from typing import Callable, Dict, Optional
+from config_file import Configuration
+from utils import logger
+
+
+class Components:
+    """Process-wide services, created on first use or by the startup warm-up.
+
+    Nothing expensive happens at import time: model clients, the corpus
+    registry and the reranker are built the first time a request needs them,
+    or ahead of time by ``warm_up`` running in the background after startup.
+    The process is live as soon as it can answer HTTP, and ready once the
+    warm-up has finished.
+
+    Each component is built under its own lock, so loading the reranker does
+    not hold up a request that only needs the model clients. Async code
+    resolves components with ``aget``, which builds them in a worker thread
+    instead of blocking the event loop.
+    """
+
+    def __init__(self):
+        self._instances: Dict[str, object] = {}
+        self._locks: Dict[str, threading.Lock] = {}  # One per component, held while it is built
+        self._lock = threading.Lock()  # Guards the two dicts above
+        self._warmup: Optional[asyncio.Task] = None
+        self.started_at = time.time()
+        self.ready = False
+        self.warmup_error: Optional[str] = None
+        self.timings: Dict[str, float] = {}
+
+    def _get(self, name: str, factory: Callable[[], object]):
+        instance = self._instances.get(name)
+        if instance is None:
+            with self._lock:
+                lock = self._locks.setdefault(name, threading.Lock())
+            with lock:
+                instance = self._instances.get(name)
+                if instance is None:
+                    start = time.perf_counter()
+                    instance = factory()
+                    self.timings[name] = round((time.perf_counter() - start) * 1000, 2)
+                    with self._lock:
+                        self._instances[name] = instance
+        return instance
+
+    async def aget(self, name: str):
+        """Component ``name``; if it is not built yet, it is built (or waited for) in a worker thread."""
+        instance = self._instances.get(name)
+        if instance is None:
+            instance = await asyncio.to_thread(getattr, self, name)
+        return instance
+
+    def override(self, name: str, instance):
+        """Install ``instance`` in place of a lazily built component, e.g. a local stand-in."""
+        with self._lock:
+            self._instances[name] = instance
+
+    @property
+    def gemini(self):
+        from models import GeminiModel
+        return self._get("gemini", GeminiModel.get_instance)
+
+    @property
+    def corpora(self):
+        from corpus import CorpusRegistry
+        return self._get("corpora", lambda: CorpusRegistry(self.gemini.embeddings))
+
+    @property
+    def ingestion(self):
+        from ingestion import IngestionManager
+        return self._get("ingestion", IngestionManager)
+
+    @property
+    def history(self):
+        from history import ChatHistory, create_history_backend
+        return self._get("history", lambda: ChatHistory(create_history_backend()))
+
+    @property
+    def answer_cache(self):
+        from cache import AnswerCache
+        return self._get("answer_cache", lambda: AnswerCache(
+            self.gemini.embeddings,
+            max_entries=Configuration.ANSWER_CACHE_SIZE,
+            ttl=Configuration.ANSWER_CACHE_TTL,
+            similarity_threshold=Configuration.ANSWER_CACHE_SIMILARITY,
+        ))
+
+    @property
+    def reranker(self):
+        from retrieval import Reranker
+        return self._get("reranker", Reranker.get_instance)
+
+    def warm_up(self):
+        """Build the heavy components and reopen persisted corpora."""
+        self.corpora.preload(Configuration.STARTUP_PRELOAD_CORPORA)
+        # Touch the remaining lazy components so no request has to build them
+        _ = self.ingestion
+        _ = self.answer_cache
+        _ = self.reranker
+
+    async def _run_warm_up(self):
+        try:
+            await asyncio.to_thread(self.warm_up)
+            self.ready = True
+            logger.info(f"Warm-up finished in {round(time.time() - self.started_at, 2)}s: {self.timings}")
+        except Exception as e:
+            self.warmup_error = str(e)
+            logger.error(f"Warm-up failed: {e}")
+
+    async def start(self):
+        await self.history.start()
+        if Configuration.STARTUP_WARMUP:
+            self._warmup = asyncio.get_running_loop().create_task(self._run_warm_up())
+        else:
+            self.ready = True
+
+    async def stop(self):
+        if self._warmup is not None:
+            self._warmup.cancel()
+        if "ingestion" in self._instances:
+            self.ingestion.shutdown()
+        if "history" in self._instances:
+            await self.history.close()
+
+    def status(self) -> Dict:
+        return {
+            "ready": self.ready,
+            "warmup_error": self.warmup_error,
+            "uptime": round(time.time() - self.started_at, 2),
+            "initialized": dict(self.timings),
+        }
@@ -4,12 +4,80 @@ load_dotenv()
 
 class Configuration:
     PDF_FOLDER_PATH = "/content/Rag_data"  # Folder containing PDFs
-    CHROMA_PERSIST_DIR = "./chroma_db"  # Directory to persist Chroma vector store
     EMBEDDING_MODEL = "models/embedding-001"  # Gemini embedding model
+    EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "gemini")  # "gemini" (API) or "local" (CPU model, works offline)
+    LOCAL_EMBEDDING_MODEL = "BAAI/bge-small-en-v1.5"  # Hugging Face id or path of the local embedding model
+    LOCAL_EMBEDDING_RUNTIME = os.getenv("LOCAL_EMBEDDING_RUNTIME", "torch")  # "torch", "int8" (dynamic quantization) or "onnx"
+    LOCAL_EMBEDDING_POOLING = "cls"  # "cls" for bge/e5-style models, "mean" for sentence-transformers models
+    LOCAL_EMBEDDING_QUERY_PREFIX = "Represent this sentence for searching relevant passages: "  # Query instruction; "" if none
+    LOCAL_EMBEDDING_BATCH_SIZE = 64  # Max texts per forward pass
+    LOCAL_EMBEDDING_BATCH_TOKENS = 16384  # Max padded tokens per forward pass (texts x longest text)
+    LOCAL_EMBEDDING_MAX_LENGTH = 512  # Texts are truncated to this many tokens
+    LOCAL_EMBEDDING_THREADS = 0  # Intra-op CPU threads; 0 keeps the runtime default
+    LOCAL_EMBEDDING_BATCH_WAIT = 0.005  # Seconds a query waits for concurrent queries to share its forward pass
+    EMBEDDING_CACHE_ENABLED = True  # Reuse embeddings of previously seen texts
+    EMBEDDING_CACHE_SIZE = 50000  # Embeddings kept in the in-memory LRU tier
+    EMBEDDING_CACHE_PATH = "./embedding_cache/embeddings.sqlite3"  # Persistent tier; empty string disables it
+    ANSWER_CACHE_ENABLED = True  # Serve repeated questions from the answer cache
+    ANSWER_CACHE_SIZE = 1000  # Cached answers across all chats
+    ANSWER_CACHE_TTL = 3600  # Seconds before a cached answer expires
+    ANSWER_CACHE_SIMILARITY = 0.95  # Min cosine similarity for a semantic cache hit
     RERANKER_MODEL = "BAAI/bge-reranker-base"  # Reranking model
+    RERANKER_BACKEND = os.getenv("RERANKER_BACKEND", "torch")  # "torch", "int8" (dynamic quantization) or "onnx"
+    RERANKER_BATCH_SIZE = 16  # Query/document pairs per reranker forward pass
+    RERANKER_MAX_LENGTH = 512  # Max tokens per query/document pair
     GENERATION_MODEL = "gemini-2.0-flash"  # Gemini generation model
+    LLM_MAX_CONCURRENCY = 16  # Gemini generation calls in flight per process
+    LLM_MAX_QUEUE = 64  # Generation calls waiting for a slot; further requests are rejected with 429
+    LLM_REQUESTS_PER_MINUTE = 1000  # Token-bucket rate of generation calls per process; 0 disables
+    LLM_BURST = 20  # Generation calls allowed back to back before the rate applies
+    EMBEDDING_MAX_CONCURRENCY = 8  # Gemini embedding calls in flight per process
+    EMBEDDING_MAX_QUEUE = 256  # Embedding calls waiting for a slot before new ones are rejected
+    EMBEDDING_REQUESTS_PER_MINUTE = 1500  # Token-bucket rate of embedding calls per process; 0 disables
+    EMBEDDING_BURST = 50  # Embedding calls allowed back to back before the rate applies
+    SCHEDULER_MAX_RETRIES = 3  # Retries of a model call refused for quota or availability
+    SCHEDULER_BACKOFF = 0.5  # Base of the exponential retry backoff (full jitter), in seconds
+    SCHEDULER_BACKOFF_MAX = 8.0  # Longest single backoff sleep, in seconds
     TOP_K = 5  # Default number of documents to retrieve
     TOP_N = 3  # Default number of documents to rerank
+    CONTEXT_TOKEN_BUDGET = 1500  # Max estimated tokens of retrieved context per generation prompt
+    CONTEXT_MIN_PASSAGE_TOKENS = 50  # A passage crossing the budget is truncated only if this much room is left
+    CONTEXT_MAX_OVERLAP = 400  # Max characters compared when merging chunks without a start index
+    FUSION_METHOD = "rrf"  # Hybrid fusion: "rrf" (reciprocal rank) or "weighted" (normalised scores)
+    FUSION_VECTOR_WEIGHT = 0.5  # Weight of the vector arm; the BM25 arm gets the remainder
+    RRF_K = 60  # Reciprocal-rank-fusion smoothing constant
+    FUSION_CANDIDATES = 8  # Max fused chunks passed to the reranker
+    FUSION_THREADS = 8  # Threads running the vector and BM25 arms concurrently
+    BATCH_MAX_QUESTIONS = 1000  # Max questions per /chat/batch request
+    BATCH_GENERATION_CONCURRENCY = 8  # Generation calls in flight per batch
+    BATCH_SCORE_BLOCK = 64  # Queries per BM25 or dense score matrix (block x chunks float32)
+    STATS_TOP_VALUES = 10  # Most common values reported per metadata field
+    STATS_EXCLUDED_FIELDS = ("chunk_id", "fingerprint", "start_index", "duplicate_sources")  # Internal fields left out of corpus statistics
+    FILTER_MASK_CACHE_SIZE = 64  # Metadata filter masks cached per snapshot (one byte per chunk each)
+    INGEST_WORKERS = max(1, (os.cpu_count() or 2) - 1)  # Processes parsing PDFs in parallel
+    INGEST_BATCH_SIZE = 64  # Chunks embedded and indexed per batch
+    INGEST_QUEUE_SIZE = 8  # Batches buffered between parsing and embedding
+    INGEST_MAX_JOBS = 100  # Finished ingestion jobs kept for status queries, per worker
+    INGEST_JOBS_DIR = "./ingestion_jobs"  # Job status files, so every worker can answer status queries
+    INGEST_LOCK_POLL = 0.2  # Seconds between attempts to take a chat's write lock held by another process
+    DEDUP_ENABLED = True  # Store exact and near-duplicate chunks once, keeping every source reference
+    DEDUP_THRESHOLD = 0.9  # Min estimated Jaccard similarity of word shingles for a near duplicate
+    DEDUP_NUM_PERM = 128  # MinHash signature length
+    DEDUP_BANDS = 16  # LSH bands; must divide DEDUP_NUM_PERM
+    DEDUP_SHINGLE_SIZE = 5  # Words per shingle
+    CORPUS_DIR = "./corpora"  # Per-chat snapshots: chunk store, embeddings, BM25 index and manifest
+    SNAPSHOT_KEEP_GENERATIONS = 2  # Published generations kept on disk per chat
+    SNAPSHOT_BLOCK_BYTES = 64 * 1024 * 1024  # Bytes of the previous generation copied per step when publishing
+    VECTOR_QUANTIZATION = os.getenv("VECTOR_QUANTIZATION", "none")  # First-pass vector scan: "none" (float32), "int8" or "binary"
+    VECTOR_RESCORE_FACTOR = 8  # Quantized candidates rescored against float32 vectors, as a multiple of k
+    VECTOR_SCAN_BLOCK = 16384  # Rows of quantized codes scored per block
+    STARTUP_WARMUP = True  # Build models and reopen corpora in the background after startup
+    STARTUP_PRELOAD_CORPORA = 20  # Most recently updated corpora reopened during warm-up
+    IVF_N_CLUSTERS = 0  # Hierarchical index clusters; 0 picks sqrt(number of chunks)
+    IVF_NPROBE = 8  # Clusters scanned per query; higher improves recall at the cost of latency
+    IVF_TRAIN_SAMPLE = 50000  # Max vectors used to train the cluster centroids
+    BM25_K1 = 1.5  # BM25 term-frequency saturation
+    BM25_B = 0.75  # BM25 document-length normalisation
 
     # # MongoDB configuration
     # MONGO_URI = os.getenv("MONGO_URI")
@@ -19,4 +87,19 @@ class Configuration:
     # MongoDB configuration
     MONGO_URI = os.getenv("MONGO_URI")
     MONGO_DB = "chat_history"
-    MONGO_COLLECTION = "history_store"
\ No newline at end of file
+    MONGO_COLLECTION = "history_store"
+    MONGO_MAX_POOL_SIZE = 50  # Max pooled connections per process
+    MONGO_MIN_POOL_SIZE = 5  # Connections kept warm
+    MONGO_MAX_IDLE_MS = 60000  # Idle connections are closed after this long
+    MONGO_TIMEOUT_MS = 5000  # Server selection timeout
+
+    # Chat history
+    HISTORY_BACKEND = os.getenv("HISTORY_BACKEND", "mongo")  # "mongo", "sqlite" (single node) or "memory" (tests)
+    HISTORY_SQLITE_PATH = "./chat_history/history.sqlite3"  # Used by the sqlite backend
+    HISTORY_LIMIT = 5  # Messages passed to the pipeline as chat history
+    HISTORY_CACHE_SESSIONS = 1000  # Active chats whose recent turns are kept in memory
+    HISTORY_CACHE_TURNS = 20  # Recent messages cached per chat
+    HISTORY_CACHE_TTL = 10.0  # Seconds a cached window is served before it is re-read; bounds staleness across workers
+    HISTORY_FLUSH_INTERVAL = 0.5  # Seconds between bulk writes of buffered messages
+    HISTORY_BATCH_SIZE = 100  # Buffered messages that trigger an immediate flush
+    HISTORY_MAX_PENDING = 10000  # Unsaved messages kept while the backend is down; the oldest are dropped beyond this
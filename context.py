@@ -0,0 +1,139 @@
+from dataclasses import dataclass, field
+from typing import List, Dict, Optional, Tuple
+from langchain.schema import Document
+from config_file import Configuration
+from metrics import estimate_tokens
+
+
+@dataclass
+class Passage:
+    """Contiguous text from one page of one source, built from one or more chunks."""
+    source: str
+    page: Optional[int]
+    text: str
+    score: float
+    start: Optional[int] = None  # Character offset of the passage within its page, if known
+    chunk_ids: List[str] = field(default_factory=list)
+    duplicate_sources: Optional[str] = None  # Other files containing the same text, collapsed at ingest
+
+    @property
+    def end(self) -> Optional[int]:
+        return None if self.start is None else self.start + len(self.text)
+
+    @property
+    def citation(self) -> str:
+        # PyPDFLoader pages are 0-based; citations are for humans
+        citation = self.source if self.page is None else f"{self.source} p.{int(self.page) + 1}"
+        return f"{citation} (also in {self.duplicate_sources})" if self.duplicate_sources else citation
+
+
+def _overlap(left: str, right: str, max_overlap: int) -> int:
+    """Length of the longest suffix of ``left`` that is a prefix of ``right`` (bounded by ``max_overlap``)."""
+    for size in range(min(len(left), len(right), max_overlap), 0, -1):
+        if left.endswith(right[:size]):
+            return size
+    return 0
+
+
+class ContextBuilder:
+    """Turns ranked chunks into a compact, cited context for the generation prompt.
+
+    Chunks from the same source and page are merged when they overlap or
+    touch, using the splitter's ``start_index`` when present and falling back
+    to matching the overlapping text, so the ``chunk_overlap`` between
+    neighbours is sent once. Passages are ordered by their best chunk's score
+    and added until ``token_budget`` is reached; the passage that crosses the
+    budget is cut at a word boundary if enough room is left for it to be useful.
+    """
+
+    def __init__(self, token_budget: int = Configuration.CONTEXT_TOKEN_BUDGET,
+                 min_passage_tokens: int = Configuration.CONTEXT_MIN_PASSAGE_TOKENS,
+                 max_overlap: int = Configuration.CONTEXT_MAX_OVERLAP):
+        self.token_budget = token_budget
+        self.min_passage_tokens = min_passage_tokens
+        self.max_overlap = max_overlap
+
+    def _merge(self, passages: List[Passage]) -> List[Passage]:
+        """Merge the passages of one (source, page) group."""
+        if all(p.start is not None for p in passages):
+            passages = sorted(passages, key=lambda p: p.start)
+            merged = [passages[0]]
+            for passage in passages[1:]:
+                current = merged[-1]
+                if passage.start > current.end:
+                    merged.append(passage)
+                    continue
+                # Overlapping or touching: append only the part past the current end
+                current.text += passage.text[current.end - passage.start:]
+                self._absorb(current, passage)
+            return merged
+
+        # Without offsets (chunks indexed before start_index was recorded), match the overlapping text
+        merged: List[Passage] = []
+        for passage in passages:
+            for current in merged:
+                if passage.text in current.text:
+                    break
+                if current.text in passage.text:
+                    current.text = passage.text
+                    break
+                size = _overlap(current.text, passage.text, self.max_overlap)
+                if size:
+                    current.text += passage.text[size:]
+                    break
+                size = _overlap(passage.text, current.text, self.max_overlap)
+                if size:
+                    current.text = passage.text + current.text[size:]
+                    break
+            else:
+                merged.append(passage)
+                continue
+            self._absorb(current, passage)
+        return merged
+
+    @staticmethod
+    def _absorb(current: Passage, passage: Passage):
+        current.score = max(current.score, passage.score)
+        current.chunk_ids.extend(passage.chunk_ids)
+
+    def _fit(self, text: str, tokens: int) -> str:
+        """Cut ``text`` at a word boundary so it holds about ``tokens`` tokens."""
+        cut = text[:tokens * 4]
+        space = cut.rfind(" ")
+        return (cut[:space] if space > 0 else cut) + " ..."
+
+    def passages(self, documents: List[Document], scores: Optional[List[float]] = None) -> List[Passage]:
+        """Merged passages ordered by score; without scores, the input order is the ranking."""
+        if scores is None:
+            scores = [-rank for rank in range(len(documents))]
+        groups: Dict[Tuple[str, Optional[int]], List[Passage]] = {}
+        for doc, score in zip(documents, scores):
+            passage = Passage(
+                source=doc.metadata.get("source", "unknown"),
+                page=doc.metadata.get("page"),
+                text=doc.page_content,
+                score=float(score),
+                start=doc.metadata.get("start_index"),
+                chunk_ids=[doc.metadata["chunk_id"]] if "chunk_id" in doc.metadata else [],
+                duplicate_sources=doc.metadata.get("duplicate_sources"),
+            )
+            groups.setdefault((passage.source, passage.page), []).append(passage)
+        merged = [p for group in groups.values() for p in self._merge(group)]
+        return sorted(merged, key=lambda p: p.score, reverse=True)
+
+    def build(self, documents: List[Document], scores: Optional[List[float]] = None) -> Tuple[str, List[Passage]]:
+        """Return the context text and the passages it contains, in citation order."""
+        selected, used = [], 0
+        for passage in self.passages(documents, scores):
+            header = f"[{len(selected) + 1}] {passage.citation}\n"
+            tokens = estimate_tokens(header) + estimate_tokens(passage.text)
+            if used + tokens > self.token_budget:
+                remaining = self.token_budget - used - estimate_tokens(header)
+                if remaining >= self.min_passage_tokens:
+                    passage.text = self._fit(passage.text, remaining)
+                    selected.append(passage)
+                break
+            selected.append(passage)
+            used += tokens
+        context = "\n\n".join(f"[{i}] {p.citation}\n{p.text}" for i, p in enumerate(selected, start=1))
+        return context, selected
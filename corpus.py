@@ -0,0 +1,588 @@
+import hashlib
+import itertools
+import json
+import os
+import shutil
+import threading
+import uuid
+from collections import Counter, defaultdict
+from typing import Iterator, List, Dict, Optional, Set, Tuple
+import numpy as np
+from langchain.schema import Document
+from config_file import Configuration
+from dedup import ChunkDeduplicator
+from retrieval import BM25Index, CorpusStatistics, MetadataColumns, tokenize
+from snapshot import (ChunkStore, Snapshot, StagedChunks, CURRENT, GENERATIONS, publish_snapshot, read_current,
+                      row_blocks, write_embeddings)
+from utils import logger
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows: only one process may write to a corpus there
+    fcntl = None
+
+STAGING_PREFIX = ".staging-"  # Directories of new chunks spilled by a writer until it publishes
+
+
+def tenant_id(userID: str, chatID: str) -> str:
+    """Stable tenant identifier that is also a valid directory name."""
+    return "t_" + hashlib.sha1(f"{userID}/{chatID}".encode("utf-8")).hexdigest()
+
+
+def chunk_id(source: str, page, content: str) -> str:
+    """Content-addressed chunk id: unchanged chunks keep their id across re-uploads."""
+    return hashlib.sha256(f"{source}\0{page}\0{content}".encode("utf-8")).hexdigest()
+
+
+def embedding_model_name(embeddings) -> str:
+    """Identity of an embedding model, recorded in snapshots so vectors of different models never mix."""
+    return getattr(embeddings, "model_name", None) or getattr(embeddings, "model", None) or type(embeddings).__name__
+
+
+class Corpus:
+    """Documents of one tenant (a user's chat), served from immutable snapshots.
+
+    Every change publishes a new generation under ``generations/`` (chunk
+    store, normalised embedding matrix, BM25 index, statistics and manifest)
+    and then atomically replaces the ``CURRENT`` pointer. Queries go through
+    ``snapshot()``, which memory-maps the current generation and remaps when
+    any process publishes a newer one, so all uvicorn workers share one copy
+    of the corpus through the page cache and answer from the same version.
+
+    Changes are made through ``writer()``; a per-tenant file lock lets one
+    process at a time modify the corpus. A corpus persisted before snapshots
+    existed, or embedded by another model, is republished by
+    ``start_migration()`` in the background.
+    """
+
+    def __init__(self, tenant: str, userID: str, chatID: str, embeddings, root_dir: str = Configuration.CORPUS_DIR):
+        self.tenant = tenant
+        self.userID = userID
+        self.chatID = chatID
+        self.embeddings = embeddings
+        self.path = os.path.join(root_dir, tenant)
+        self._snapshot: Optional[Snapshot] = None
+        self._current_key = None  # (inode, mtime) of the CURRENT file the snapshot was opened from
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._migration: Optional[threading.Thread] = None
+        self._migration_checked = False
+
+    def _needs_migration(self) -> bool:
+        generation = read_current(self.path)
+        if generation is None:
+            return os.path.exists(os.path.join(self.path, "manifest.json"))  # Persisted before snapshots existed
+        with open(os.path.join(self.path, GENERATIONS, generation, "manifest.json")) as f:
+            model = json.load(f).get("embedding_model")
+        return model not in (None, embedding_model_name(self.embeddings))
+
+    def _migrate(self):
+        """Republish a corpus in the old layout, or embedded by another model, as a new generation."""
+        with self.writer() as writer:
+            if writer.legacy or writer.reembed:
+                writer.changed = True
+                writer.version += 1
+                writer.publish()
+                logger.info(f"Migrated corpus {self.tenant} to a new generation with {writer.embedding_model}.")
+
+    def start_migration(self):
+        """Start migrating in a background thread if the corpus needs it; see ``migrating``."""
+        if self._migration_checked:
+            return
+        with self._lock:
+            if self._migration_checked:
+                return
+            self._migration_checked = True
+            if self._needs_migration():
+                self._migration = threading.Thread(target=self._run_migration, name=f"migrate-{self.tenant}",
+                                                   daemon=True)
+                self._migration.start()
+
+    def _run_migration(self):
+        try:
+            self._migrate()
+        except Exception as e:
+            logger.error(f"Error migrating corpus {self.tenant}: {e}")
+            self._migration_checked = False  # Retried on the next access
+
+    @property
+    def migrating(self) -> bool:
+        """True while a migration runs; the current generation must not be queried until it is done."""
+        migration = self._migration
+        return migration is not None and migration.is_alive()
+
+    def snapshot(self) -> Optional[Snapshot]:
+        """The current generation, remapped if another process published since the last call."""
+        try:
+            stat = os.stat(os.path.join(self.path, CURRENT))
+        except FileNotFoundError:
+            return None
+        key = (stat.st_ino, stat.st_mtime_ns)
+        if key != self._current_key:
+            with self._lock:
+                if key != self._current_key:
+                    generation = read_current(self.path)
+                    if self._snapshot is None or self._snapshot.generation != generation:
+                        self._snapshot = Snapshot(os.path.join(self.path, GENERATIONS, generation),
+                                                  self.tenant, self.embeddings)
+                    self._current_key = key
+        return self._snapshot
+
+    def __len__(self) -> int:
+        snapshot = self.snapshot()
+        return len(snapshot) if snapshot is not None else 0
+
+    @property
+    def version(self) -> int:
+        snapshot = self.snapshot()
+        return snapshot.version if snapshot is not None else 0
+
+    def writer(self, blocking: bool = True) -> Optional["CorpusWriter"]:
+        """Lock the corpus for writing and return a writer starting from the current generation.
+
+        With ``blocking=False``, returns None instead of waiting if another thread or process holds the lock.
+        """
+        if not self._write_lock.acquire(blocking=blocking):
+            return None
+        lock_file = None
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            lock_file = open(os.path.join(self.path, ".lock"), "w")
+            if fcntl is not None:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    lock_file.close()
+                    self._write_lock.release()
+                    return None
+            for name in os.listdir(self.path):
+                if name.startswith(STAGING_PREFIX):  # Left behind by a writer that crashed
+                    shutil.rmtree(os.path.join(self.path, name), ignore_errors=True)
+            generation = read_current(self.path)
+            if generation is not None:
+                state_path = os.path.join(self.path, GENERATIONS, generation)
+            elif os.path.exists(os.path.join(self.path, "manifest.json")):
+                state_path = self.path  # Pre-snapshot layout
+            else:
+                state_path = None
+            return CorpusWriter(self, state_path, lock_file)
+        except Exception:
+            if lock_file is not None:
+                lock_file.close()
+            self._write_lock.release()
+            raise
+
+    def describe(self) -> Dict:
+        snapshot = self.snapshot()
+        manifest = snapshot.manifest if snapshot is not None else {}
+        return {
+            "userID": self.userID,
+            "chatID": self.chatID,
+            "version": self.version,
+            "generation": snapshot.generation if snapshot is not None else None,
+            "chunks": len(self),
+            "duplicate_chunks": len(manifest.get("duplicates", {})),
+            "statistics": snapshot.statistics.summary() if snapshot is not None else CorpusStatistics().summary(),
+            "sources": {name: {"fingerprint": entry["fingerprint"], "chunks": len(entry["chunk_ids"])}
+                        for name, entry in manifest.get("sources", {}).items()},
+        }
+
+
+class CorpusWriter:
+    """Changes to a corpus for one upload or deletion, obtained from ``Corpus.writer()``.
+
+    It holds the tenant's write lock until ``close()``. A manifest maps each
+    source file name to the fingerprint of its last upload and the ids of its
+    chunks; chunks whose id is already present are never re-embedded, chunks
+    that disappear from a re-uploaded file are deleted, and ``publish()``
+    copies unchanged embeddings from the previous generation.
+
+    The previous generation stays memory-mapped: the writer only tracks which
+    of its rows are deleted and the rows whose metadata changes. New chunks,
+    their vectors and term counts are spilled to a ``StagedChunks`` directory
+    batch by batch. Only deleted or changed rows are decoded, and ``publish()``
+    copies the kept rows, vectors and postings as raw blocks, then the staged
+    chunks the same way. Each publish still writes a complete generation, so
+    its cost is a sequential copy of the whole corpus; memory stays bounded by
+    a few integers per chunk and ``SNAPSHOT_BLOCK_BYTES``, except for the
+    dedup signatures, which are loaded whole.
+
+    A new chunk that duplicates a stored one, exactly or nearly, is not stored
+    again: it is recorded as an alias of the stored chunk, whose
+    ``duplicate_sources`` metadata lists the other files it appears in. If the
+    stored chunk's own source goes away, a surviving alias takes its place
+    with its own text and metadata. A chunk is never collapsed into a chunk of
+    its own file's previous version, which a re-upload may be about to delete.
+    """
+
+    def __init__(self, corpus: Corpus, state_path: Optional[str], lock_file):
+        self.corpus = corpus
+        self._lock_file = lock_file
+        self.legacy = state_path == corpus.path
+        manifest = {}
+        if state_path is not None:
+            with open(os.path.join(state_path, "manifest.json")) as f:
+                manifest = json.load(f)
+        self.sources: Dict[str, Dict] = manifest.get("sources", {})
+        self.duplicates: Dict[str, Dict] = manifest.get("duplicates", {})  # Alias id -> {"of": stored id, "metadata", "text"}
+        self.version = manifest.get("version", 0)
+        self.chunk_ids: Set[str] = {cid for entry in self.sources.values() for cid in entry["chunk_ids"]}
+        self.embedding_model = embedding_model_name(corpus.embeddings)
+        self.reembed = manifest.get("embedding_model") not in (None, self.embedding_model)
+
+        self._state_path = state_path
+        self._base: Optional[ChunkStore] = None  # Previous generation, memory-mapped
+        self._base_vectors = None
+        self._staged = StagedChunks(os.path.join(corpus.path, f"{STAGING_PREFIX}{uuid.uuid4().hex}"))  # New chunks
+        self._metadata: Dict[int, Dict] = {}  # Previous-generation row -> rewritten metadata
+        self._sorted_ids = self._id_order = None  # Chunk id lookup into the previous generation, built on demand
+        chunks_path = os.path.join(state_path, "chunks") if state_path is not None else None
+        if chunks_path is not None and os.path.isdir(chunks_path):
+            self._base = ChunkStore.open(chunks_path)
+            # Vectors of another embedding model are not reused; publish() embeds every chunk again
+            self._base_vectors = None if self.reembed else np.load(os.path.join(state_path, "embeddings.npy"), mmap_mode="r")
+        elif state_path is not None:
+            # The pre-snapshot layout kept its embeddings in Chroma; publish() embeds its chunks again
+            legacy = BM25Index.load_or_create(os.path.join(state_path, "bm25"))
+            self._stage(legacy.documents)
+        self._keep = np.ones(len(self._base) if self._base is not None else 0, dtype=bool)
+        self.statistics = self._load_statistics(state_path)
+        self.deduplicator = None
+        if Configuration.DEDUP_ENABLED:
+            stored = [cid.decode("utf-8") for cid in self._base.chunk_ids()] if self._base is not None else []
+            self.deduplicator = ChunkDeduplicator.load_or_build(
+                os.path.join(state_path or corpus.path, "dedup"), stored + list(self._staged.rows), self._documents())
+        self.changed = False
+
+    def _load_statistics(self, state_path: Optional[str]) -> CorpusStatistics:
+        if state_path is not None and os.path.exists(os.path.join(state_path, "stats.json")):
+            return CorpusStatistics.load(os.path.join(state_path, "stats.json"))
+        # Corpora persisted before statistics existed are scanned once
+        statistics = CorpusStatistics()
+        statistics.update(self._documents())
+        return statistics
+
+    def _base_document(self, row: int) -> Document:
+        doc = self._base[row]
+        if row in self._metadata:
+            doc.metadata = dict(self._metadata[row])
+        return doc
+
+    def _documents(self) -> Iterator[Document]:
+        """Chunks as they will be published: kept rows of the previous generation, then the new chunks."""
+        if self._base is not None:
+            for row in np.flatnonzero(self._keep):
+                yield self._base_document(row)
+        yield from self._staged.documents()
+
+    def _base_rows(self, chunk_ids: Set[str]) -> Dict[str, int]:
+        """Rows of the previous generation still holding ``chunk_ids``."""
+        if self._base is None or not chunk_ids:
+            return {}
+        if self._sorted_ids is None:
+            ids = self._base.chunk_ids()
+            self._id_order = np.argsort(ids, kind="stable")
+            self._sorted_ids = np.asarray(ids)[self._id_order]
+        wanted = list(chunk_ids)
+        encoded = np.array([cid.encode("utf-8") for cid in wanted], dtype=bytes)
+        positions = np.minimum(np.searchsorted(self._sorted_ids, encoded), max(len(self._sorted_ids) - 1, 0))
+        rows = {}
+        for cid, key, position in zip(wanted, encoded, positions):
+            if len(self._sorted_ids) and self._sorted_ids[position] == key:
+                row = int(self._id_order[position])
+                if self._keep[row]:
+                    rows[cid] = row
+        return rows
+
+    def is_ingested(self, source: str, fingerprint: str) -> bool:
+        """True if this exact file content was already ingested under this name."""
+        entry = self.sources.get(source)
+        return entry is not None and entry["fingerprint"] == fingerprint
+
+    def _stage(self, documents: List[Document], vectors: Optional[np.ndarray] = None):
+        # Tokenized here, while the next batch is parsed, rather than all at once in publish()
+        self._staged.append(documents, [Counter(tokenize(doc.page_content)) for doc in documents], vectors)
+
+    def _vector(self, cid: str) -> Optional[np.ndarray]:
+        if cid in self._staged:
+            return self._staged.vector(cid)
+        row = self._base_rows({cid}).get(cid)
+        if self._base_vectors is not None and row is not None:
+            return np.asarray(self._base_vectors[row])
+        return None
+
+    def add_documents(self, documents: List[Document]) -> Tuple[int, int]:
+        """Embed the chunks that are not stored yet; they are indexed by ``publish()``.
+
+        Returns how many chunks were added and how many were collapsed into an
+        already stored duplicate.
+        """
+        new_docs, aliases = {}, {}
+        for doc in documents:
+            cid = doc.metadata["chunk_id"]
+            if cid in self.chunk_ids or cid in new_docs or cid in aliases:
+                continue
+            original = None
+            if self.deduplicator is not None:
+                # Chunks of the file's previous version may be deleted by this upload, so a
+                # revised chunk must not become an alias of the text it replaces
+                previous = self.sources.get(doc.metadata.get("source"), {}).get("chunk_ids", ())
+                original = self.deduplicator.check(cid, doc.page_content, exclude=set(previous))
+            if original is None:
+                new_docs[cid] = doc
+            else:
+                aliases[cid] = {"of": original, "metadata": dict(doc.metadata), "text": doc.page_content}
+        try:
+            if new_docs:
+                vectors = self.corpus.embeddings.embed_documents([doc.page_content for doc in new_docs.values()])
+                self._stage(list(new_docs.values()), np.asarray(vectors, dtype=np.float32))
+        except Exception:
+            if self.deduplicator is not None:  # Forget the chunks registered above so a retry can store them
+                for cid in new_docs:
+                    self.deduplicator.remove(cid)
+            raise
+        self.statistics.update(list(new_docs.values()))
+        self.chunk_ids.update(new_docs)
+        self.chunk_ids.update(aliases)
+        self.duplicates.update(aliases)
+        self._refresh_duplicate_sources({entry["of"] for entry in aliases.values()})
+        self.changed = self.changed or bool(new_docs or aliases)
+        return len(new_docs), len(aliases)
+
+    def _refresh_duplicate_sources(self, chunk_ids: Set[str]):
+        """Rewrite the ``duplicate_sources`` metadata of stored chunks from their aliases."""
+        if not chunk_ids:
+            return
+        sources = defaultdict(set)
+        for entry in self.duplicates.values():
+            if entry["of"] in chunk_ids:
+                sources[entry["of"]].add(entry["metadata"].get("source", "unknown"))
+        targets = {cid: self._staged.document(cid).metadata for cid in chunk_ids if cid in self._staged}
+        for cid, metadata in targets.items():
+            self._staged.metadata[self._staged.rows[cid]] = metadata
+        for cid, row in self._base_rows({cid for cid in chunk_ids if cid not in self._staged}).items():
+            targets[cid] = self._metadata[row] = self._base_document(row).metadata
+        for cid, metadata in targets.items():
+            others = sorted(sources[cid] - {metadata.get("source")})
+            if others:
+                metadata["duplicate_sources"] = ", ".join(others)
+            else:
+                metadata.pop("duplicate_sources", None)
+
+    def commit_source(self, source: str, fingerprint: str, chunk_ids: List[str]):
+        """Record a source's new chunk set and drop chunks of its previous version."""
+        previous = self.sources.get(source)
+        stale = set(previous["chunk_ids"]) - set(chunk_ids) if previous else set()
+        self.sources[source] = {"fingerprint": fingerprint, "chunk_ids": list(dict.fromkeys(chunk_ids))}
+        self._delete_chunks(stale)
+        self.version += 1
+        self.changed = True
+
+    def delete_source(self, source: str) -> bool:
+        entry = self.sources.pop(source, None)
+        if entry is None:
+            return False
+        self._delete_chunks(set(entry["chunk_ids"]))
+        self.version += 1
+        self.changed = True
+        return True
+
+    def _remove(self, chunk_ids: Set[str]) -> List[Document]:
+        """Drop stored chunks, decoding only the rows removed from the previous generation; returns them."""
+        removed = [self._staged.remove(cid) for cid in chunk_ids if cid in self._staged]
+        for row in self._base_rows(chunk_ids).values():
+            removed.append(self._base_document(row))
+            self._keep[row] = False
+            self._metadata.pop(row, None)
+        return removed
+
+    def _delete_chunks(self, chunk_ids: Set[str]):
+        if not chunk_ids:
+            return
+        aliases = chunk_ids.intersection(self.duplicates)
+        touched = {self.duplicates.pop(alias)["of"] for alias in aliases}
+        stored = chunk_ids - aliases
+        aliases_of = defaultdict(list)
+        for alias, entry in self.duplicates.items():
+            aliases_of[entry["of"]].append(alias)
+        deleted = set()
+        for cid in stored:
+            if aliases_of.get(cid):
+                touched.add(self._promote(cid, aliases_of[cid]))
+            else:
+                deleted.add(cid)
+        if deleted:
+            self.statistics.remove(self._remove(deleted))
+            if self.deduplicator is not None:
+                for cid in deleted:
+                    self.deduplicator.remove(cid)
+        self.chunk_ids -= chunk_ids
+        self._refresh_duplicate_sources(touched - chunk_ids)
+        logger.info(f"Deleted {len(chunk_ids)} chunks from corpus {self.corpus.tenant}.")
+
+    def _promote(self, cid: str, aliases: List[str]) -> str:
+        """Replace chunk ``cid`` with its first alias, whose source still exists.
+
+        The alias is stored with its own text and embedded again by ``publish()``.
+        """
+        alias = aliases[0]
+        entry = self.duplicates.pop(alias)
+        metadata = dict(entry["metadata"])
+        for other in aliases[1:]:
+            self.duplicates[other]["of"] = alias
+        vector = self._vector(cid)
+        removed = self._remove({cid})
+        self.statistics.remove(removed)
+        if "text" in entry:
+            promoted = Document(page_content=entry["text"], metadata=metadata)
+            if self.deduplicator is not None:
+                self.deduplicator.remove(cid)
+                self.deduplicator.add(alias, promoted.page_content)
+        else:
+            # Aliases recorded before their text was kept can only take over the stored content
+            metadata.pop("start_index", None)
+            promoted = Document(page_content=removed[0].page_content, metadata=metadata)
+            if self.deduplicator is not None:
+                self.deduplicator.rename(cid, alias)
+        # Promoted with its own text is embedded again by publish(); otherwise the stored vector still fits
+        self._stage([promoted], vector[None, :] if vector is not None and "text" not in entry else None)
+        self.statistics.update([promoted])
+        return alias
+
+    def _vector_blocks(self) -> Iterator[np.ndarray]:
+        """Vectors in published row order, a block at a time; chunks without one are embedded here."""
+        block_bytes = Configuration.SNAPSHOT_BLOCK_BYTES
+        if self._base_vectors is not None:
+            step = max(1, block_bytes // max(1, self._base_vectors.shape[1] * self._base_vectors.itemsize))
+            for start in range(0, len(self._keep), step):
+                keep = self._keep[start:start + step]
+                if keep.any():
+                    yield np.asarray(self._base_vectors[start:start + step])[keep]
+        elif self._base is not None:
+            for start, end in row_blocks(self._base.text_offsets, block_bytes):
+                rows = np.flatnonzero(self._keep[start:end]) + start
+                if len(rows):
+                    texts = [self._base.text(row) for row in rows]
+                    yield np.asarray(self.corpus.embeddings.embed_documents(texts), dtype=np.float32)
+        yield from self._staged.vector_blocks(self.corpus.embeddings.embed_documents, block_bytes)
+
+    def _write(self, path: str):
+        """Write the kept part of the previous generation followed by the staged chunks into ``path``."""
+        base = self._base if self._base is not None else ChunkStore.empty()
+        ChunkStore.write_parts(os.path.join(path, "chunks"), [(base, self._keep, self._metadata), self._staged.store()])
+
+        blocks = self._vector_blocks()
+        first = next(blocks, None)
+        shape = (int(self._keep.sum()) + len(self._staged), first.shape[1] if first is not None else 0)
+        write_embeddings(path, itertools.chain([first], blocks) if first is not None else [], shape,
+                         Configuration.VECTOR_QUANTIZATION)
+
+        if self._base is not None:
+            bm25_index = BM25Index.load(os.path.join(self._state_path, "bm25"), documents=self._base)
+        else:
+            bm25_index = BM25Index()
+        bm25_index.save_merged(os.path.join(path, "bm25"), self._keep, self._staged.term_counts())
+        columns = MetadataColumns()
+        if self._base is not None:
+            columns_path = os.path.join(self._state_path, "columns")
+            if os.path.exists(os.path.join(columns_path, "columns.json")):
+                columns = MetadataColumns.load(columns_path)
+            else:
+                columns = MetadataColumns(documents=self._base)  # Published before columns were stored
+        columns.merge(self._keep, self._metadata, self._staged.documents()).save(os.path.join(path, "columns"))
+        self.statistics.save(os.path.join(path, "stats.json"))
+        if self.deduplicator is not None:
+            self.deduplicator.save(os.path.join(path, "dedup"))
+
+    def publish(self) -> Optional[str]:
+        """Write the changes as a new generation and make it current; returns its name, or None if unchanged."""
+        if not self.changed:
+            return None
+        manifest = {"userID": self.corpus.userID, "chatID": self.corpus.chatID, "version": self.version,
+                    "embedding_model": self.embedding_model, "sources": self.sources, "duplicates": self.duplicates}
+        generation = publish_snapshot(self.corpus.path, manifest, self._write)
+        logger.info(f"Published corpus {self.corpus.tenant}: {int(self._keep.sum())} chunks kept, "
+                    f"{len(self._staged)} added.")
+        self.changed = False
+        return generation
+
+    def close(self):
+        """Release the write lock; unpublished changes are discarded."""
+        self._staged.close()
+        if self._lock_file is not None:
+            self._lock_file.close()  # Closing the file releases the flock
+            self._lock_file = None
+            self.corpus._write_lock.release()
+
+    def __enter__(self) -> "CorpusWriter":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class CorpusRegistry:
+    """All tenant corpora served by this process, opened lazily on first use.
+
+    At startup only the manifests under ``root_dir`` are scanned; a corpus's
+    current generation is mapped the first time it is queried. Corpora created
+    by other worker processes are picked up from disk on first request.
+    """
+
+    def __init__(self, embeddings, root_dir: str = Configuration.CORPUS_DIR):
+        self.embeddings = embeddings
+        self.root_dir = root_dir
+        self.known: Dict[str, Dict[str, str]] = {}
+        self._corpora: Dict[str, Corpus] = {}
+        self._lock = threading.Lock()
+        self._scan()
+
+    def _manifest_path(self, tenant: str) -> Optional[str]:
+        path = os.path.join(self.root_dir, tenant)
+        generation = read_current(path)
+        manifest_path = os.path.join(path, GENERATIONS, generation, "manifest.json") if generation \
+            else os.path.join(path, "manifest.json")
+        return manifest_path if os.path.exists(manifest_path) else None
+
+    def _scan(self):
+        if not os.path.isdir(self.root_dir):
+            return
+        for tenant in os.listdir(self.root_dir):
+            manifest_path = self._manifest_path(tenant)
+            if manifest_path is not None:
+                with open(manifest_path) as f:
+                    manifest = json.load(f)
+                self.known[tenant] = {"userID": manifest["userID"], "chatID": manifest["chatID"]}
+        logger.info(f"Found {len(self.known)} persisted corpora in {self.root_dir}.")
+
+    def preload(self, limit: int) -> int:
+        """Map the ``limit`` most recently updated corpora so their first query is not a cold one."""
+        def updated_at(tenant: str) -> float:
+            manifest_path = self._manifest_path(tenant)
+            return os.path.getmtime(manifest_path) if manifest_path else 0.0
+
+        tenants = sorted(self.known, key=updated_at, reverse=True)[:max(0, limit)]
+        for tenant in tenants:
+            corpus = self.get(self.known[tenant]["userID"], self.known[tenant]["chatID"])
+            corpus.snapshot()
+        logger.info(f"Preloaded {len(tenants)} corpora.")
+        return len(tenants)
+
+    def get(self, userID: str, chatID: str, create: bool = False) -> Optional[Corpus]:
+        """Return the tenant's corpus, opening it on first access."""
+        tenant = tenant_id(userID, chatID)
+        corpus = self._corpora.get(tenant)
+        if corpus is not None:
+            corpus.start_migration()
+            return corpus
+        if tenant not in self.known and not create and self._manifest_path(tenant) is None:
+            return None
+        with self._lock:
+            corpus = self._corpora.get(tenant)
+            if corpus is None:
+                corpus = Corpus(tenant, userID, chatID, self.embeddings, self.root_dir)
+                self._corpora[tenant] = corpus
+                self.known[tenant] = {"userID": userID, "chatID": chatID}
+        # Outside the registry lock: re-embedding a corpus must not hold up other tenants
+        corpus.start_migration()
+        return corpus
@@ -0,0 +1,164 @@
+import hashlib
+import json
+import os
+import re
+from collections import defaultdict
+from typing import Collection, Iterable, List, Dict, Optional, Set, Tuple
+import numpy as np
+from langchain.schema import Document
+from config_file import Configuration
+from utils import logger, atomic_write, atomic_save_npy
+
+_WORD = re.compile(r"\w+")
+_PRIME = (1 << 31) - 1  # Keeps a * hash + b inside uint64 for 32-bit shingle hashes
+
+
+def _words(text: str) -> List[str]:
+    return _WORD.findall(text.lower())
+
+
+def content_hash(text: str) -> str:
+    """Hash of the text with case, punctuation and whitespace normalised away."""
+    return hashlib.sha1(" ".join(_words(text)).encode("utf-8")).hexdigest()
+
+
+class MinHasher:
+    """MinHash signatures over word shingles; matching slots estimate Jaccard similarity."""
+
+    def __init__(self, num_perm: int = Configuration.DEDUP_NUM_PERM,
+                 shingle_size: int = Configuration.DEDUP_SHINGLE_SIZE, seed: int = 1):
+        rng = np.random.default_rng(seed)
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.a = rng.integers(1, _PRIME, size=num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, _PRIME, size=num_perm, dtype=np.uint64)
+
+    def shingles(self, text: str) -> Set[str]:
+        words = _words(text)
+        size = min(self.shingle_size, len(words)) or 1
+        return {" ".join(words[i:i + size]) for i in range(max(1, len(words) - size + 1))}
+
+    def signature(self, text: str) -> np.ndarray:
+        hashes = np.fromiter(
+            (int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=4).digest(), "little")
+             for s in self.shingles(text)), dtype=np.uint64)
+        return ((np.outer(hashes, self.a) + self.b) % _PRIME).min(axis=0).astype(np.uint32)
+
+
+class ChunkDeduplicator:
+    """Finds stored chunks that a new chunk duplicates, exactly or nearly.
+
+    Exact duplicates are found through a normalised content hash. Near
+    duplicates are found with MinHash and locality-sensitive hashing: the
+    signature is split into ``bands`` bands, chunks sharing any band become
+    candidates, and a candidate matches if the estimated Jaccard similarity of
+    their word shingles reaches ``threshold``.
+    """
+
+    def __init__(self, threshold: float = Configuration.DEDUP_THRESHOLD, num_perm: int = Configuration.DEDUP_NUM_PERM,
+                 bands: int = Configuration.DEDUP_BANDS, shingle_size: int = Configuration.DEDUP_SHINGLE_SIZE):
+        if num_perm % bands:
+            raise ValueError("DEDUP_NUM_PERM must be a multiple of DEDUP_BANDS")
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.hasher = MinHasher(num_perm, shingle_size)
+        self.hashes: Dict[str, str] = {}  # Content hash -> chunk id
+        self.signatures: Dict[str, Tuple[str, np.ndarray]] = {}  # Chunk id -> (content hash, signature)
+        self.buckets: List[Dict[bytes, Set[str]]] = [defaultdict(set) for _ in range(bands)]
+
+    def __len__(self) -> int:
+        return len(self.signatures)
+
+    def _band_keys(self, signature: np.ndarray) -> List[bytes]:
+        return [signature[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)]
+
+    def _insert(self, key: str, digest: str, signature: np.ndarray):
+        self.hashes.setdefault(digest, key)
+        self.signatures[key] = (digest, signature)
+        for bucket, band in zip(self.buckets, self._band_keys(signature)):
+            bucket[band].add(key)
+
+    def _find(self, digest: str, signature: np.ndarray, exclude: Collection[str] = ()) -> Optional[str]:
+        match = self.hashes.get(digest)
+        if match is not None and match not in exclude:
+            return match
+        best, best_similarity = None, self.threshold
+        candidates = set().union(*(bucket.get(band, ()) for bucket, band in zip(self.buckets, self._band_keys(signature))))
+        for key in candidates.difference(exclude):
+            similarity = float(np.mean(self.signatures[key][1] == signature))
+            if similarity >= best_similarity:
+                best, best_similarity = key, similarity
+        return best
+
+    def find(self, text: str) -> Optional[str]:
+        """Id of a stored chunk that ``text`` duplicates, if any."""
+        return self._find(content_hash(text), self.hasher.signature(text))
+
+    def check(self, key: str, text: str, exclude: Collection[str] = ()) -> Optional[str]:
+        """Return the id of the chunk ``text`` duplicates, or register it under ``key`` and return None.
+
+        Chunks in ``exclude`` are never returned as a match.
+        """
+        digest, signature = content_hash(text), self.hasher.signature(text)
+        match = self._find(digest, signature, exclude)
+        if match is None:
+            self._insert(key, digest, signature)
+        return match
+
+    def add(self, key: str, text: str):
+        self._insert(key, content_hash(text), self.hasher.signature(text))
+
+    def remove(self, key: str):
+        entry = self.signatures.pop(key, None)
+        if entry is None:
+            return
+        digest, signature = entry
+        if self.hashes.get(digest) == key:
+            del self.hashes[digest]
+        for bucket, band in zip(self.buckets, self._band_keys(signature)):
+            bucket[band].discard(key)
+            if not bucket[band]:
+                del bucket[band]
+
+    def rename(self, key: str, new_key: str):
+        """Register the same content under another chunk id."""
+        digest, signature = self.signatures[key]
+        self.remove(key)
+        self._insert(new_key, digest, signature)
+
+    def save(self, path: str):
+        os.makedirs(path, exist_ok=True)
+        keys = list(self.signatures)
+        matrix = np.stack([self.signatures[key][1] for key in keys]) if keys else np.zeros((0, self.hasher.num_perm), dtype=np.uint32)
+        atomic_save_npy(os.path.join(path, "signatures.npy"), matrix)
+        atomic_write(os.path.join(path, "keys.json"), json.dumps(
+            {"num_perm": self.hasher.num_perm, "shingle_size": self.hasher.shingle_size,
+             "keys": keys, "hashes": [self.signatures[key][0] for key in keys]}))
+
+    @classmethod
+    def load_or_build(cls, path: str, chunk_ids: List[str], documents: Iterable[Document]) -> "ChunkDeduplicator":
+        """Load persisted signatures if they cover ``chunk_ids``, otherwise hash ``documents`` once.
+
+        ``documents`` is only iterated when the signatures have to be rebuilt.
+        """
+        deduplicator = cls()
+        keys_path = os.path.join(path, "keys.json")
+        if os.path.exists(keys_path):
+            try:
+                with open(keys_path) as f:
+                    header = json.load(f)
+                if (header["num_perm"] == deduplicator.hasher.num_perm
+                        and header["shingle_size"] == deduplicator.hasher.shingle_size
+                        and set(header["keys"]) == set(chunk_ids)):
+                    matrix = np.load(os.path.join(path, "signatures.npy"))
+                    for key, digest, signature in zip(header["keys"], header["hashes"], matrix):
+                        deduplicator._insert(key, digest, signature)
+                    return deduplicator
+            except Exception as e:
+                logger.error(f"Error loading dedup signatures from {path}: {e}")
+        for doc in documents:
+            deduplicator.add(doc.metadata.get("chunk_id"), doc.page_content)
+        if deduplicator:
+            logger.info(f"Built dedup signatures for {len(deduplicator)} chunks.")
+        return deduplicator
@@ -0,0 +1,276 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, defaultdict, deque
+from datetime import datetime
+from typing import List, Dict, Optional, Tuple
+from config_file import Configuration
+from utils import logger
+from metrics import CACHE_LOOKUPS, HISTORY_DROPPED
+
+
+class HistoryBackend:
+    """Storage for chat messages. Messages are dicts with userID, chatID, timestamp, role and content."""
+
+    async def ensure_indexes(self):
+        pass
+
+    async def insert_many(self, messages: List[Dict]):
+        raise NotImplementedError
+
+    async def recent(self, userID: str, chatID: str, limit: int) -> List[Dict]:
+        """The ``limit`` most recent messages of a chat, newest first."""
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class MemoryHistoryBackend(HistoryBackend):
+    """Process-local backend for tests and throwaway deployments."""
+
+    def __init__(self):
+        self._messages: Dict[Tuple[str, str], List[Dict]] = defaultdict(list)
+
+    async def insert_many(self, messages: List[Dict]):
+        for message in messages:
+            self._messages[(message["userID"], message["chatID"])].append(message)
+
+    async def recent(self, userID: str, chatID: str, limit: int) -> List[Dict]:
+        return self._messages.get((userID, chatID), [])[-limit:][::-1]
+
+
+class SQLiteHistoryBackend(HistoryBackend):
+    """Single-node backend storing messages in a local SQLite file."""
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS messages (id INTEGER PRIMARY KEY AUTOINCREMENT, userID TEXT NOT NULL, "
+            "chatID TEXT NOT NULL, timestamp TEXT NOT NULL, role TEXT NOT NULL, content TEXT NOT NULL)"
+        )
+        self._lock = threading.Lock()
+
+    async def ensure_indexes(self):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS messages_chat_time ON messages (userID, chatID, timestamp)")
+
+    def _insert_many(self, messages: List[Dict]):
+        rows = [(m["userID"], m["chatID"], m["timestamp"].isoformat(), m["role"], m["content"]) for m in messages]
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT INTO messages (userID, chatID, timestamp, role, content) VALUES (?, ?, ?, ?, ?)", rows)
+
+    def _recent(self, userID: str, chatID: str, limit: int) -> List[Dict]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT timestamp, role, content FROM messages WHERE userID = ? AND chatID = ? "
+                "ORDER BY timestamp DESC, id DESC LIMIT ?", (userID, chatID, limit)
+            ).fetchall()
+        return [{"userID": userID, "chatID": chatID, "timestamp": datetime.fromisoformat(timestamp),
+                 "role": role, "content": content} for timestamp, role, content in rows]
+
+    async def insert_many(self, messages: List[Dict]):
+        await asyncio.to_thread(self._insert_many, messages)
+
+    async def recent(self, userID: str, chatID: str, limit: int) -> List[Dict]:
+        return await asyncio.to_thread(self._recent, userID, chatID, limit)
+
+    async def close(self):
+        self._conn.close()
+
+
+class MongoHistoryBackend(HistoryBackend):
+    """MongoDB backend using the async motor driver and a shared connection pool."""
+
+    def __init__(self, uri: str = Configuration.MONGO_URI, database: str = Configuration.MONGO_DB,
+                 collection: str = Configuration.MONGO_COLLECTION):
+        from motor.motor_asyncio import AsyncIOMotorClient
+        from pymongo.server_api import ServerApi
+
+        self.client = AsyncIOMotorClient(
+            uri,
+            server_api=ServerApi('1'),
+            maxPoolSize=Configuration.MONGO_MAX_POOL_SIZE,
+            minPoolSize=Configuration.MONGO_MIN_POOL_SIZE,
+            maxIdleTimeMS=Configuration.MONGO_MAX_IDLE_MS,
+            serverSelectionTimeoutMS=Configuration.MONGO_TIMEOUT_MS,
+            retryWrites=True,
+        )
+        self.collection = self.client[database][collection]
+
+    async def ensure_indexes(self):
+        await self.collection.create_index([("userID", 1), ("chatID", 1), ("timestamp", -1)])
+
+    async def insert_many(self, messages: List[Dict]):
+        # insert_many mutates its input with _id fields; keep the cached dicts clean
+        await self.collection.insert_many([dict(message) for message in messages], ordered=False)
+
+    async def recent(self, userID: str, chatID: str, limit: int) -> List[Dict]:
+        cursor = self.collection.find(
+            {"userID": userID, "chatID": chatID},
+            projection={"_id": False},
+            sort=[("timestamp", -1)],
+            limit=limit,
+        )
+        return await cursor.to_list(length=limit)
+
+    async def close(self):
+        self.client.close()
+
+
+def create_history_backend(kind: str = Configuration.HISTORY_BACKEND) -> HistoryBackend:
+    if kind == "mongo":
+        return MongoHistoryBackend()
+    if kind == "sqlite":
+        return SQLiteHistoryBackend(Configuration.HISTORY_SQLITE_PATH)
+    if kind == "memory":
+        return MemoryHistoryBackend()
+    raise ValueError(f"Unknown history backend: {kind}")
+
+
+class _Window(deque):
+    """Cached recent messages of one chat, oldest first, with the time they were read from the backend."""
+    loaded_at = 0.0
+
+
+class ChatHistory:
+    """Chat history with write-behind batching and an LRU of recent turns per chat.
+
+    ``append`` only touches memory: messages go into the chat's cached window
+    and a write buffer that a background task flushes to the backend in bulk.
+    ``recent`` is served from the cached window when it holds enough turns and
+    was read from the backend less than ``cache_ttl`` seconds ago; otherwise
+    pending writes are flushed and the window is loaded again. The cache is per
+    process, so with several workers a window can miss turns written through
+    other workers for up to ``cache_ttl`` seconds (plus their flush interval);
+    routing a chat to the same worker avoids that.
+
+    While the backend is unreachable, failed batches stay buffered and are
+    retried on the next flush; beyond ``max_pending`` messages the oldest are
+    dropped, so an outage cannot grow the process without bound.
+    """
+
+    def __init__(self, backend: HistoryBackend, cache_sessions: int = Configuration.HISTORY_CACHE_SESSIONS,
+                 cache_turns: int = Configuration.HISTORY_CACHE_TURNS,
+                 cache_ttl: float = Configuration.HISTORY_CACHE_TTL,
+                 flush_interval: float = Configuration.HISTORY_FLUSH_INTERVAL,
+                 batch_size: int = Configuration.HISTORY_BATCH_SIZE,
+                 max_pending: int = Configuration.HISTORY_MAX_PENDING):
+        self.backend = backend
+        self.cache_sessions = cache_sessions
+        self.cache_turns = cache_turns
+        self.cache_ttl = cache_ttl
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self._sessions: "OrderedDict[Tuple[str, str], _Window]" = OrderedDict()
+        self._pending: List[Dict] = []
+        self._flush_lock: Optional[asyncio.Lock] = None  # Created on the serving event loop
+        self._flusher: Optional[asyncio.Task] = None
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.dropped = 0
+
+    async def start(self):
+        try:
+            await self.backend.ensure_indexes()
+        except Exception as e:
+            logger.error(f"Error creating chat history indexes: {e}")
+        self._flusher = asyncio.get_running_loop().create_task(self._flush_periodically())
+
+    async def close(self):
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        await self.flush()
+        await self.backend.close()
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def _lock(self) -> asyncio.Lock:
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        return self._flush_lock
+
+    async def flush(self):
+        """Write buffered messages to the backend in one bulk insert."""
+        async with self._lock():
+            await self._write_pending()
+
+    async def _write_pending(self):
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        try:
+            await self.backend.insert_many(batch)
+        except Exception as e:
+            logger.error(f"Error storing {len(batch)} chat messages: {e}")
+            self._pending = batch + self._pending  # Retry on the next flush
+            self._trim_pending()
+
+    def _trim_pending(self):
+        """Drop the oldest unsaved messages beyond ``max_pending``."""
+        overflow = len(self._pending) - self.max_pending
+        if overflow > 0:
+            del self._pending[:overflow]
+            self.dropped += overflow
+            HISTORY_DROPPED.inc(overflow)
+            logger.warning(f"Chat history write buffer full: dropped the {overflow} oldest unsaved messages.")
+
+    def _remember(self, key: Tuple[str, str], window: "_Window"):
+        self._sessions[key] = window
+        self._sessions.move_to_end(key)
+        while len(self._sessions) > self.cache_sessions:
+            self._sessions.popitem(last=False)
+
+    async def append(self, userID: str, chatID: str, role: str, content: str):
+        """Record one message."""
+        message = {"userID": userID, "chatID": chatID, "timestamp": datetime.now(), "role": role, "content": content}
+        window = self._sessions.get((userID, chatID))
+        if window is not None:
+            window.append(message)
+            self._sessions.move_to_end((userID, chatID))
+        self._pending.append(message)
+        self._trim_pending()
+        if len(self._pending) >= self.batch_size:
+            await self.flush()
+
+    async def recent(self, userID: str, chatID: str, limit: int = 5) -> List[Dict[str, str]]:
+        """The ``limit`` most recent messages of a chat as role/content dicts, newest first."""
+        key = (userID, chatID)
+        window = self._sessions.get(key)
+        if window is not None and limit <= self.cache_turns and time.monotonic() - window.loaded_at < self.cache_ttl:
+            self.cache_hits += 1
+            CACHE_LOOKUPS.inc(cache="history", result="hit")
+            self._sessions.move_to_end(key)
+        else:
+            self.cache_misses += 1
+            CACHE_LOOKUPS.inc(cache="history", result="miss")
+            loaded_at = time.monotonic()
+            # Holding the flush lock keeps the flusher from draining the buffer while the backend is
+            # queried: every earlier message is then either in the backend's answer or still buffered
+            async with self._lock():
+                await self._write_pending()
+                messages = await self.backend.recent(userID, chatID, max(limit, self.cache_turns))
+                messages = [m for m in self._pending if m["userID"] == userID and m["chatID"] == chatID][::-1] + messages
+            if limit > self.cache_turns:
+                return [{"role": m["role"], "content": m["content"]} for m in messages[:limit]]
+            window = _Window(reversed(messages[:self.cache_turns]), maxlen=self.cache_turns)
+            window.loaded_at = loaded_at
+            self._remember(key, window)
+        return [{"role": m["role"], "content": m["content"]} for m in list(window)[::-1][:limit]]
+
+    def stats(self) -> Dict[str, int]:
+        return {"sessions": len(self._sessions), "pending": len(self._pending), "dropped": self.dropped,
+                "cache_hits": self.cache_hits, "cache_misses": self.cache_misses}
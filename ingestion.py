@@ -0,0 +1,257 @@
+import asyncio
+import contextlib
+import json
+import os
+import shutil
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field, asdict
+from typing import List, Dict, Optional, Tuple
+from langchain.schema import Document
+from config_file import Configuration
+from corpus import Corpus, CorpusWriter, chunk_id
+from utils import load_and_chunk_pdf, logger, atomic_write
+from metrics import INGESTED_CHUNKS
+
+
+@dataclass
+class SourceFile:
+    """An uploaded file on disk, with the name and content fingerprint it is indexed under."""
+    path: str
+    name: str
+    fingerprint: str
+
+
+def parse_source(source: SourceFile) -> List[Document]:
+    """Load and chunk one PDF, tagging chunks with their source and chunk id.
+
+    Runs in a worker process, so it must stay a picklable module-level function.
+    """
+    chunks = load_and_chunk_pdf(source.path)
+    for chunk in chunks:
+        chunk.metadata["source"] = source.name
+        chunk.metadata["fingerprint"] = source.fingerprint
+        chunk.metadata["chunk_id"] = chunk_id(source.name, chunk.metadata.get("page"), chunk.page_content)
+    return chunks
+
+
+@dataclass
+class IngestionJob:
+    """Progress of one background upload."""
+    job_id: str
+    files: int
+    status: str = "queued"  # queued, running, completed or failed
+    files_parsed: int = 0
+    files_unchanged: int = 0
+    pages: int = 0
+    chunks: int = 0
+    chunks_unchanged: int = 0
+    chunks_collapsed: int = 0  # New chunks stored as references to an existing duplicate
+    embedded: int = 0
+    error: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+
+    def to_dict(self) -> Dict:
+        return asdict(self)
+
+
+class IngestionManager:
+    """Runs PDF ingestion as background jobs.
+
+    PDFs are parsed and chunked in a process pool (pypdf parsing is CPU-bound,
+    so threads would serialise on the GIL). Chunks flow through a bounded queue
+    into the indexing callback in fixed-size batches; when indexing falls
+    behind, the queue fills up and parsing waits, so memory stays bounded by
+    the queue size rather than by the size of the upload.
+
+    A job holds its corpus's write lock from start to finish, so uploads to the
+    same chat are applied one after the other, also across worker processes,
+    and the result is published as one new snapshot generation. Waiting jobs
+    queue on an ``asyncio.Lock`` per chat and poll the file lock without
+    blocking, so they never tie up executor threads. Job progress is also
+    written to ``jobs_dir``, so any worker can answer a status query.
+    """
+
+    def __init__(self, workers: int = Configuration.INGEST_WORKERS, batch_size: int = Configuration.INGEST_BATCH_SIZE,
+                 queue_size: int = Configuration.INGEST_QUEUE_SIZE, max_jobs: int = Configuration.INGEST_MAX_JOBS,
+                 jobs_dir: str = Configuration.INGEST_JOBS_DIR, lock_poll: float = Configuration.INGEST_LOCK_POLL):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.max_jobs = max_jobs
+        self.jobs_dir = jobs_dir
+        self.lock_poll = lock_poll
+        self.jobs: Dict[str, IngestionJob] = {}
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._tasks = set()
+        self._corpus_locks: Dict[str, Tuple[asyncio.Lock, int]] = {}  # tenant -> (lock, jobs holding or waiting)
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    def _job_path(self, job_id: str) -> Optional[str]:
+        try:
+            return os.path.join(self.jobs_dir, f"{uuid.UUID(job_id)}.json")
+        except ValueError:
+            return None  # Not a job id; never turned into a path
+
+    def _save(self, job: IngestionJob):
+        try:
+            os.makedirs(self.jobs_dir, exist_ok=True)
+            atomic_write(self._job_path(job.job_id), json.dumps(job.to_dict()))
+        except OSError as e:
+            logger.error(f"Error saving status of ingestion job {job.job_id}: {e}")
+
+    def get(self, job_id: str) -> Optional[IngestionJob]:
+        """A job of this process, or the last saved status of one run by another worker."""
+        job = self.jobs.get(job_id)
+        if job is not None:
+            return job
+        path = self._job_path(job_id)
+        if path is None:
+            return None
+        try:
+            with open(path) as f:
+                return IngestionJob(**json.load(f))
+        except (OSError, ValueError, TypeError):
+            return None
+
+    def submit(self, corpus: Corpus, sources: List[SourceFile], cleanup_dir: Optional[str] = None) -> IngestionJob:
+        """Start ingesting ``sources`` into ``corpus`` in the background and return the job handle.
+
+        Jobs for the same corpus are serialised by its write lock; jobs for
+        other corpora run concurrently. ``cleanup_dir`` is removed when the job ends.
+        """
+        job = IngestionJob(job_id=str(uuid.uuid4()), files=len(sources))
+        self.jobs[job.job_id] = job
+        self._save(job)
+        self._evict_finished_jobs()
+        task = asyncio.get_running_loop().create_task(self._run(job, corpus, sources, cleanup_dir))
+        self._tasks.add(task)  # Keep a strong reference until the task finishes
+        task.add_done_callback(self._tasks.discard)
+        return job
+
+    def _evict_finished_jobs(self):
+        finished = [job for job in self.jobs.values() if job.finished_at is not None]
+        for job in sorted(finished, key=lambda j: j.finished_at)[:max(0, len(self.jobs) - self.max_jobs)]:
+            del self.jobs[job.job_id]
+            try:
+                os.remove(self._job_path(job.job_id))
+            except OSError:
+                pass
+
+    @contextlib.asynccontextmanager
+    async def _corpus_lock(self, tenant: str):
+        """Serialise this process's jobs for one corpus on the event loop."""
+        lock, users = self._corpus_locks.get(tenant, (None, 0))
+        lock = lock or asyncio.Lock()
+        self._corpus_locks[tenant] = (lock, users + 1)
+        try:
+            async with lock:
+                yield
+        finally:
+            lock, users = self._corpus_locks[tenant]
+            if users == 1:
+                del self._corpus_locks[tenant]
+            else:
+                self._corpus_locks[tenant] = (lock, users - 1)
+
+    async def _acquire_writer(self, corpus: Corpus) -> CorpusWriter:
+        """Take the corpus's write lock without holding an executor thread while it is busy."""
+        while True:
+            writer = await asyncio.to_thread(corpus.writer, False)
+            if writer is not None:
+                return writer
+            await asyncio.sleep(self.lock_poll)  # Another process (or a deletion) is writing this chat
+
+    async def _run(self, job: IngestionJob, corpus: Corpus, sources: List[SourceFile], cleanup_dir):
+        async with self._corpus_lock(corpus.tenant):
+            await self._ingest(job, corpus, sources, cleanup_dir)
+
+    async def _ingest(self, job: IngestionJob, corpus: Corpus, sources: List[SourceFile], cleanup_dir):
+        writer: Optional[CorpusWriter] = None
+        producer = consumer = None
+        try:
+            writer = await self._acquire_writer(corpus)
+            job.status = "running"
+            self._save(job)
+            queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+            parsed: List[Tuple[SourceFile, List[str]]] = []
+            producer = asyncio.ensure_future(self._produce(job, writer, sources, queue, parsed))
+            consumer = asyncio.ensure_future(self._consume(job, writer, queue))
+            await asyncio.wait({producer, consumer}, return_when=asyncio.FIRST_COMPLETED)
+            if consumer.done():
+                consumer.result()  # Indexing failed while parsing was still running
+            await producer
+            await queue.put(None)
+            await consumer
+            await asyncio.to_thread(self._commit, writer, parsed)
+            job.status = "completed"
+            logger.info(f"Ingestion job {job.job_id} completed: {job.pages} pages, {job.chunks} chunks "
+                        f"({job.chunks_collapsed} duplicates collapsed).")
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e)
+            logger.error(f"Ingestion job {job.job_id} failed: {e}")
+        finally:
+            for task in (producer, consumer):
+                if task is not None:
+                    task.cancel()
+            if writer is not None:
+                writer.close()
+            job.finished_at = time.time()
+            self._save(job)
+            if cleanup_dir:
+                shutil.rmtree(cleanup_dir, ignore_errors=True)
+
+    async def _produce(self, job: IngestionJob, writer: CorpusWriter, sources: List[SourceFile], queue: asyncio.Queue,
+                       parsed: List[Tuple[SourceFile, List[str]]]):
+        """Parse files in the process pool, keeping at most ``workers`` in flight."""
+        loop = asyncio.get_running_loop()
+        semaphore = asyncio.Semaphore(self.workers)
+
+        async def parse(source: SourceFile):
+            if writer.is_ingested(source.name, source.fingerprint):
+                job.files_unchanged += 1
+                return
+            async with semaphore:
+                chunks = await loop.run_in_executor(self.executor, parse_source, source)
+                job.files_parsed += 1
+                job.pages += len({doc.metadata.get("page") for doc in chunks})
+                job.chunks += len(chunks)
+                parsed.append((source, [doc.metadata["chunk_id"] for doc in chunks]))
+                for start in range(0, len(chunks), self.batch_size):
+                    await queue.put(chunks[start:start + self.batch_size])
+
+        await asyncio.gather(*(parse(source) for source in sources))
+
+    async def _consume(self, job: IngestionJob, writer: CorpusWriter, queue: asyncio.Queue):
+        while True:
+            batch = await queue.get()
+            if batch is None:
+                return
+            added, collapsed = await asyncio.to_thread(writer.add_documents, batch)
+            job.embedded += added
+            job.chunks_collapsed += collapsed
+            job.chunks_unchanged += len(batch) - added - collapsed
+            INGESTED_CHUNKS.inc(added, result="embedded")
+            INGESTED_CHUNKS.inc(collapsed, result="collapsed")
+            INGESTED_CHUNKS.inc(len(batch) - added - collapsed, result="unchanged")
+            self._save(job)
+
+    @staticmethod
+    def _commit(writer: CorpusWriter, parsed: List[Tuple[SourceFile, List[str]]]):
+        """Replace previous versions of the parsed sources and publish the new generation."""
+        for source, chunk_ids in parsed:
+            writer.commit_source(source.name, source.fingerprint, chunk_ids)
+        writer.publish()
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,212 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_labels(labelnames: Sequence[str], values: Tuple[str, ...]) -> str:
+    if not labelnames:
+        return ""
+    pairs = ",".join('{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+                     for name, value in zip(labelnames, values))
+    return "{" + pairs + "}"
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"] + self._samples()
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """Monotonically increasing value per label set."""
+
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in items]
+
+
+class Histogram(_Metric):
+    """Bucketed distribution per label set; observing is a bisect and three additions."""
+
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._counts: Dict[Tuple[str, ...], List[int]] = {}
+        self._sums: Dict[Tuple[str, ...], float] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._counts.get(key)
+            if counts is None:
+                counts = self._counts[key] = [0] * (len(self.buckets) + 1)
+                self._sums[key] = 0.0
+            counts[index] += 1
+            self._sums[key] += value
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = [(key, list(counts), self._sums[key]) for key, counts in self._counts.items()]
+        lines = []
+        for key, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                labels = _format_labels(self.labelnames + ("le",), key + (le,))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """Process-local metrics rendered in the Prometheus text exposition format.
+
+    Each worker process keeps its own values; scrape every worker (or run one
+    worker per pod) to get complete numbers.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def _register(self, metric: _Metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric already registered: {metric.name}")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(line for metric in self._metrics.values() for line in metric.render()) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+REQUEST_SECONDS = REGISTRY.histogram(
+    "rag_http_request_duration_seconds", "HTTP request latency until the response starts.", ["route", "status"])
+STAGE_SECONDS = REGISTRY.histogram(
+    "rag_stage_duration_seconds", "Latency of each query pipeline stage.", ["stage"])
+LLM_CALLS = REGISTRY.counter("rag_llm_calls_total", "Calls to the generation model.", ["operation"])
+LLM_ERRORS = REGISTRY.counter("rag_llm_errors_total", "Failed calls to the generation model.", ["operation"])
+LLM_TOKENS = REGISTRY.counter("rag_llm_tokens_total", "Prompt and completion tokens sent to and produced by the generation model.", ["kind"])
+EMBEDDING_CALLS = REGISTRY.counter("rag_embedding_calls_total", "Batched calls to the embedding model.", ["kind"])
+EMBEDDED_TEXTS = REGISTRY.counter("rag_embedded_texts_total", "Texts embedded by the embedding model.", ["kind"])
+DOCUMENTS_SCORED = REGISTRY.counter("rag_documents_scored_total", "Documents scored per retrieval arm or reranker.", ["scorer"])
+CACHE_LOOKUPS = REGISTRY.counter("rag_cache_lookups_total", "Cache lookups by cache and outcome.", ["cache", "result"])
+INGESTED_CHUNKS = REGISTRY.counter("rag_ingested_chunks_total", "Chunks processed by ingestion jobs.", ["result"])
+SCHEDULER_REJECTED = REGISTRY.counter("rag_scheduler_rejected_total", "Model calls rejected by a request scheduler.", ["scheduler", "reason"])
+SCHEDULER_RETRIES = REGISTRY.counter("rag_scheduler_retries_total", "Model calls retried after a quota or availability error.", ["scheduler"])
+HISTORY_DROPPED = REGISTRY.counter("rag_history_dropped_messages_total", "Unsaved chat messages dropped because the history write buffer was full.")
+SCHEDULER_COALESCED = REGISTRY.counter("rag_scheduler_coalesced_total", "Model calls served by an identical call already in flight.", ["scheduler"])
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about four characters per token) for models that do not report usage."""
+    return (len(text) + 3) // 4
+
+
+def record_llm_usage(prompt: str, message, operation: str):
+    """Count one LLM call and its tokens, preferring the usage the provider reports."""
+    LLM_CALLS.inc(operation=operation)
+    usage = getattr(message, "usage_metadata", None) or {}
+    LLM_TOKENS.inc(usage.get("input_tokens") or estimate_tokens(prompt), kind="prompt")
+    LLM_TOKENS.inc(usage.get("output_tokens") or estimate_tokens(message.content), kind="completion")
+
+
+def record_embedding_call(texts: int, kind: str):
+    """Count one call that reaches the embedding model, with the number of texts it embeds."""
+    EMBEDDING_CALLS.inc(kind=kind)
+    EMBEDDED_TEXTS.inc(texts, kind=kind)
+
+
+@contextmanager
+def span(stage: str):
+    """Time a block into ``rag_stage_duration_seconds``."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage)
+
+
+class InstrumentedLLM:
+    """Chat model wrapper counting calls and tokens; exposes invoke, ainvoke and astream."""
+
+    def __init__(self, llm):
+        self.llm = llm
+
+    def invoke(self, prompt: str):
+        try:
+            message = self.llm.invoke(prompt)
+        except Exception:
+            LLM_ERRORS.inc(operation="invoke")
+            raise
+        record_llm_usage(prompt, message, "invoke")
+        return message
+
+    async def ainvoke(self, prompt: str):
+        try:
+            message = await self.llm.ainvoke(prompt)
+        except Exception:
+            LLM_ERRORS.inc(operation="ainvoke")
+            raise
+        record_llm_usage(prompt, message, "ainvoke")
+        return message
+
+    async def astream(self, prompt: str):
+        LLM_CALLS.inc(operation="astream")
+        LLM_TOKENS.inc(estimate_tokens(prompt), kind="prompt")
+        try:
+            async for chunk in self.llm.astream(prompt):
+                LLM_TOKENS.inc(estimate_tokens(chunk.content), kind="completion")
+                yield chunk
+        except Exception:
+            LLM_ERRORS.inc(operation="astream")
+            raise
+
+    def __getattr__(self, name):
+        return getattr(self.llm, name)
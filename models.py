@@ -1,7 +1,211 @@
-from langchain_google_genai import GoogleGenerativeAIEmbeddings, ChatGoogleGenerativeAI
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, List, Tuple
+from langchain.schema.embeddings import Embeddings
 from config_file import Configuration
+from cache import CachedEmbeddings, SQLiteEmbeddingCache
+from metrics import InstrumentedLLM, record_embedding_call
+from scheduler import RequestScheduler, ScheduledEmbeddings, ScheduledLLM
+from utils import logger
+
+
+class QueryBatcher:
+    """Coalesces concurrent single-text embedding calls into one batched call.
+
+    The first pending text opens a window of ``max_wait`` seconds; texts that
+    arrive meanwhile, up to ``max_batch``, share its forward pass.
+    """
+
+    def __init__(self, embed_batch: Callable[[List[str]], List[List[float]]], max_batch: int, max_wait: float):
+        self.embed_batch = embed_batch
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._pending: List[Tuple[str, Future]] = []
+        self._condition = threading.Condition()
+        self._worker = None
+
+    def embed(self, text: str) -> List[float]:
+        future: Future = Future()
+        with self._condition:
+            self._pending.append((text, future))
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="query-batcher", daemon=True)
+                self._worker.start()
+            self._condition.notify()
+        return future.result()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+                deadline = time.monotonic() + self.max_wait
+                while len(self._pending) < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                batch, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+            try:
+                vectors = self.embed_batch([text for text, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), vector in zip(batch, vectors):
+                future.set_result(vector)
+
+
+class LocalEmbeddings(Embeddings):
+    """Embedding model running on the local CPU, so ingestion is bound by cores rather than API quotas.
+
+    Texts are tokenized once, sorted by length and grouped into batches capped
+    at ``batch_size`` texts and ``batch_tokens`` padded tokens, so short chunks
+    are not padded to the longest one and long ones do not blow up memory.
+    Concurrent queries are coalesced by a ``QueryBatcher``. ``runtime`` is
+    "torch", "int8" (dynamically quantized linear layers) or "onnx" (ONNX
+    Runtime through optimum).
+    """
+
+    def __init__(self, model_name: str = Configuration.LOCAL_EMBEDDING_MODEL,
+                 runtime: str = Configuration.LOCAL_EMBEDDING_RUNTIME, pooling: str = Configuration.LOCAL_EMBEDDING_POOLING,
+                 query_prefix: str = Configuration.LOCAL_EMBEDDING_QUERY_PREFIX,
+                 batch_size: int = Configuration.LOCAL_EMBEDDING_BATCH_SIZE,
+                 batch_tokens: int = Configuration.LOCAL_EMBEDDING_BATCH_TOKENS,
+                 max_length: int = Configuration.LOCAL_EMBEDDING_MAX_LENGTH,
+                 threads: int = Configuration.LOCAL_EMBEDDING_THREADS,
+                 batch_wait: float = Configuration.LOCAL_EMBEDDING_BATCH_WAIT):
+        if pooling not in ("cls", "mean"):
+            raise ValueError(f"Unknown pooling: {pooling}")
+        from transformers import AutoTokenizer  # Deferred: importing transformers takes seconds
+
+        self.model_name = model_name
+        self.runtime = runtime
+        self.pooling = pooling
+        self.query_prefix = query_prefix
+        self.batch_size = batch_size
+        self.batch_tokens = batch_tokens
+        self.max_length = max_length
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.model = self._load_model(model_name, runtime, threads)
+        self._queries = QueryBatcher(self._embed_queries, batch_size, batch_wait) if batch_wait > 0 else None
+        logger.info(f"Loaded local embedding model: {model_name} (runtime={runtime})")
+
+    @staticmethod
+    def _load_model(model_name: str, runtime: str, threads: int):
+        if runtime == "onnx":
+            try:
+                import onnxruntime
+                from optimum.onnxruntime import ORTModelForFeatureExtraction
+            except ImportError as e:
+                raise ImportError("The 'onnx' embedding runtime requires `pip install optimum[onnxruntime]`.") from e
+            options = onnxruntime.SessionOptions()
+            if threads:
+                options.intra_op_num_threads = threads
+            return ORTModelForFeatureExtraction.from_pretrained(model_name, export=True, session_options=options)
+
+        import torch
+        from transformers import AutoModel
+
+        if threads:
+            torch.set_num_threads(threads)  # Process-wide: the reranker shares the same pool
+        model = AutoModel.from_pretrained(model_name)
+        model.eval()
+        if runtime == "int8":
+            model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        elif runtime != "torch":
+            raise ValueError(f"Unknown embedding runtime: {runtime}")
+        return model
+
+    def _batches(self, lengths: List[int]) -> List[List[int]]:
+        """Indices grouped into length-sorted batches within the text and padded-token limits."""
+        batches, batch = [], []
+        for i in sorted(range(len(lengths)), key=lengths.__getitem__):
+            if batch and (len(batch) == self.batch_size or (len(batch) + 1) * lengths[i] > self.batch_tokens):
+                batches.append(batch)
+                batch = []
+            batch.append(i)
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def _pool(self, hidden, attention_mask):
+        if self.pooling == "cls":
+            return hidden[:, 0]
+        mask = attention_mask.unsqueeze(-1).to(hidden.dtype)
+        return (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+
+    def _embed(self, texts: List[str], kind: str = "document") -> List[List[float]]:
+        import torch
+
+        if not texts:
+            return []
+        record_embedding_call(len(texts), kind)
+        encoded = self.tokenizer(texts, truncation=True, max_length=self.max_length)
+        vectors: List[List[float]] = [[] for _ in texts]
+        with torch.inference_mode():
+            for batch in self._batches([len(ids) for ids in encoded["input_ids"]]):
+                features = self.tokenizer.pad({key: [encoded[key][i] for i in batch] for key in encoded.keys()},
+                                              return_tensors="pt")
+                hidden = self.model(**features).last_hidden_state
+                pooled = torch.nn.functional.normalize(self._pool(hidden, features["attention_mask"]).float(), dim=-1)
+                for i, vector in zip(batch, pooled.tolist()):
+                    vectors[i] = vector
+        return vectors
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._embed(texts)
+
+    def _embed_queries(self, texts: List[str]) -> List[List[float]]:
+        return self._embed(texts, kind="query")
+
+    def embed_query(self, text: str) -> List[float]:
+        if self._queries is not None:
+            return self._queries.embed(self.query_prefix + text)
+        return self._embed_queries([self.query_prefix + text])[0]
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        return self._embed_queries([self.query_prefix + text for text in texts])
+
+
+def create_embeddings(backend: str = Configuration.EMBEDDING_BACKEND) -> Embeddings:
+    """Embedding model for the configured backend, behind the embedding cache if enabled."""
+    if backend == "gemini":
+        from langchain_google_genai import GoogleGenerativeAIEmbeddings
+
+        model_name = Configuration.EMBEDDING_MODEL
+        embeddings = ScheduledEmbeddings(GoogleGenerativeAIEmbeddings(model=model_name),
+                                         RequestScheduler.for_embeddings(), model_name)
+    elif backend == "local":
+        embeddings = LocalEmbeddings()
+        model_name = embeddings.model_name
+    else:
+        raise ValueError(f"Unknown embedding backend: {backend}")
+    if Configuration.EMBEDDING_CACHE_ENABLED:
+        store = SQLiteEmbeddingCache(Configuration.EMBEDDING_CACHE_PATH) if Configuration.EMBEDDING_CACHE_PATH else None
+        embeddings = CachedEmbeddings(embeddings, model_name, Configuration.EMBEDDING_CACHE_SIZE, store)
+    return embeddings
+
 
 class GeminiModel:
+    _instance = None
+    _instance_lock = threading.Lock()
+
     def __init__(self):
-        self.embeddings = GoogleGenerativeAIEmbeddings(model=Configuration.EMBEDDING_MODEL)
-        self.llm = ChatGoogleGenerativeAI(model=Configuration.GENERATION_MODEL, temperature=0.3)
\ No newline at end of file
+        # Imported here so that importing this module stays cheap until the clients are needed
+        from langchain_google_genai import ChatGoogleGenerativeAI
+
+        self.embeddings = create_embeddings()
+        # Retries happen in the scheduler, which also sees the concurrency and rate limits
+        chat_model = ChatGoogleGenerativeAI(model=Configuration.GENERATION_MODEL, temperature=0.3, max_retries=1)
+        self.llm = ScheduledLLM(InstrumentedLLM(chat_model), RequestScheduler.for_llm())
+
+    @classmethod
+    def get_instance(cls) -> "GeminiModel":
+        """Return the process-wide Gemini clients, creating them on first use."""
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    cls._instance = cls()
+        return cls._instance
@@ -0,0 +1,183 @@
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, List, Dict, Optional, Tuple
+from langchain.schema import Document
+from config_file import Configuration
+from prompts import AdvancedPrompts
+from retrieval import MetadataExtractor, CorpusStatistics
+from metrics import STAGE_SECONDS
+from context import ContextBuilder
+
+
+@dataclass
+class PipelineOptions:
+    """Per-request switches for the optional pipeline stages."""
+    history_check: bool = True
+    metadata_extraction: bool = True
+    query_rewrite: bool = True
+    metadata_filter: bool = True
+    rerank: bool = True
+
+
+@dataclass
+class PipelineResult:
+    answer: str
+    sources: List[str]
+    documents: List[Document] = field(default_factory=list)
+    timings: Dict[str, float] = field(default_factory=dict)
+
+
+@dataclass
+class PreparedQuery:
+    """Everything the generation stage needs: the final prompt and where its context came from."""
+    prompt: str
+    sources: List[str]
+    documents: List[Document] = field(default_factory=list)
+
+
+class StageTimer:
+    """Collects wall-clock milliseconds per pipeline stage and feeds the stage latency histogram."""
+
+    def __init__(self):
+        self.timings: Dict[str, float] = {}
+
+    def record(self, stage: str, start: float):
+        seconds = time.perf_counter() - start
+        self.timings[stage] = round(seconds * 1000, 2)
+        STAGE_SECONDS.observe(seconds, stage=stage)
+
+    async def run(self, stage: str, awaitable):
+        start = time.perf_counter()
+        try:
+            return await awaitable
+        finally:
+            self.record(stage, start)
+
+
+async def cancel_all(tasks):
+    """Cancel ``tasks`` and wait for them, so none keeps running or leaves an exception unretrieved."""
+    tasks = list(tasks)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+class QueryPipeline:
+    """Async RAG query pipeline.
+
+    The history check, metadata extraction and query rewrite only depend on the
+    question and chat history, so they are issued concurrently with ``ainvoke``.
+    Blocking retrieval and reranking run in worker threads so the event loop
+    stays free for other requests.
+    """
+
+    def __init__(self, llm, retriever, reranker, statistics: Optional[CorpusStatistics] = None,
+                 context_builder: Optional[ContextBuilder] = None):
+        self.llm = llm
+        self.retriever = retriever
+        self.reranker = reranker
+        self.statistics = statistics
+        self.context_builder = context_builder or ContextBuilder()
+
+    async def _ask(self, prompt: str) -> str:
+        return (await self.llm.ainvoke(prompt)).content
+
+    async def _can_answer_from_history(self, question: str, chat_history: List[Dict[str, str]]) -> bool:
+        response = await self._ask(AdvancedPrompts.can_answer_from_history_prompt(question, chat_history))
+        return response.strip().lower().startswith("yes")
+
+    async def _prepare(self, question: str, chat_history: List[Dict[str, str]], top_k: int,
+                       options: PipelineOptions, timer: StageTimer) -> PreparedQuery:
+        """Run every stage up to (not including) answer generation."""
+        enhanced_query = AdvancedPrompts.enhance_query_with_history_prompt(question, chat_history)
+
+        # Stage 1: independent LLM calls, issued concurrently
+        history_task = None
+        if options.history_check and chat_history:
+            history_task = asyncio.ensure_future(
+                timer.run("history_check", self._can_answer_from_history(question, chat_history)))
+        tasks = {}
+        if options.metadata_extraction:
+            tasks["metadata"] = asyncio.ensure_future(
+                timer.run("metadata_extraction", MetadataExtractor.aextract_from_query(enhanced_query, self.llm)))
+        if options.query_rewrite:
+            tasks["rewrite"] = asyncio.ensure_future(
+                timer.run("query_rewrite", self._ask(AdvancedPrompts.retrieval_prompt(enhanced_query))))
+
+        try:
+            answer_from_history = history_task is not None and await history_task
+            results = {} if answer_from_history else dict(zip(tasks, await asyncio.gather(*tasks.values())))
+        except BaseException:
+            # One call failed (or the request was cancelled): stop the others rather than leak them
+            await cancel_all(tasks.values())
+            raise
+        if answer_from_history:
+            await cancel_all(tasks.values())
+            prompt = AdvancedPrompts.answer_from_history_prompt(chat_history, question)
+            return PreparedQuery(prompt=prompt, sources=["chat_history"])
+
+        query_metadata = results.get("metadata", {})
+        search_query = results.get("rewrite", question)
+
+        # Stage 2: metadata the corpus actually contains becomes a retrieval pre-filter
+        filters = {}
+        if options.metadata_filter and self.statistics is not None:
+            filters = self.statistics.build_filter(query_metadata)
+
+        # Stage 3: retrieval and reranking off the event loop
+        documents = await timer.run("retrieval", asyncio.to_thread(
+            self.retriever.retrieve, search_query, top_k, filters))
+        if options.rerank:
+            documents = await timer.run("rerank", asyncio.to_thread(self.reranker.rerank, search_query, documents))
+        else:
+            documents = documents[:Configuration.TOP_N]
+
+        # Merge overlapping chunks and fit them into the context token budget
+        context, passages = self.context_builder.build(documents)
+        return PreparedQuery(
+            prompt=AdvancedPrompts.generation_prompt(context, question),
+            sources=[passage.citation for passage in passages],
+            documents=documents,
+        )
+
+    async def run(self, question: str, chat_history: List[Dict[str, str]], top_k: int = Configuration.TOP_K,
+                  options: Optional[PipelineOptions] = None) -> PipelineResult:
+        timer = StageTimer()
+        start = time.perf_counter()
+        prepared = await self._prepare(question, chat_history, top_k, options or PipelineOptions(), timer)
+
+        # Stage 4: answer generation
+        answer = await timer.run("generation", self._ask(prepared.prompt))
+
+        timer.record("total", start)
+        return PipelineResult(answer=answer, sources=prepared.sources, documents=prepared.documents,
+                              timings=timer.timings)
+
+    async def stream(self, question: str, chat_history: List[Dict[str, str]], top_k: int = Configuration.TOP_K,
+                     options: Optional[PipelineOptions] = None) -> AsyncIterator[Tuple[str, Any]]:
+        """Like ``run``, but yields ``(event, data)`` pairs as soon as they are available.
+
+        Emits ``("sources", [...])`` once retrieval is done, then one
+        ``("token", text)`` per chunk streamed by the LLM, and finally
+        ``("done", PipelineResult)``.
+        """
+        timer = StageTimer()
+        start = time.perf_counter()
+        prepared = await self._prepare(question, chat_history, top_k, options or PipelineOptions(), timer)
+        yield "sources", prepared.sources
+
+        generation_start = time.perf_counter()
+        parts = []
+        async for chunk in self.llm.astream(prepared.prompt):
+            if not chunk.content:
+                continue
+            if not parts:
+                timer.record("first_token", start)
+            parts.append(chunk.content)
+            yield "token", chunk.content
+        timer.record("generation", generation_start)
+
+        timer.record("total", start)
+        yield "done", PipelineResult(answer="".join(parts), sources=prepared.sources, documents=prepared.documents,
+                                     timings=timer.timings)
@@ -28,7 +28,7 @@ class AdvancedPrompts:
         Context: {context}
         ---
         Question: {question}
-        Answer in markdown with sources. If unsure, say "I don't know".
+        Answer in markdown and cite the numbered passages you used, e.g. [1]. If unsure, say "I don't know".
         """
 
     @staticmethod
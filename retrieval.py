@@ -1,113 +1,1094 @@
-from typing import List, Dict
+from typing import List, Dict, Tuple, Optional, Sequence, Iterable
+import os
+import re
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 from langchain.schema import Document
-from sklearn.cluster import KMeans
-from transformers import AutoTokenizer, AutoModelForSequenceClassification
-from rank_bm25 import BM25Okapi
 from config_file import Configuration
-from utils import logger
+from utils import logger, atomic_write, atomic_save_npy, save_documents, load_documents, NpyWriter
+from metrics import DOCUMENTS_SCORED, span
 from models import GeminiModel
 import json
-from collections import Counter
+from collections import Counter, OrderedDict, defaultdict
+
+_TOKEN_PATTERN = re.compile(r"\w+")
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokenizer shared by indexing and querying."""
+    return _TOKEN_PATTERN.findall(text.lower())
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    """L2-normalise rows so dot products are cosine similarities."""
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return (vectors / np.maximum(norms, 1e-12)).astype(np.float32)
 
 class HierarchicalIndex:
-    def __init__(self, documents: List[Document], embedding_model):
+    """IVF-style vector index: KMeans centroids route each query to a few clusters.
+
+    Vectors are L2-normalised and stored cluster by cluster in one contiguous
+    float32 matrix, so probing a cluster is a single matrix-vector product.
+    A query scores all centroids, then only the ``nprobe`` closest clusters.
+    The app serves dense search from ``DenseIndex`` snapshots; this index is
+    exercised by ``benchmarks/ivf_benchmark.py``.
+    """
+
+    def __init__(self, documents: List[Document], embedding_model, n_clusters: int = Configuration.IVF_N_CLUSTERS,
+                 nprobe: int = Configuration.IVF_NPROBE, embeddings: Optional[np.ndarray] = None):
         self.documents = documents
         self.embedding_model = embedding_model
-        self.index = self._build_index()
+        self.n_clusters = n_clusters
+        self.nprobe = nprobe
+        self.centroids = np.zeros((0, 0), dtype=np.float32)
+        self.cluster_vectors: List[np.ndarray] = []  # Per-cluster (n_i, dim) views into one matrix
+        self.cluster_ids: List[np.ndarray] = []  # Per-cluster document indices
+        if documents:
+            self.index = self._build_index(embeddings)
 
-    def _build_index(self):
+    def _build_index(self, embeddings: Optional[np.ndarray] = None):
         """Build a hierarchical index using embeddings."""
-        embeddings = self.embedding_model.embed_documents([doc.page_content for doc in self.documents])
-        self.index = self._cluster_documents(embeddings)
-        return self.index
+        if embeddings is None:
+            embeddings = self.embedding_model.embed_documents([doc.page_content for doc in self.documents])
+        vectors = _normalize(np.asarray(embeddings, dtype=np.float32))
+        n_clusters = self.n_clusters or max(1, int(np.sqrt(len(vectors))))
+        assignments = self._cluster_documents(vectors, min(n_clusters, len(vectors)))
+        self._set_clusters(vectors, assignments)
+        logger.info(f"Built hierarchical index over {len(vectors)} documents in {len(self.centroids)} clusters.")
+        return self.cluster_ids
+
+    def _cluster_documents(self, embeddings: np.ndarray, n_clusters: int) -> np.ndarray:
+        """Train centroids on a sample and assign every document to its nearest one."""
+        from sklearn.cluster import KMeans  # Deferred: only needed when an index is (re)built
+
+        rng = np.random.default_rng(0)
+        sample = embeddings
+        if len(embeddings) > Configuration.IVF_TRAIN_SAMPLE:
+            sample = embeddings[rng.choice(len(embeddings), Configuration.IVF_TRAIN_SAMPLE, replace=False)]
+        kmeans = KMeans(n_clusters=n_clusters, n_init=1, random_state=0)
+        kmeans.fit(sample)
+        self.centroids = _normalize(kmeans.cluster_centers_)
+        return self._assign(embeddings)
+
+    def _assign(self, vectors: np.ndarray) -> np.ndarray:
+        return np.argmax(vectors @ self.centroids.T, axis=1)
+
+    def _set_clusters(self, vectors: np.ndarray, assignments: np.ndarray, ids: Optional[np.ndarray] = None):
+        """Lay vectors out contiguously, grouped by cluster."""
+        ids = np.arange(len(vectors)) if ids is None else ids
+        order = np.argsort(assignments, kind="stable")
+        matrix = np.ascontiguousarray(vectors[order])
+        sorted_ids = ids[order].astype(np.int64)
+        offsets = np.searchsorted(assignments[order], np.arange(len(self.centroids) + 1))
+        self._split(matrix, sorted_ids, offsets)
 
-    def _cluster_documents(self, embeddings, n_clusters=10):
-        """Cluster documents into hierarchical groups."""
-        kmeans = KMeans(n_clusters=n_clusters)
-        clusters = kmeans.fit_predict(embeddings)
-        return {i: [] for i in range(n_clusters)}
+    def _split(self, matrix: np.ndarray, ids: np.ndarray, offsets: np.ndarray):
+        self.cluster_vectors = [matrix[start:end] for start, end in zip(offsets[:-1], offsets[1:])]
+        self.cluster_ids = [ids[start:end] for start, end in zip(offsets[:-1], offsets[1:])]
+
+    def add_documents(self, documents: List[Document], embeddings: Optional[np.ndarray] = None):
+        """Route new documents to their nearest existing cluster."""
+        if not documents:
+            return
+        if not self.cluster_vectors:
+            self.documents = list(documents)
+            self.index = self._build_index(embeddings)
+            return
+        if embeddings is None:
+            embeddings = self.embedding_model.embed_documents([doc.page_content for doc in documents])
+        vectors = _normalize(np.asarray(embeddings, dtype=np.float32))
+        ids = np.arange(len(self.documents), len(self.documents) + len(documents))
+        assignments = self._assign(vectors)
+        for cluster in np.unique(assignments):
+            mask = assignments == cluster
+            self.cluster_vectors[cluster] = np.concatenate([self.cluster_vectors[cluster], vectors[mask]])
+            self.cluster_ids[cluster] = np.concatenate([self.cluster_ids[cluster], ids[mask]])
+        self.documents.extend(documents)
+
+    def search_by_vector(self, embedding, k: int = Configuration.TOP_K, nprobe: Optional[int] = None,
+                         filters: Optional[Dict] = None) -> List[Tuple[int, float]]:
+        """Return (document index, cosine similarity) for the top-k hits in the probed clusters."""
+        if not self.cluster_vectors or k <= 0:
+            return []
+        query = _normalize(np.asarray(embedding, dtype=np.float32))
+        nprobe = min(nprobe or self.nprobe, len(self.centroids))
+        centroid_scores = self.centroids @ query
+        probes = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+        scores = np.concatenate([self.cluster_vectors[c] @ query for c in probes])
+        ids = np.concatenate([self.cluster_ids[c] for c in probes])
+        DOCUMENTS_SCORED.inc(len(scores), scorer="ivf")
+        if filters:
+            # Only the probed documents are checked, not the whole corpus
+            allowed = metadata_mask([self.documents[i] for i in ids], filters)
+            scores, ids = scores[allowed], ids[allowed]
+        if len(scores) == 0:
+            return []
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(ids[i]), float(scores[i])) for i in top]
+
+    def similarity_search_with_score(self, query: str, k: int = Configuration.TOP_K,
+                                     filter: Optional[Dict] = None) -> List[Tuple[Document, float]]:
+        query_embedding = self.embedding_model.embed_query(query)
+        return [(self.documents[i], score) for i, score in self.search_by_vector(query_embedding, k, filters=filter)]
+
+    def similarity_search(self, query: str, k: int = Configuration.TOP_K, filter: Optional[Dict] = None) -> List[Document]:
+        """Same call shape as ``Chroma.similarity_search`` so the index can replace it."""
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, filter)]
 
     def retrieve(self, query: str, top_k: int = Configuration.TOP_K) -> List[Document]:
         """Retrieve documents from the hierarchical index."""
-        query_embedding = self.embedding_model.embed_query(query)
-        # For simplicity, return top-k documents (can be enhanced with hierarchical search)
-        return self.documents[:top_k]
+        return self.similarity_search(query, k=top_k)
+
+    def save(self, path: str):
+        """Persist centroids and the clustered embedding matrix as .npy files."""
+        os.makedirs(path, exist_ok=True)
+        sizes = [len(ids) for ids in self.cluster_ids]
+        offsets = np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64)
+        dim = self.centroids.shape[1] if self.centroids.size else 0
+        matrix = np.concatenate(self.cluster_vectors) if self.cluster_vectors else np.zeros((0, dim), np.float32)
+        ids = np.concatenate(self.cluster_ids) if self.cluster_ids else np.zeros(0, np.int64)
+        atomic_save_npy(os.path.join(path, "centroids.npy"), self.centroids)
+        atomic_save_npy(os.path.join(path, "vectors.npy"), matrix.astype(np.float32))
+        atomic_save_npy(os.path.join(path, "ids.npy"), ids.astype(np.int64))
+        atomic_save_npy(os.path.join(path, "offsets.npy"), offsets)
+        save_documents(os.path.join(path, "documents.jsonl"), self.documents)
+        logger.info(f"Saved hierarchical index with {len(self.documents)} documents to {path}.")
+
+    @classmethod
+    def load(cls, path: str, embedding_model, nprobe: int = Configuration.IVF_NPROBE) -> "HierarchicalIndex":
+        """Load a saved index; the embedding matrix is memory-mapped, not read into RAM."""
+        index = cls([], embedding_model, nprobe=nprobe)
+        index.documents = load_documents(os.path.join(path, "documents.jsonl"))
+        index.centroids = np.load(os.path.join(path, "centroids.npy"))
+        index.n_clusters = len(index.centroids)
+        matrix = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+        ids = np.load(os.path.join(path, "ids.npy"), mmap_mode="r")
+        index._split(matrix, ids, np.load(os.path.join(path, "offsets.npy")))
+        return index
+
+class DenseIndex:
+    """Exact cosine search over a matrix of normalised embeddings, one row per document.
+
+    The matrix is typically a read-only memory map of a corpus snapshot, so
+    every worker process maps the same pages instead of holding its own copy.
+    Scoring is one matrix-vector product (one matrix product per block of a batch).
+    """
+
+    def __init__(self, documents: Sequence[Document], vectors: np.ndarray, embedding_model):
+        self.documents = documents
+        self.vectors = vectors
+        self.embedding_model = embedding_model
+        self.columns = MetadataColumns(documents=documents)  # Snapshots share their persisted columns
+
+    def __len__(self) -> int:
+        return len(self.vectors)
+
+    def _filter_mask(self, filters: Dict) -> np.ndarray:
+        return self.columns.mask(filters)
+
+    def _top_k(self, scores: np.ndarray, k: int, filters: Optional[Dict]) -> List[Tuple[int, float]]:
+        if filters:
+            scores = np.where(self._filter_mask(filters), scores, -np.inf)
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(i), float(scores[i])) for i in top if np.isfinite(scores[i])]
+
+    def search_by_vector(self, embedding, k: int = Configuration.TOP_K,
+                         filters: Optional[Dict] = None) -> List[Tuple[int, float]]:
+        """Return (document index, cosine similarity) for the top-k documents."""
+        if len(self.vectors) == 0 or k <= 0:
+            return []
+        scores = self.vectors @ _normalize(np.asarray(embedding, dtype=np.float32))
+        DOCUMENTS_SCORED.inc(len(scores), scorer="dense")
+        return self._top_k(scores, k, filters)
+
+    def search_batch(self, embeddings, k: int = Configuration.TOP_K, filters: Optional[Dict] = None,
+                     block_size: int = Configuration.BATCH_SCORE_BLOCK) -> List[List[Tuple[Document, float]]]:
+        """Top-k documents for many query embeddings, scoring ``block_size`` queries at a time as one matrix product."""
+        if len(self.vectors) == 0 or k <= 0:
+            return [[] for _ in embeddings]
+        queries = _normalize(np.asarray(embeddings, dtype=np.float32))
+        mask = self._filter_mask(filters) if filters else None
+        k = min(k, len(self.vectors))
+        results = []
+        for start in range(0, len(queries), block_size):
+            scores = queries[start:start + block_size] @ self.vectors.T
+            DOCUMENTS_SCORED.inc(scores.size, scorer="dense")
+            if mask is not None:
+                scores[:, ~mask] = -np.inf
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            for row, candidates in zip(scores, top):
+                candidates = candidates[np.argsort(-row[candidates])]
+                results.append([(self.documents[i], float(row[i])) for i in candidates if np.isfinite(row[i])])
+        return results
+
+    def similarity_search_by_vector_with_relevance_scores(self, embedding, k: int = Configuration.TOP_K,
+                                                          filter: Optional[Dict] = None) -> List[Tuple[Document, float]]:
+        return [(self.documents[i], score) for i, score in self.search_by_vector(embedding, k, filter)]
+
+    def similarity_search_with_score(self, query: str, k: int = Configuration.TOP_K,
+                                     filter: Optional[Dict] = None) -> List[Tuple[Document, float]]:
+        return self.similarity_search_by_vector_with_relevance_scores(self.embedding_model.embed_query(query), k, filter)
+
+    def similarity_search(self, query: str, k: int = Configuration.TOP_K, filter: Optional[Dict] = None) -> List[Document]:
+        """Same call shape as ``Chroma.similarity_search`` so the index can replace it."""
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, filter)]
+
+def quantize_vectors(vectors: np.ndarray, method: str, scale: Optional[np.ndarray] = None) -> Dict[str, np.ndarray]:
+    """Compact codes for normalised vectors: "int8" with per-dimension scales, or "binary" sign bits.
+
+    Pass the int8 ``scale`` of a whole matrix to encode one block of it.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if method == "int8":
+        if scale is None:
+            scale = np.ones(vectors.shape[1], dtype=np.float32)
+            if len(vectors):
+                scale = np.maximum(np.abs(vectors).max(axis=0), 1e-12) / 127
+        codes = np.clip(np.rint(vectors / scale), -127, 127).astype(np.int8)
+        return {"codes": codes, "scale": scale.astype(np.float32)}
+    if method == "binary":
+        return {"codes": np.packbits(vectors > 0, axis=1)}
+    raise ValueError(f"Unknown vector quantization: {method}")
+
+class QuantizedDenseIndex(DenseIndex):
+    """``DenseIndex`` whose full scan reads compact codes instead of the float32 matrix.
+
+    The first pass scores every document against int8 codes (a quarter of the
+    float32 size) or packed sign bits (a thirty-second, scored as the float
+    query's dot product with the signs), ``rescore`` times ``k`` candidates are kept, and only those rows
+    of the memory-mapped float32 matrix are read to compute exact cosine
+    similarities. Resident memory is the codes plus the pages of the rows
+    actually rescored; a batch is scanned ``BATCH_SCORE_BLOCK`` queries at a
+    time with a running shortlist per query.
+    """
+
+    def __init__(self, documents: Sequence[Document], vectors: np.ndarray, codes: np.ndarray,
+                 scale: Optional[np.ndarray], embedding_model, rescore: int = Configuration.VECTOR_RESCORE_FACTOR,
+                 block_rows: int = Configuration.VECTOR_SCAN_BLOCK):
+        super().__init__(documents, vectors, embedding_model)
+        self.codes = codes
+        self.scale = scale  # None for binary codes
+        self.rescore = rescore
+        self.block_rows = block_rows
+
+    def _shortlist(self, queries: np.ndarray, size: int,
+                   mask: Optional[np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+        """First-pass (ids, scores) of the ``size`` best documents per query, one row per query.
+
+        Codes are scanned a block at a time and merged into a running
+        shortlist, so temporaries stay at queries x ``block_rows``. Documents
+        outside ``mask`` score -inf, as do unfilled slots.
+        """
+        size = min(size, len(self.codes))
+        ids = np.zeros((len(queries), 0), dtype=np.int64)
+        best = np.zeros((len(queries), 0), dtype=np.float32)
+        if self.scale is not None:
+            queries = queries * self.scale
+        for start in range(0, len(self.codes), self.block_rows):
+            block = np.asarray(self.codes[start:start + self.block_rows])
+            if self.scale is not None:
+                scores = queries @ block.astype(np.float32).T
+            else:
+                # q . sign(v) = 2 * (q . bits) - sum(q)
+                bits = np.unpackbits(block, axis=1, count=queries.shape[1]).astype(np.float32)
+                scores = 2 * (queries @ bits.T) - queries.sum(axis=1, keepdims=True)
+            if mask is not None:
+                scores[:, ~mask[start:start + len(block)]] = -np.inf
+            best = np.concatenate([best, scores.astype(np.float32)], axis=1)
+            block_ids = np.broadcast_to(np.arange(start, start + len(block), dtype=np.int64), scores.shape)
+            ids = np.concatenate([ids, block_ids], axis=1)
+            if best.shape[1] > size:
+                top = np.argpartition(-best, size - 1, axis=1)[:, :size]
+                best, ids = np.take_along_axis(best, top, axis=1), np.take_along_axis(ids, top, axis=1)
+        DOCUMENTS_SCORED.inc(len(queries) * len(self.codes), scorer="quantized")
+        return ids, best
+
+    def _rescore(self, query: np.ndarray, ids: np.ndarray, approximate: np.ndarray, k: int) -> List[Tuple[int, float]]:
+        rows = np.sort(ids[np.isfinite(approximate)])  # Ascending reads from the memory map
+        if not len(rows):
+            return []
+        exact = np.asarray(self.vectors[rows], dtype=np.float32) @ query
+        DOCUMENTS_SCORED.inc(len(rows), scorer="dense")
+        order = np.argsort(-exact)[:k]
+        return [(int(rows[i]), float(exact[i])) for i in order]
+
+    def search_by_vector(self, embedding, k: int = Configuration.TOP_K,
+                         filters: Optional[Dict] = None) -> List[Tuple[int, float]]:
+        """Return (document index, cosine similarity) for the top-k rescored candidates."""
+        return self._search(np.asarray(embedding, dtype=np.float32)[None, :], k, filters)[0]
+
+    def search_batch(self, embeddings, k: int = Configuration.TOP_K, filters: Optional[Dict] = None,
+                     block_size: int = Configuration.BATCH_SCORE_BLOCK) -> List[List[Tuple[Document, float]]]:
+        """Top-k documents for many query embeddings; ``block_size`` queries share each pass over the codes."""
+        return [[(self.documents[i], score) for i, score in hits]
+                for hits in self._search(np.asarray(embeddings, dtype=np.float32), k, filters, block_size)]
+
+    def _search(self, queries: np.ndarray, k: int, filters: Optional[Dict],
+                block_size: int = Configuration.BATCH_SCORE_BLOCK) -> List[List[Tuple[int, float]]]:
+        if len(self.vectors) == 0 or k <= 0:
+            return [[] for _ in queries]
+        queries = _normalize(queries)
+        mask = self._filter_mask(filters) if filters else None
+        results = []
+        for start in range(0, len(queries), block_size):
+            block = queries[start:start + block_size]
+            ids, approximate = self._shortlist(block, k * max(1, self.rescore), mask)
+            results.extend(self._rescore(query, query_ids, query_scores, k)
+                           for query, query_ids, query_scores in zip(block, ids, approximate))
+        return results
 
 class MetadataExtractor:
     @staticmethod
-    def extract_from_query(query: str) -> Dict[str, str]:
-        """Extract metadata from the query using an LLM."""
-        prompt = f"""
+    def _prompt(query: str) -> str:
+        return f"""
         Extract metadata from the following query. Return the result as a JSON object with keys like "year", "topic", "location", etc.
         Query: {query}
         Metadata (JSON):
         """
-        llm = GeminiModel().llm
-        response = llm.invoke(prompt).content
+
+    @staticmethod
+    def _parse(response: str) -> Dict[str, str]:
+        """Parse the LLM response, tolerating markdown code fences."""
         try:
-            metadata = json.loads(response)
-            return metadata
+            cleaned = response.strip().removeprefix("```json").removeprefix("```").removesuffix("```").strip()
+            metadata = json.loads(cleaned)
+            return metadata if isinstance(metadata, dict) else {}
         except Exception as e:
             logger.error(f"Error parsing metadata: {e}")
             return {}
 
-class MetadataInferrer:
     @staticmethod
-    def infer_from_documents(documents: List[Document]) -> Dict[str, str]:
-        """Infer metadata from the document set."""
-        metadata = {}
-        
-        # Example: Infer the most recent year
-        years = [doc.metadata.get("year") for doc in documents if "year" in doc.metadata]
-        if years:
-            metadata["year"] = max(years)
-        
-        # Example: Infer the most common topic
-        topics = [doc.metadata.get("topic") for doc in documents if "topic" in doc.metadata]
-        if topics:
-            metadata["topic"] = Counter(topics).most_common(1)[0][0]
-        
-        return metadata
-
-def combine_metadata(query_metadata: Dict[str, str], document_metadata: Dict[str, str]) -> Dict[str, str]:
-    """Combine metadata from the query and documents."""
-    combined = {}
-    combined.update(document_metadata)  # Start with document metadata
-    combined.update(query_metadata)    # Override with query metadata (if any)
-    return combined
+    def extract_from_query(query: str, llm=None) -> Dict[str, str]:
+        """Extract metadata from the query using an LLM."""
+        llm = llm or GeminiModel.get_instance().llm
+        response = llm.invoke(MetadataExtractor._prompt(query)).content
+        return MetadataExtractor._parse(response)
+
+    @staticmethod
+    async def aextract_from_query(query: str, llm=None) -> Dict[str, str]:
+        """Async variant of ``extract_from_query``."""
+        llm = llm or GeminiModel.get_instance().llm
+        response = (await llm.ainvoke(MetadataExtractor._prompt(query))).content
+        return MetadataExtractor._parse(response)
+
+class CorpusStatistics:
+    """Metadata statistics of a corpus, maintained incrementally at ingest time.
+
+    Every scalar metadata field is tracked as a value -> chunk count table, from
+    which counts, min/max and top-N values are derived on demand; chunk counts
+    are also kept per source. Internal fields such as chunk ids are skipped.
+    """
+
+    def __init__(self, top_n: int = Configuration.STATS_TOP_VALUES,
+                 excluded_fields=Configuration.STATS_EXCLUDED_FIELDS):
+        self.top_n = top_n
+        self.excluded_fields = set(excluded_fields)
+        self.total = 0
+        self.value_counts: Dict[str, Counter] = defaultdict(Counter)
+        self.source_counts: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def _fields(self, doc: Document):
+        for field_name, value in doc.metadata.items():
+            if field_name not in self.excluded_fields and isinstance(value, (str, int, float, bool)):
+                yield field_name, value
+
+    def update(self, documents: List[Document], sign: int = 1):
+        """Add (or with ``sign=-1`` remove) documents from the statistics."""
+        with self._lock:
+            for doc in documents:
+                self.total += sign
+                self.source_counts[doc.metadata.get("source", "unknown")] += sign
+                for field_name, value in self._fields(doc):
+                    self.value_counts[field_name][value] += sign
+            if sign < 0:
+                self.source_counts = +self.source_counts  # Drop zero counts
+                for field_name in list(self.value_counts):
+                    self.value_counts[field_name] = +self.value_counts[field_name]
+                    if not self.value_counts[field_name]:
+                        del self.value_counts[field_name]
+
+    def remove(self, documents: List[Document]):
+        self.update(documents, sign=-1)
+
+    def field_summary(self, field_name: str) -> Dict:
+        counts = self.value_counts.get(field_name)
+        if not counts:
+            return {}
+        summary = {"count": sum(counts.values()), "distinct": len(counts), "min": None, "max": None,
+                   "top": counts.most_common(self.top_n)}
+        try:
+            summary["min"], summary["max"] = min(counts), max(counts)
+        except TypeError:
+            pass  # Mixed value types have no ordering
+        return summary
+
+    def summary(self) -> Dict:
+        return {
+            "documents": self.total,
+            "fields": {field_name: self.field_summary(field_name) for field_name in self.value_counts},
+            "sources": dict(self.source_counts),
+        }
+
+    def build_filter(self, query_metadata: Dict[str, str]) -> Dict:
+        """Turn extracted query metadata into an exact-match filter on known field values.
+
+        Values are matched case-insensitively against the values actually stored,
+        so a filter never excludes the whole corpus because of a typo or type mismatch.
+        """
+        filters = {}
+        for field_name, wanted in query_metadata.items():
+            for value in self.value_counts.get(field_name, ()):
+                if str(value).strip().lower() == str(wanted).strip().lower():
+                    filters[field_name] = value
+                    break
+        return filters
+
+    def save(self, path: str):
+        with self._lock:
+            state = {
+                "total": self.total,
+                "value_counts": {field_name: list(counts.items()) for field_name, counts in self.value_counts.items()},
+                "source_counts": dict(self.source_counts),
+            }
+        atomic_write(path, json.dumps(state))
+
+    @classmethod
+    def load(cls, path: str) -> "CorpusStatistics":
+        with open(path) as f:
+            state = json.load(f)
+        statistics = cls()
+        statistics.total = state["total"]
+        for field_name, items in state["value_counts"].items():
+            statistics.value_counts[field_name] = Counter({value: count for value, count in items})
+        statistics.source_counts = Counter(state["source_counts"])
+        return statistics
+
+def metadata_mask(documents: Sequence[Document], filters: Dict) -> np.ndarray:
+    """Boolean mask of the documents whose metadata matches every filter value."""
+    return np.fromiter((all(doc.metadata.get(k) == v for k, v in filters.items()) for doc in documents),
+                       dtype=bool, count=len(documents))
+
+def _filterable(metadata: Dict):
+    """The scalar metadata fields that ``CorpusStatistics`` tracks and filters are built from."""
+    for field_name, value in metadata.items():
+        if field_name not in Configuration.STATS_EXCLUDED_FIELDS and isinstance(value, (str, int, float, bool)):
+            yield field_name, value
+
+class MetadataColumns:
+    """Per-field value columns of a corpus, so an exact-match filter is a few vectorized comparisons.
+
+    Every filterable field is an int32 column of codes into the field's
+    distinct values, -1 where a document lacks it. Snapshots persist the
+    columns and memory-map them; built from ``documents`` instead, they are
+    decoded once on first use. Masks of the last ``cache_size`` filters are
+    kept in an LRU.
+    """
+
+    def __init__(self, size: int = 0, values: Optional[Dict[str, List]] = None,
+                 codes: Optional[Dict[str, np.ndarray]] = None, documents: Optional[Sequence[Document]] = None,
+                 cache_size: int = Configuration.FILTER_MASK_CACHE_SIZE):
+        self.size = size
+        self.values: Dict[str, List] = values or {}
+        self.codes: Dict[str, np.ndarray] = codes or {}
+        self.cache_size = cache_size
+        self._documents = documents  # Decoded into columns on first use
+        self._lookup = {field_name: self._index(field_values) for field_name, field_values in self.values.items()}
+        self._masks: "OrderedDict[Tuple, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _index(values: List) -> Dict:
+        lookup = {}
+        for code, value in enumerate(values):
+            lookup.setdefault(value, code)
+        return lookup
+
+    def _ensure_built(self):
+        if self._documents is None:
+            return
+        with self._lock:
+            if self._documents is not None:
+                built = MetadataColumns().merge(np.zeros(0, dtype=bool), {}, self._documents)
+                self.size, self.values, self.codes, self._lookup = built.size, built.values, built.codes, built._lookup
+                self._documents = None
+
+    def mask(self, filters: Dict) -> np.ndarray:
+        """Boolean mask of the documents whose metadata matches every filter value."""
+        self._ensure_built()
+        key = tuple(sorted((k, repr(v)) for k, v in filters.items()))
+        with self._lock:
+            mask = self._masks.get(key)
+            if mask is not None:
+                self._masks.move_to_end(key)
+                return mask
+        mask = np.ones(self.size, dtype=bool)
+        for field_name, value in filters.items():
+            try:
+                code = -1 if value is None else self._lookup.get(field_name, {}).get(value)
+            except TypeError:  # Unhashable values are never stored in a column
+                code = None
+            if code is None:
+                mask[:] = False
+                break
+            column = self.codes.get(field_name)
+            if column is not None:  # A field no document has is None everywhere, which ``code`` already matched
+                mask &= np.asarray(column) == code
+        with self._lock:
+            self._masks[key] = mask
+            while len(self._masks) > self.cache_size:
+                self._masks.popitem(last=False)
+        return mask
+
+    def merge(self, keep: np.ndarray, metadata: Dict[int, Dict], documents: Iterable[Document]) -> "MetadataColumns":
+        """Columns of the rows selected by ``keep``, with ``metadata`` replacing some rows', then ``documents``.
+
+        ``documents`` is read once, so it may be a generator over chunks on disk.
+        """
+        self._ensure_built()
+        values = {field_name: list(field_values) for field_name, field_values in self.values.items()}
+        lookup = {field_name: dict(field_lookup) for field_name, field_lookup in self._lookup.items()}
+
+        def code(field_name: str, value) -> int:
+            field_lookup = lookup.setdefault(field_name, {})
+            if value not in field_lookup:
+                field_lookup[value] = len(values.setdefault(field_name, []))
+                values[field_name].append(value)
+            return field_lookup[value]
+
+        replaced = {row: dict(_filterable(row_metadata)) for row, row_metadata in metadata.items()}
+        added: Dict[str, Tuple[List[int], List[int]]] = {}  # Field -> (rows, codes) of the new documents
+        count = 0
+        for row, doc in enumerate(documents):
+            for field_name, value in _filterable(doc.metadata):
+                rows, field_codes = added.setdefault(field_name, ([], []))
+                rows.append(row)
+                field_codes.append(code(field_name, value))
+            count = row + 1
+        field_names = set(values).union(*replaced.values(), added)
+        codes = {}
+        for field_name in sorted(field_names):
+            column = np.full(len(keep), -1, dtype=np.int32)
+            if field_name in self.codes:
+                column[:] = self.codes[field_name]
+            for row, fields in replaced.items():
+                column[row] = code(field_name, fields[field_name]) if field_name in fields else -1
+            new = np.full(count, -1, dtype=np.int32)
+            if field_name in added:
+                rows, field_codes = added[field_name]
+                new[rows] = field_codes
+            codes[field_name] = np.concatenate([column[keep], new])
+        return MetadataColumns(int(keep.sum()) + count, values, codes, cache_size=self.cache_size)
+
+    def save(self, path: str):
+        self._ensure_built()
+        os.makedirs(path, exist_ok=True)
+        field_names = sorted(self.codes)
+        for i, field_name in enumerate(field_names):
+            atomic_save_npy(os.path.join(path, f"{i}.npy"), np.asarray(self.codes[field_name], dtype=np.int32))
+        atomic_write(os.path.join(path, "columns.json"), json.dumps(
+            {"size": self.size, "fields": [[field_name, self.values[field_name]] for field_name in field_names]}))
+
+    @classmethod
+    def load(cls, path: str) -> "MetadataColumns":
+        """Load persisted columns; the codes are memory-mapped."""
+        with open(os.path.join(path, "columns.json")) as f:
+            header = json.load(f)
+        values = {field_name: field_values for field_name, field_values in header["fields"]}
+        codes = {field_name: np.load(os.path.join(path, f"{i}.npy"), mmap_mode="r")
+                 for i, (field_name, _) in enumerate(header["fields"])}
+        return cls(header["size"], values, codes)
+
+def merge_postings(offsets: np.ndarray, doc_ids: np.ndarray, tfs: np.ndarray, n_terms: int,
+                   keep: Optional[np.ndarray] = None,
+                   new_postings: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]] = None,
+                   block_size: Optional[int] = None):
+    """Yield CSR postings without the documents outside ``keep`` and with ``new_postings`` added.
+
+    ``offsets``/``doc_ids``/``tfs`` may be memory-mapped: they are read one run
+    of terms holding about ``block_size`` postings at a time. Kept documents are
+    renumbered densely and ``new_postings`` are (term ids, doc ids, tfs) arrays
+    numbered after them. Each block is (postings per term, doc ids, tfs) for
+    the next run of terms, so concatenating the blocks gives the merged index.
+    """
+    base = np.full(n_terms + 1, offsets[-1], dtype=np.int64)
+    base[:len(offsets)] = offsets
+    if new_postings is None:
+        new_postings = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float32))
+    order = np.argsort(new_postings[0], kind="stable")
+    new_terms, new_ids, new_tfs = (np.asarray(array)[order] for array in new_postings)
+    added = np.searchsorted(new_terms, np.arange(n_terms + 1))
+    renumber = None if keep is None else (np.cumsum(keep) - 1).astype(np.int32)
+    merged = base + added
+    block_size = block_size or max(int(merged[-1]), 1)
+    start = 0
+    while start < n_terms:
+        end = int(np.searchsorted(merged, merged[start] + block_size, side="right")) - 1
+        end = min(max(end, start + 1), n_terms)
+        ids, freqs = np.asarray(doc_ids[base[start]:base[end]]), np.asarray(tfs[base[start]:base[end]])
+        terms = np.repeat(np.arange(start, end), np.diff(base[start:end + 1]))
+        if keep is not None:
+            kept = keep[ids]
+            ids, freqs, terms = renumber[ids[kept]], freqs[kept], terms[kept]
+        lo, hi = added[start], added[end]
+        terms = np.concatenate([terms, new_terms[lo:hi]])
+        ids = np.concatenate([ids, new_ids[lo:hi]])
+        freqs = np.concatenate([freqs, new_tfs[lo:hi]])
+        order = np.argsort(terms, kind="stable")  # Within a term, new documents follow the kept ones
+        yield (np.bincount(terms - start, minlength=end - start),
+               ids[order].astype(np.int32), freqs[order].astype(np.float32))
+        start = end
+
+
+class BM25Index:
+    """Long-lived BM25 keyword index kept as a compact inverted index.
+
+    Postings are flat CSR arrays: the document ids and term frequencies of
+    term ``t`` are ``doc_ids``/``tfs[offsets[t]:offsets[t + 1]]``. A loaded
+    index memory-maps them and a query only slices the postings of its own
+    terms; IDF and length normalisation are precomputed whenever the corpus
+    changes.
+    """
+
+    def __init__(self, k1: float = Configuration.BM25_K1, b: float = Configuration.BM25_B):
+        self.k1 = k1
+        self.b = b
+        self.documents: List[Document] = []
+        self.vocabulary: Dict[str, int] = {}
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.doc_ids = np.zeros(0, dtype=np.int32)
+        self.tfs = np.zeros(0, dtype=np.float32)
+        self.doc_lengths = np.zeros(0, dtype=np.float32)
+        self.idf = np.zeros(0, dtype=np.float32)
+        self.length_norm = np.zeros(0, dtype=np.float32)
+        self._lock = threading.RLock()  # Uploads update the index while queries read it
+        self.columns = MetadataColumns(documents=self.documents)  # Snapshots share their persisted columns
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    def add_documents(self, documents: List[Document]):
+        """Tokenize only the new documents and merge them into the postings."""
+        if not documents:
+            return
+        # Tokenize outside the lock so queries are only blocked by the merge
+        term_counts = [Counter(tokenize(doc.page_content)) for doc in documents]
+        with self._lock:
+            self._add_documents(documents, term_counts)
+        logger.info(f"Indexed {len(documents)} documents for BM25 ({len(self.documents)} total).")
+
+    def new_postings(self, term_counts: Iterable[Dict[str, int]], first_doc: int):
+        """(term ids, doc ids, tfs) postings and lengths of documents numbered from ``first_doc``.
+
+        Terms not seen before are added to the vocabulary. ``term_counts`` is
+        read once and each document's postings are kept as arrays.
+        """
+        terms, ids, tfs = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int32)], [np.zeros(0, dtype=np.float32)]
+        lengths = []
+        for doc_id, counts in enumerate(term_counts, start=first_doc):
+            lengths.append(sum(counts.values()))
+            terms.append(np.fromiter((self.vocabulary.setdefault(term, len(self.vocabulary)) for term in counts),
+                                     dtype=np.int64, count=len(counts)))
+            ids.append(np.full(len(counts), doc_id, dtype=np.int32))
+            tfs.append(np.fromiter(counts.values(), dtype=np.float32, count=len(counts)))
+        postings = (np.concatenate(terms), np.concatenate(ids), np.concatenate(tfs))
+        return postings, np.asarray(lengths, dtype=np.float32)
+
+    def _merge(self, keep: Optional[np.ndarray] = None, new_postings=None):
+        counts, ids, tfs = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int32)], [np.zeros(0, dtype=np.float32)]
+        for block_counts, block_ids, block_tfs in merge_postings(self.offsets, self.doc_ids, self.tfs,
+                                                                 len(self.vocabulary), keep, new_postings):
+            counts.append(block_counts)
+            ids.append(block_ids)
+            tfs.append(block_tfs)
+        offsets = np.zeros(len(self.vocabulary) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.concatenate(counts))
+        self.offsets, self.doc_ids, self.tfs = offsets, np.concatenate(ids), np.concatenate(tfs)
+
+    def _add_documents(self, documents: List[Document], term_counts: List[Counter]):
+        postings, lengths = self.new_postings(term_counts, len(self.documents))
+        self._merge(new_postings=postings)
+        self.documents.extend(documents)
+        self.doc_lengths = np.concatenate([self.doc_lengths, lengths])
+        self.columns = MetadataColumns(documents=self.documents)
+        self._refresh_statistics()
+
+    def delete(self, chunk_ids) -> List[Document]:
+        """Remove documents whose ``chunk_id`` metadata is in ``chunk_ids`` and return them.
+
+        Postings are filtered and renumbered in one pass; nothing is re-tokenized.
+        """
+        with self._lock:
+            keep = np.fromiter((doc.metadata.get("chunk_id") not in chunk_ids for doc in self.documents),
+                               dtype=bool, count=len(self.documents))
+            removed = [doc for doc, kept in zip(self.documents, keep) if not kept]
+            if not removed:
+                return []
+            self._merge(keep=keep)
+            self.documents = [doc for doc, kept in zip(self.documents, keep) if kept]
+            self.doc_lengths = self.doc_lengths[keep]
+            self.columns = MetadataColumns(documents=self.documents)
+            self._refresh_statistics()
+        logger.info(f"Removed {len(removed)} documents from the BM25 index.")
+        return removed
+
+    def _refresh_statistics(self):
+        """Recompute IDF and per-document length normalisation."""
+        n_docs = len(self.documents)
+        doc_freqs = np.diff(self.offsets).astype(np.float32)
+        self.idf = np.log((n_docs - doc_freqs + 0.5) / (doc_freqs + 0.5) + 1.0).astype(np.float32)
+        avg_length = float(self.doc_lengths.mean()) if n_docs else 0.0
+        if avg_length == 0.0:
+            avg_length = 1.0
+        self.length_norm = (self.k1 * (1 - self.b + self.b * self.doc_lengths / avg_length)).astype(np.float32)
+
+    def _postings(self, term_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        start, end = self.offsets[term_id], self.offsets[term_id + 1]
+        return self.doc_ids[start:end], self.tfs[start:end]
+
+    def get_scores(self, query: str) -> np.ndarray:
+        """Score every document against the query."""
+        scores = np.zeros(len(self.documents), dtype=np.float32)
+        for term in set(tokenize(query)):
+            term_id = self.vocabulary.get(term)
+            if term_id is None:
+                continue
+            ids, tfs = self._postings(term_id)
+            scores[ids] += self.idf[term_id] * tfs * (self.k1 + 1) / (tfs + self.length_norm[ids])
+        return scores
+
+    def _filter_mask(self, filters: Dict) -> np.ndarray:
+        return self.columns.mask(filters)
+
+    def search(self, query: str, k: int = Configuration.TOP_K, filters: Optional[Dict] = None) -> List[Tuple[Document, float]]:
+        """Return the top-k documents with their BM25 scores, optionally restricted by metadata."""
+        with self._lock:
+            if not self.documents or k <= 0:
+                return []
+            scores = self.get_scores(query)
+            DOCUMENTS_SCORED.inc(len(scores), scorer="bm25")
+            if filters:
+                scores[~self._filter_mask(filters)] = 0.0
+            k = min(k, len(scores))
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [(self.documents[i], float(scores[i])) for i in top if scores[i] > 0]
+
+    def get_score_matrix(self, queries: List[str]) -> np.ndarray:
+        """Score every document against every query; row ``i`` is ``get_scores(queries[i])``.
+
+        Each distinct term's contribution is computed once and added to the
+        rows of all queries containing it.
+        """
+        scores = np.zeros((len(queries), len(self.documents)), dtype=np.float32)
+        rows_by_term: Dict[int, List[int]] = defaultdict(list)
+        for row, query in enumerate(queries):
+            for term in set(tokenize(query)):
+                term_id = self.vocabulary.get(term)
+                if term_id is not None:
+                    rows_by_term[term_id].append(row)
+        for term_id, rows in rows_by_term.items():
+            ids, tfs = self._postings(term_id)
+            contribution = self.idf[term_id] * tfs * (self.k1 + 1) / (tfs + self.length_norm[ids])
+            scores[np.ix_(rows, ids)] += contribution
+        return scores
+
+    def search_batch(self, queries: List[str], k: int = Configuration.TOP_K, filters: Optional[Dict] = None,
+                     block_size: int = Configuration.BATCH_SCORE_BLOCK) -> List[List[Tuple[Document, float]]]:
+        """``search`` for many queries, scoring ``block_size`` queries at a time as one matrix."""
+        results = []
+        with self._lock:
+            if not self.documents or k <= 0:
+                return [[] for _ in queries]
+            mask = self._filter_mask(filters) if filters else None
+            k = min(k, len(self.documents))
+            for start in range(0, len(queries), block_size):
+                scores = self.get_score_matrix(queries[start:start + block_size])
+                DOCUMENTS_SCORED.inc(scores.size, scorer="bm25")
+                if mask is not None:
+                    scores[:, ~mask] = 0.0
+                top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+                for row, candidates in zip(scores, top):
+                    candidates = candidates[np.argsort(-row[candidates])]
+                    results.append([(self.documents[i], float(row[i])) for i in candidates if row[i] > 0])
+        return results
+
+    def get_relevant_documents(self, query: str, k: int = Configuration.TOP_K, filters: Optional[Dict] = None) -> List[Document]:
+        """Drop-in replacement for ``BM25Retriever.get_relevant_documents``."""
+        return [doc for doc, _ in self.search(query, k, filters)]
+
+    def save(self, path: str, with_documents: bool = True):
+        """Persist the index as flat CSR arrays plus a JSON-lines document store.
+
+        Pass ``with_documents=False`` when the documents are stored elsewhere,
+        e.g. in a snapshot's chunk store, and handed back to ``load``.
+        """
+        with self._lock:
+            self._save(path, with_documents)
+        logger.info(f"Saved BM25 index with {len(self.documents)} documents to {path}.")
+
+    def _save(self, path: str, with_documents: bool = True):
+        os.makedirs(path, exist_ok=True)
+        terms = sorted(self.vocabulary, key=self.vocabulary.get)
+        atomic_save_npy(os.path.join(path, "offsets.npy"), self.offsets)
+        atomic_save_npy(os.path.join(path, "doc_ids.npy"), np.asarray(self.doc_ids, dtype=np.int32))
+        atomic_save_npy(os.path.join(path, "tfs.npy"), np.asarray(self.tfs, dtype=np.float32))
+        atomic_save_npy(os.path.join(path, "doc_lengths.npy"), self.doc_lengths)
+        atomic_write(os.path.join(path, "vocabulary.json"), json.dumps({"k1": self.k1, "b": self.b, "terms": terms}))
+        if with_documents:
+            save_documents(os.path.join(path, "documents.jsonl"), self.documents)
+
+    def save_merged(self, path: str, keep: np.ndarray, term_counts: Iterable[Dict[str, int]],
+                    block_bytes: int = Configuration.SNAPSHOT_BLOCK_BYTES):
+        """Write this index without the documents outside ``keep`` and with ``term_counts`` documents appended.
+
+        Postings are streamed a run of terms at a time, so a memory-mapped index
+        is copied without being loaded. Terms of the new documents are added to
+        this index's vocabulary; the index itself is left otherwise unchanged.
+        """
+        os.makedirs(path, exist_ok=True)
+        new_postings, lengths = self.new_postings(term_counts, int(keep.sum()))
+        block_size = max(1, block_bytes // 8)
+        total = len(self.doc_ids)
+        if not keep.all():
+            total = sum(int(keep[self.doc_ids[start:start + block_size]].sum())
+                        for start in range(0, len(self.doc_ids), block_size))
+        total += len(new_postings[1])
+        counts = [np.zeros(0, dtype=np.int64)]
+        with NpyWriter(os.path.join(path, "doc_ids.npy"), np.int32, (total,)) as doc_ids, \
+                NpyWriter(os.path.join(path, "tfs.npy"), np.float32, (total,)) as tfs:
+            for block_counts, block_ids, block_tfs in merge_postings(self.offsets, self.doc_ids, self.tfs,
+                                                                     len(self.vocabulary), keep, new_postings,
+                                                                     block_size):
+                counts.append(block_counts)
+                doc_ids.write(block_ids)
+                tfs.write(block_tfs)
+        offsets = np.zeros(len(self.vocabulary) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.concatenate(counts))
+        terms = sorted(self.vocabulary, key=self.vocabulary.get)
+        atomic_save_npy(os.path.join(path, "offsets.npy"), offsets)
+        atomic_save_npy(os.path.join(path, "doc_lengths.npy"), np.concatenate([self.doc_lengths[keep], lengths]))
+        atomic_write(os.path.join(path, "vocabulary.json"), json.dumps({"k1": self.k1, "b": self.b, "terms": terms}))
+
+    @classmethod
+    def load(cls, path: str, documents: Optional[Sequence[Document]] = None) -> "BM25Index":
+        """Load a persisted index without re-tokenizing the corpus; postings stay memory-mapped."""
+        with open(os.path.join(path, "vocabulary.json")) as f:
+            header = json.load(f)
+        index = cls(k1=header["k1"], b=header["b"])
+        index.vocabulary = {term: i for i, term in enumerate(header["terms"])}
+        index.documents = load_documents(os.path.join(path, "documents.jsonl")) if documents is None else documents
+
+        index.offsets = np.load(os.path.join(path, "offsets.npy"))
+        if len(index.offsets) != len(index.vocabulary) + 1:
+            raise ValueError(f"BM25 offsets do not match the vocabulary in {path}")
+        index.doc_ids = np.load(os.path.join(path, "doc_ids.npy"), mmap_mode="r")
+        index.tfs = np.load(os.path.join(path, "tfs.npy"), mmap_mode="r")
+        index.doc_lengths = np.load(os.path.join(path, "doc_lengths.npy"))
+        index._refresh_statistics()
+        logger.info(f"Loaded BM25 index with {len(index.documents)} documents from {path}.")
+        return index
+
+    @classmethod
+    def load_or_create(cls, path: str) -> "BM25Index":
+        """Load the persisted index if present, otherwise start an empty one."""
+        if os.path.exists(os.path.join(path, "vocabulary.json")):
+            try:
+                return cls.load(path)
+            except Exception as e:
+                logger.error(f"Error loading BM25 index from {path}: {e}")
+        return cls()
+
+def document_key(doc: Document) -> str:
+    """Identity used to deduplicate chunks: the ingest-time chunk id, else a content hash."""
+    return doc.metadata.get("chunk_id") or hashlib.sha1(doc.page_content.encode("utf-8")).hexdigest()
 
 class HybridRetriever:
-    def __init__(self, vector_store, bm25_retriever):
+    """Fuses vector and BM25 results by rank (RRF) or by normalised score.
+
+    Both arms run concurrently and each returns at most ``top_k`` hits; only
+    the best ``candidate_limit`` fused chunks are passed on to the reranker.
+    ``vector_store`` is a snapshot's ``DenseIndex`` (or anything with its
+    ``similarity_search_with_score`` and ``search_batch``).
+    """
+
+    _executor = ThreadPoolExecutor(max_workers=Configuration.FUSION_THREADS, thread_name_prefix="hybrid")
+
+    def __init__(self, vector_store, bm25_retriever, fusion: str = Configuration.FUSION_METHOD,
+                 vector_weight: float = Configuration.FUSION_VECTOR_WEIGHT, rrf_k: int = Configuration.RRF_K,
+                 candidate_limit: int = Configuration.FUSION_CANDIDATES):
+        if fusion not in ("rrf", "weighted"):
+            raise ValueError(f"Unknown fusion method: {fusion}")
         self.vector_store = vector_store
         self.bm25_retriever = bm25_retriever
+        self.fusion = fusion
+        self.vector_weight = vector_weight
+        self.rrf_k = rrf_k
+        self.candidate_limit = candidate_limit
 
-    def retrieve(self, query: str, top_k: int = Configuration.TOP_K) -> List[Document]:
-        # Semantic Search
-        vector_results = self.vector_store.similarity_search(query, k=top_k)
-        # Keyword Search
-        bm25_docs = self.bm25_retriever.get_relevant_documents(query)
-        # Combine and deduplicate
-        combined = vector_results + bm25_docs
-        seen = set()
-        return [doc for doc in combined if not (doc.page_content in seen or seen.add(doc.page_content))]
+    def _vector_search(self, query: str, k: int, filters: Optional[Dict]) -> List[Tuple[Document, float]]:
+        with span("vector_search"):
+            return self.vector_store.similarity_search_with_score(query, k=k, filter=filters or None)
+
+    def _keyword_search(self, query: str, k: int, filters: Optional[Dict]) -> List[Tuple[Document, float]]:
+        with span("bm25_search"):
+            return self.bm25_retriever.search(query, k, filters)
+
+    def _fuse(self, ranked_lists: List[Tuple[float, List[Tuple[Document, float]]]]) -> List[Tuple[Document, float]]:
+        """Combine (weight, [(doc, score)]) lists into one list ordered by fused score."""
+        fused: Dict[str, float] = defaultdict(float)
+        docs: Dict[str, Document] = {}
+        for weight, results in ranked_lists:
+            if not results:
+                continue
+            scores = np.array([score for _, score in results], dtype=np.float32)
+            if self.fusion == "weighted":
+                spread = scores.max() - scores.min()
+                normalized = (scores - scores.min()) / spread if spread > 0 else np.ones_like(scores)
+            for rank, (doc, _) in enumerate(results):
+                key = document_key(doc)
+                docs.setdefault(key, doc)
+                if self.fusion == "rrf":
+                    fused[key] += weight / (self.rrf_k + rank + 1)
+                else:
+                    fused[key] += weight * float(normalized[rank])
+        ordered = sorted(fused, key=fused.get, reverse=True)
+        return [(docs[key], fused[key]) for key in ordered]
+
+    def retrieve_with_scores(self, query: str, top_k: int = Configuration.TOP_K,
+                             filters: Optional[Dict] = None) -> List[Tuple[Document, float]]:
+        # Semantic and keyword search in parallel, both restricted by the metadata filter
+        vector_future = self._executor.submit(self._vector_search, query, top_k, filters)
+        bm25_future = self._executor.submit(self._keyword_search, query, top_k, filters)
+        ranked_lists = [
+            (self.vector_weight, vector_future.result()),
+            (1.0 - self.vector_weight, bm25_future.result()),
+        ]
+        # Fuse, deduplicate by chunk id and bound the reranker's input
+        return self._fuse(ranked_lists)[:self.candidate_limit]
+
+    def retrieve(self, query: str, top_k: int = Configuration.TOP_K, filters: Optional[Dict] = None) -> List[Document]:
+        return [doc for doc, _ in self.retrieve_with_scores(query, top_k, filters)]
+
+    def _vector_search_batch(self, query_embeddings: List[List[float]], k: int,
+                             filters: Optional[Dict]) -> List[List[Tuple[Document, float]]]:
+        with span("vector_search"):
+            return self.vector_store.search_batch(query_embeddings, k, filters)
+
+    def retrieve_batch(self, queries: List[str], query_embeddings: List[List[float]], top_k: int = Configuration.TOP_K,
+                       filters: Optional[Dict] = None) -> List[List[Tuple[Document, float]]]:
+        """``retrieve_with_scores`` for many queries whose embeddings were computed in one batch."""
+        vector_future = self._executor.submit(self._vector_search_batch, query_embeddings, top_k, filters)
+        with span("bm25_search"):
+            bm25_results = self.bm25_retriever.search_batch(queries, top_k, filters)
+        return [
+            self._fuse([(self.vector_weight, vector), (1.0 - self.vector_weight, keyword)])[:self.candidate_limit]
+            for vector, keyword in zip(vector_future.result(), bm25_results)
+        ]
 
 class Reranker:
-    def __init__(self, model_name=Configuration.RERANKER_MODEL):
+    """Cross-encoder reranker, loaded once per process via ``get_instance``."""
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, model_name=Configuration.RERANKER_MODEL, backend: str = Configuration.RERANKER_BACKEND,
+                 batch_size: int = Configuration.RERANKER_BATCH_SIZE, max_length: int = Configuration.RERANKER_MAX_LENGTH):
+        self.backend = backend
+        self.batch_size = batch_size
+        self.max_length = max_length
         try:
+            from transformers import AutoTokenizer  # Deferred: importing transformers takes seconds
+
             self.tokenizer = AutoTokenizer.from_pretrained(model_name)
-            self.model = AutoModelForSequenceClassification.from_pretrained(model_name)
-            logger.info(f"Loaded reranking model: {model_name}")
+            self.model = self._load_model(model_name, backend)
+            logger.info(f"Loaded reranking model: {model_name} (backend={backend})")
         except Exception as e:
             logger.error(f"Error loading reranking model: {e}")
             raise
 
+    @staticmethod
+    def _load_model(model_name: str, backend: str):
+        """Load the scoring model for the configured CPU backend."""
+        if backend == "onnx":
+            try:
+                from optimum.onnxruntime import ORTModelForSequenceClassification
+            except ImportError as e:
+                raise ImportError("The 'onnx' reranker backend requires `pip install optimum[onnxruntime]`.") from e
+            return ORTModelForSequenceClassification.from_pretrained(model_name, export=True)
+
+        import torch
+        from transformers import AutoModelForSequenceClassification
+
+        model = AutoModelForSequenceClassification.from_pretrained(model_name)
+        model.eval()
+        if backend == "int8":
+            model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        elif backend != "torch":
+            raise ValueError(f"Unknown reranker backend: {backend}")
+        return model
+
+    @classmethod
+    def get_instance(cls) -> "Reranker":
+        """Return the process-wide reranker, loading it on first use."""
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    cls._instance = cls()
+        return cls._instance
+
+    def score(self, query: str, documents: List[Document]) -> List[float]:
+        return self.score_pairs([(query, doc.page_content) for doc in documents])
+
+    def score_pairs(self, pairs: List[Tuple[str, str]]) -> List[float]:
+        """Score (query, text) pairs in length-bucketed micro-batches."""
+        import torch
+
+        # Sorting by length keeps similarly sized pairs together, so each batch
+        # is only padded to its own longest member.
+        order = sorted(range(len(pairs)), key=lambda i: len(pairs[i][0]) + len(pairs[i][1]))
+        DOCUMENTS_SCORED.inc(len(pairs), scorer="reranker")
+        scores = [0.0] * len(pairs)
+        with torch.inference_mode():
+            for start in range(0, len(order), self.batch_size):
+                batch = order[start:start + self.batch_size]
+                features = self.tokenizer(
+                    [pairs[i] for i in batch],
+                    padding=True, truncation=True, max_length=self.max_length, return_tensors="pt"
+                )
+                logits = self.model(**features).logits.view(-1).float().tolist()
+                for i, logit in zip(batch, logits):
+                    scores[i] = logit
+        return scores
+
     def rerank(self, query: str, documents: List[Document], top_n: int = Configuration.TOP_N) -> List[Document]:
         try:
-            pairs = [(query, doc.page_content) for doc in documents]
-            features = self.tokenizer(pairs, padding=True, truncation=True, return_tensors="pt")
-            scores = self.model(**features).logits
-            sorted_indices = scores.argsort(descending=True)
+            if not documents:
+                return []
+            scores = self.score(query, documents)
+            sorted_indices = sorted(range(len(documents)), key=lambda i: scores[i], reverse=True)
             return [documents[i] for i in sorted_indices[:top_n]]
         except Exception as e:
             logger.error(f"Error during reranking: {e}")
-            return documents[:top_n]  # Fallback to top N documents
\ No newline at end of file
+            return documents[:top_n]  # Fallback to top N documents
+
+    def rerank_batch(self, queries: List[str], document_lists: List[List[Document]],
+                     top_n: int = Configuration.TOP_N) -> List[List[Document]]:
+        """Rerank several candidate lists with all (query, chunk) pairs packed into shared batches."""
+        pairs = [(query, doc.page_content) for query, docs in zip(queries, document_lists) for doc in docs]
+        try:
+            scores = self.score_pairs(pairs)
+        except Exception as e:
+            logger.error(f"Error during batch reranking: {e}")
+            return [docs[:top_n] for docs in document_lists]
+        results, offset = [], 0
+        for docs in document_lists:
+            doc_scores = scores[offset:offset + len(docs)]
+            offset += len(docs)
+            order = sorted(range(len(docs)), key=lambda i: doc_scores[i], reverse=True)
+            results.append([docs[i] for i in order[:top_n]])
+        return results
@@ -0,0 +1,359 @@
+import asyncio
+import inspect
+import itertools
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable, List, Optional, Set, Tuple
+from langchain.schema.embeddings import Embeddings
+from config_file import Configuration
+from metrics import SCHEDULER_COALESCED, SCHEDULER_REJECTED, SCHEDULER_RETRIES, record_embedding_call
+from utils import logger
+
+# Provider errors worth retrying: quota exhaustion and transient unavailability
+_RETRYABLE_ERRORS = ("ResourceExhausted", "TooManyRequests", "ServiceUnavailable", "DeadlineExceeded")
+_RETRYABLE_MESSAGES = ("429", "quota", "rate limit", "resource exhausted", "503", "unavailable")
+
+
+def is_retryable(error: Exception) -> bool:
+    """Whether ``error`` looks like a quota or availability error rather than a bad request."""
+    if type(error).__name__ in _RETRYABLE_ERRORS:
+        return True
+    message = str(error).lower()
+    return any(marker in message for marker in _RETRYABLE_MESSAGES)
+
+
+class SchedulerOverloaded(Exception):
+    """A call was rejected: the wait queue is full, or the provider kept refusing it."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Token-bucket rate limiter shared by threads and coroutines.
+
+    ``reserve`` takes a token immediately and returns how long the caller must
+    wait before using it, so waiting happens outside the lock with either
+    ``time.sleep`` or ``asyncio.sleep``. A rate of 0 disables limiting.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = max(1.0, capacity)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            return max(0.0, -self._tokens / self.rate)
+
+
+class _Slots:
+    """First-come first-served semaphore that threads and coroutines can both wait on."""
+
+    def __init__(self, limit: int):
+        self._available = limit
+        self._waiters: deque = deque()
+        self._lock = threading.Lock()
+
+    def _enqueue(self, wake: Callable[[], None]) -> bool:
+        """Take a free slot (True) or queue ``wake`` to be called when one is handed over (False)."""
+        with self._lock:
+            if self._available > 0 and not self._waiters:
+                self._available -= 1
+                return True
+            self._waiters.append(wake)
+            return False
+
+    def acquire(self):
+        event = threading.Event()
+        if not self._enqueue(event.set):
+            event.wait()
+
+    async def aacquire(self):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def resolve():
+            if future.cancelled():
+                self.release()  # The waiter gave up after the slot was handed over
+            else:
+                future.set_result(None)
+
+        def wake():
+            loop.call_soon_threadsafe(resolve)
+
+        if self._enqueue(wake):
+            return
+        try:
+            await future
+        except asyncio.CancelledError:
+            with self._lock:
+                queued = wake in self._waiters
+                if queued:
+                    self._waiters.remove(wake)
+            if not queued and future.done() and not future.cancelled():
+                self.release()
+            raise
+
+    def release(self):
+        with self._lock:
+            if not self._waiters:
+                self._available += 1
+                return
+            wake = self._waiters.popleft()
+        wake()
+
+
+class RequestScheduler:
+    """Admission control, concurrency limit, rate limit and retries for calls to a hosted model.
+
+    A call is admitted only while fewer than ``max_concurrency + max_queue``
+    calls are pending; otherwise it fails fast with ``SchedulerOverloaded``
+    instead of piling up. Admitted calls wait for one of ``max_concurrency``
+    slots and a token-bucket token, and quota or availability errors are
+    retried with exponential backoff and full jitter. Calls given the same
+    ``key`` while one is in flight share its result (single flight).
+    Limits are per process.
+    """
+
+    def __init__(self, name: str, max_concurrency: int, max_queue: int, requests_per_minute: float, burst: int,
+                 max_retries: int = Configuration.SCHEDULER_MAX_RETRIES,
+                 backoff: float = Configuration.SCHEDULER_BACKOFF,
+                 backoff_max: float = Configuration.SCHEDULER_BACKOFF_MAX):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.bucket = TokenBucket(requests_per_minute / 60, burst)
+        self._slots = _Slots(max_concurrency)
+        self._pending = 0
+        self._inflight: Dict[Hashable, Future] = {}
+        self._tasks: Set[asyncio.Task] = set()  # Keeps shared calls alive while only futures reference them
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_llm(cls) -> "RequestScheduler":
+        return cls("llm", Configuration.LLM_MAX_CONCURRENCY, Configuration.LLM_MAX_QUEUE,
+                   Configuration.LLM_REQUESTS_PER_MINUTE, Configuration.LLM_BURST)
+
+    @classmethod
+    def for_embeddings(cls) -> "RequestScheduler":
+        return cls("embedding", Configuration.EMBEDDING_MAX_CONCURRENCY, Configuration.EMBEDDING_MAX_QUEUE,
+                   Configuration.EMBEDDING_REQUESTS_PER_MINUTE, Configuration.EMBEDDING_BURST)
+
+    def check_admission(self):
+        """Raise ``SchedulerOverloaded`` if a new call would be rejected right now."""
+        if self._pending >= self.max_concurrency + self.max_queue:
+            SCHEDULER_REJECTED.inc(scheduler=self.name, reason="queue_full")
+            raise SchedulerOverloaded(f"Too many pending {self.name} calls; retry shortly.", retry_after=1.0)
+
+    def _admit(self):
+        with self._lock:
+            self.check_admission()
+            self._pending += 1
+
+    def _done(self):
+        with self._lock:
+            self._pending -= 1
+
+    def _retry_delay(self, error: Exception, attempt: int) -> float:
+        """Backoff before the next attempt; re-raises errors that should not be retried."""
+        if not is_retryable(error):
+            raise error
+        if attempt >= self.max_retries:
+            SCHEDULER_REJECTED.inc(scheduler=self.name, reason="retries_exhausted")
+            raise SchedulerOverloaded(f"{self.name} quota exhausted after {attempt + 1} attempts: {error}",
+                                      retry_after=self.backoff_max) from error
+        SCHEDULER_RETRIES.inc(scheduler=self.name)
+        logger.warning(f"Retrying {self.name} call after error: {error}")
+        return random.uniform(0, min(self.backoff_max, self.backoff * 2 ** attempt))
+
+    def _join(self, key: Optional[Hashable]) -> Tuple[Optional[Future], Optional[Future]]:
+        """(shared future to wait on, or None) and (own future to publish to, or None)."""
+        if key is None:
+            return None, None
+        with self._lock:
+            shared = self._inflight.get(key)
+            if shared is None:
+                own = self._inflight[key] = Future()
+                return None, own
+        SCHEDULER_COALESCED.inc(scheduler=self.name)
+        return shared, None
+
+    def _publish(self, key: Hashable, own: Future, result: Any = None, error: Optional[BaseException] = None):
+        with self._lock:
+            self._inflight.pop(key, None)
+        if error is None:
+            own.set_result(result)
+        else:
+            own.set_exception(error if isinstance(error, Exception) else RuntimeError("Shared call was cancelled"))
+
+    def _run(self, fn: Callable[[], Any]) -> Any:
+        self._admit()
+        try:
+            self._slots.acquire()
+            try:
+                for attempt in itertools.count():
+                    time.sleep(self.bucket.reserve())
+                    try:
+                        return fn()
+                    except Exception as e:
+                        time.sleep(self._retry_delay(e, attempt))
+            finally:
+                self._slots.release()
+        finally:
+            self._done()
+
+    async def _arun(self, fn: Callable[[], Awaitable]) -> Any:
+        self._admit()
+        try:
+            await self._slots.aacquire()
+            try:
+                for attempt in itertools.count():
+                    await asyncio.sleep(self.bucket.reserve())
+                    try:
+                        return await fn()
+                    except Exception as e:
+                        await asyncio.sleep(self._retry_delay(e, attempt))
+            finally:
+                self._slots.release()
+        finally:
+            self._done()
+
+    def call(self, fn: Callable[[], Any], key: Optional[Hashable] = None) -> Any:
+        """Run ``fn`` under the scheduler's limits, blocking the calling thread."""
+        shared, own = self._join(key)
+        if shared is not None:
+            return shared.result()
+        try:
+            result = self._run(fn)
+        except BaseException as e:
+            if own is not None:
+                self._publish(key, own, error=e)
+            raise
+        if own is not None:
+            self._publish(key, own, result)
+        return result
+
+    async def acall(self, fn: Callable[[], Awaitable], key: Optional[Hashable] = None) -> Any:
+        """Async variant of ``call``; ``fn`` returns the awaitable to schedule.
+
+        A keyed call runs as its own task, so a caller that is cancelled (for
+        example a query rewrite made unnecessary by chat history) does not
+        cancel it for the other callers sharing it.
+        """
+        if key is None:
+            return await self._arun(fn)
+        shared, own = self._join(key)
+        if shared is None:
+            task = asyncio.ensure_future(self._arun(fn))
+            self._tasks.add(task)
+            task.add_done_callback(lambda done: self._finish(key, own, done))
+            shared = own
+        return await asyncio.shield(asyncio.wrap_future(shared))
+
+    def _finish(self, key: Hashable, own: Future, task: asyncio.Task):
+        self._tasks.discard(task)
+        if task.cancelled():
+            self._publish(key, own, error=RuntimeError(f"Shared {self.name} call was cancelled"))
+        elif task.exception() is not None:
+            self._publish(key, own, error=task.exception())
+        else:
+            self._publish(key, own, task.result())
+
+    async def astream(self, stream: Callable[[], AsyncIterator]) -> AsyncIterator:
+        """Hold a slot for the whole stream; retries only happen before the first chunk."""
+        self._admit()
+        try:
+            await self._slots.aacquire()
+            try:
+                for attempt in itertools.count():
+                    await asyncio.sleep(self.bucket.reserve())
+                    started = False
+                    try:
+                        async for chunk in stream():
+                            started = True
+                            yield chunk
+                        return
+                    except Exception as e:
+                        if started:
+                            raise
+                        await asyncio.sleep(self._retry_delay(e, attempt))
+            finally:
+                self._slots.release()
+        finally:
+            self._done()
+
+
+class ScheduledLLM:
+    """Chat model wrapper sending every call through a ``RequestScheduler``; exposes invoke, ainvoke and astream.
+
+    Identical prompts in flight at the same time, such as the same question
+    rewritten for several concurrent requests, share one call.
+    """
+
+    def __init__(self, llm, scheduler: RequestScheduler):
+        self.llm = llm
+        self.scheduler = scheduler
+
+    def invoke(self, prompt: str):
+        return self.scheduler.call(lambda: self.llm.invoke(prompt), key=prompt)
+
+    async def ainvoke(self, prompt: str):
+        return await self.scheduler.acall(lambda: self.llm.ainvoke(prompt), key=prompt)
+
+    async def astream(self, prompt: str):
+        async for chunk in self.scheduler.astream(lambda: self.llm.astream(prompt)):
+            yield chunk
+
+    def __getattr__(self, name):
+        return getattr(self.llm, name)
+
+
+class ScheduledEmbeddings(Embeddings):
+    """Embeddings wrapper sending calls to a hosted embedding API through a ``RequestScheduler``.
+
+    Keyword arguments such as Gemini's ``task_type`` are passed through, so
+    ``embed_queries`` still embeds a batch of queries in one call.
+    """
+
+    def __init__(self, embeddings: Embeddings, scheduler: RequestScheduler, model_name: Optional[str] = None):
+        self.embeddings = embeddings
+        self.scheduler = scheduler
+        # Corpora record this name; the wrapper must not become the model's identity
+        self.model_name = model_name or getattr(embeddings, "model_name", None) or getattr(embeddings, "model", None)
+
+    def embed_documents(self, texts: List[str], **kwargs) -> List[List[float]]:
+        kind = "query" if kwargs.get("task_type") == "retrieval_query" else "document"
+
+        def embed():
+            record_embedding_call(len(texts), kind)  # Per attempt: retries are calls the provider sees too
+            return self.embeddings.embed_documents(texts, **kwargs)
+
+        return self.scheduler.call(embed)
+
+    def embed_query(self, text: str) -> List[float]:
+        def embed():
+            record_embedding_call(1, "query")
+            return self.embeddings.embed_query(text)
+
+        return self.scheduler.call(embed, key=("query", text))
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        if "task_type" in inspect.signature(self.embeddings.embed_documents).parameters:
+            return self.embed_documents(texts, task_type="retrieval_query")
+        return [self.embed_query(text) for text in texts]
@@ -0,0 +1,445 @@
+import hashlib
+import json
+from array import array
+import os
+import shutil
+import uuid
+from typing import Callable, List, Dict, Iterable, Iterator, Optional, Sequence, Tuple
+import numpy as np
+from langchain.schema import Document
+from config_file import Configuration
+from retrieval import BM25Index, CorpusStatistics, DenseIndex, MetadataColumns, QuantizedDenseIndex, quantize_vectors
+from utils import logger, atomic_write, atomic_save_npy, NpyWriter
+
+CURRENT = "CURRENT"  # File naming the generation readers should map
+GENERATIONS = "generations"
+
+
+def row_blocks(offsets: np.ndarray, block_bytes: int) -> Iterator[Tuple[int, int]]:
+    """Consecutive row ranges of a variable-length store holding about ``block_bytes`` each."""
+    rows = len(offsets) - 1
+    start = 0
+    while start < rows:
+        end = int(np.searchsorted(offsets, offsets[start] + block_bytes, side="right")) - 1
+        end = min(max(end, start + 1), rows)
+        yield start, end
+        start = end
+
+
+class ChunkStore:
+    """Read-only chunk texts and metadata stored as two memory-mapped byte arrays.
+
+    Documents are decoded on access, so a process only pays for the chunks it
+    returns; the bytes stay in the page cache, shared by every process that
+    maps the same generation.
+    """
+
+    def __init__(self, texts: np.ndarray, text_offsets: np.ndarray, metadata: np.ndarray, metadata_offsets: np.ndarray,
+                 chunk_ids: Optional[np.ndarray] = None):
+        self.texts = texts
+        self.text_offsets = text_offsets
+        self.metadata = metadata
+        self.metadata_offsets = metadata_offsets
+        self._chunk_ids = chunk_ids
+
+    def __len__(self) -> int:
+        return len(self.text_offsets) - 1
+
+    def text(self, i) -> str:
+        i = int(i)
+        return self.texts[self.text_offsets[i]:self.text_offsets[i + 1]].tobytes().decode("utf-8")
+
+    def __getitem__(self, i) -> Document:
+        i = int(i)
+        if i < 0:
+            i += len(self)
+        metadata = self.metadata[self.metadata_offsets[i]:self.metadata_offsets[i + 1]].tobytes().decode("utf-8")
+        return Document(page_content=self.text(i), metadata=json.loads(metadata))
+
+    def __iter__(self) -> Iterator[Document]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def chunk_ids(self) -> np.ndarray:
+        """Chunk id of every row as bytes; generations written before ids were stored decode them once."""
+        if self._chunk_ids is None:
+            self._chunk_ids = np.array([doc.metadata["chunk_id"].encode("utf-8") for doc in self], dtype=bytes)
+        return self._chunk_ids
+
+    @staticmethod
+    def _pack(path: str, name: str, parts: Sequence[Tuple[np.ndarray, np.ndarray, np.ndarray, Dict[int, bytes]]],
+              block_bytes: int):
+        """Write the kept rows of each (data, offsets, keep, replaced rows) part, one after the other."""
+        kept_lengths = []
+        for data, offsets, keep, replaced in parts:
+            lengths = np.diff(offsets)
+            for row, item in replaced.items():
+                lengths[row] = len(item)
+            kept_lengths.append(lengths[keep])
+        new_offsets = np.zeros(sum(len(lengths) for lengths in kept_lengths) + 1, dtype=np.int64)
+        new_offsets[1:] = np.cumsum(np.concatenate(kept_lengths))
+        with NpyWriter(os.path.join(path, f"{name}.npy"), np.uint8, (new_offsets[-1],)) as out:
+            for data, offsets, keep, replaced in parts:
+                lengths = np.diff(offsets)
+                for start, end in row_blocks(offsets, block_bytes):
+                    position = start
+                    for row in sorted(row for row in replaced if start <= row < end) + [end]:
+                        if position < row:
+                            block = np.asarray(data[offsets[position]:offsets[row]])
+                            if not keep[position:row].all():
+                                block = block[np.repeat(keep[position:row], lengths[position:row])]
+                            out.write(block)
+                        if row < end and keep[row]:
+                            out.write(np.frombuffer(replaced[row], dtype=np.uint8))
+                        position = row + 1
+        atomic_save_npy(os.path.join(path, f"{name}_offsets.npy"), new_offsets)
+
+    @classmethod
+    def write(cls, path: str, documents: Sequence[Document], base: Optional["ChunkStore"] = None,
+              keep: Optional[np.ndarray] = None, metadata: Optional[Dict[int, Dict]] = None,
+              block_bytes: int = Configuration.SNAPSHOT_BLOCK_BYTES):
+        """Write the rows of ``base`` selected by ``keep``, followed by ``documents``."""
+        base = base if base is not None else cls.empty()
+        cls.write_parts(path, [(base, keep, metadata), (cls.from_documents(documents), None, None)], block_bytes)
+
+    @classmethod
+    def write_parts(cls, path: str, parts: Sequence[Tuple["ChunkStore", Optional[np.ndarray], Optional[Dict[int, Dict]]]],
+                    block_bytes: int = Configuration.SNAPSHOT_BLOCK_BYTES):
+        """Write the rows of each (store, keep, row -> metadata) part, one store after the other.
+
+        Rows are copied as raw bytes a block at a time; only the rows whose
+        metadata is replaced are encoded again.
+        """
+        os.makedirs(path, exist_ok=True)
+        parts = [(store, keep if keep is not None else np.ones(len(store), dtype=bool),
+                  {row: json.dumps(value).encode("utf-8") for row, value in (metadata or {}).items()})
+                 for store, keep, metadata in parts]
+        cls._pack(path, "texts", [(store.texts, store.text_offsets, keep, {}) for store, keep, _ in parts], block_bytes)
+        cls._pack(path, "metadata", [(store.metadata, store.metadata_offsets, keep, replaced)
+                                     for store, keep, replaced in parts], block_bytes)
+
+        ids = [store.chunk_ids() for store, _, _ in parts]
+        width = max([array.itemsize for array in ids] + [1])
+        size = sum(int(keep.sum()) for _, keep, _ in parts)
+        with NpyWriter(os.path.join(path, "chunk_ids.npy"), f"S{width}", (size,)) as out:
+            for array, (_, keep, _) in zip(ids, parts):
+                step = max(1, block_bytes // max(1, array.itemsize))
+                for start in range(0, len(array), step):
+                    out.write(np.asarray(array[start:start + step])[keep[start:start + step]])
+
+    @classmethod
+    def from_documents(cls, documents: Sequence[Document]) -> "ChunkStore":
+        """An in-memory store of ``documents``."""
+        def pack(items: List[bytes]) -> Tuple[np.ndarray, np.ndarray]:
+            offsets = np.zeros(len(items) + 1, dtype=np.int64)
+            offsets[1:] = np.cumsum([len(item) for item in items])
+            return np.frombuffer(b"".join(items), dtype=np.uint8), offsets
+
+        texts, text_offsets = pack([doc.page_content.encode("utf-8") for doc in documents])
+        metadata, metadata_offsets = pack([json.dumps(doc.metadata).encode("utf-8") for doc in documents])
+        chunk_ids = np.array([doc.metadata["chunk_id"].encode("utf-8") for doc in documents], dtype=bytes)
+        return cls(texts, text_offsets, metadata, metadata_offsets, chunk_ids)
+
+    @classmethod
+    def empty(cls) -> "ChunkStore":
+        empty_offsets = np.zeros(1, dtype=np.int64)
+        return cls(np.zeros(0, dtype=np.uint8), empty_offsets, np.zeros(0, dtype=np.uint8), empty_offsets,
+                   np.zeros(0, dtype="S1"))
+
+    @classmethod
+    def open(cls, path: str) -> "ChunkStore":
+        def load(name: str) -> np.ndarray:
+            return np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+
+        chunk_ids = load("chunk_ids") if os.path.exists(os.path.join(path, "chunk_ids.npy")) else None
+        return cls(load("texts"), load("texts_offsets"), load("metadata"), load("metadata_offsets"), chunk_ids)
+
+
+class StagedChunks:
+    """New chunks of a writer, appended to files in ``path`` batch by batch.
+
+    Texts, metadata and BM25 term counts go to append-only byte files and
+    vectors to a float32 file, so a large upload costs disk rather than
+    memory: only the offsets, id and keep flag of each chunk stay in process.
+    ``store()`` maps the files as a ChunkStore that ``ChunkStore.write_parts``
+    copies block by block, like the previous generation. Chunks without a
+    vector (migrated or promoted ones) are embedded by ``vector_blocks()``.
+    """
+
+    NAMES = ("texts", "metadata", "terms")
+
+    def __init__(self, path: str):
+        self.path = path
+        self.ids: List[str] = []
+        self.rows: Dict[str, int] = {}  # Chunk id -> row of its latest version
+        self.keep = bytearray()  # 1 for the rows to publish
+        self.metadata: Dict[int, Dict] = {}  # Row -> rewritten metadata
+        self._offsets: Dict[str, array] = {name: array("q", [0]) for name in self.NAMES}
+        self._vector_rows = array("q")  # Row in vectors.bin, or -1 if embedded when publishing
+        self._vectors_written = 0
+        self._dimension: Optional[int] = None
+        self._files = None
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __contains__(self, cid: str) -> bool:
+        return cid in self.rows
+
+    def _file(self, name: str):
+        if self._files is None:
+            os.makedirs(self.path, exist_ok=True)
+            self._files = {name: open(os.path.join(self.path, f"{name}.bin"), "a+b") for name in self.NAMES + ("vectors",)}
+        return self._files[name]
+
+    def _read(self, name: str, start: int, end: int) -> bytes:
+        f = self._file(name)
+        f.flush()
+        f.seek(start)
+        return f.read(end - start)
+
+    def _item(self, name: str, row: int) -> bytes:
+        offsets = self._offsets[name]
+        return self._read(name, offsets[row], offsets[row + 1])
+
+    def append(self, documents: List[Document], term_counts: List[Dict[str, int]], vectors: Optional[np.ndarray] = None):
+        """Stage ``documents`` with their term counts and, if already embedded, their vectors."""
+        items = {"texts": [doc.page_content.encode("utf-8") for doc in documents],
+                 "metadata": [json.dumps(doc.metadata).encode("utf-8") for doc in documents],
+                 "terms": [json.dumps(counts).encode("utf-8") for counts in term_counts]}
+        for name, values in items.items():
+            self._file(name).write(b"".join(values))
+            offsets = self._offsets[name]
+            for value in values:
+                offsets.append(offsets[-1] + len(value))
+        if vectors is not None:
+            vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+            self._dimension = vectors.shape[1]
+            self._file("vectors").write(vectors.tobytes())
+            self._vector_rows.extend(range(self._vectors_written, self._vectors_written + len(vectors)))
+            self._vectors_written += len(vectors)
+        else:
+            self._vector_rows.extend([-1] * len(documents))
+        for doc in documents:
+            cid = doc.metadata["chunk_id"]
+            if cid in self.rows:
+                self.keep[self.rows[cid]] = 0
+            self.rows[cid] = len(self.ids)
+            self.ids.append(cid)
+            self.keep.append(1)
+
+    def document(self, cid: str) -> Document:
+        row = self.rows[cid]
+        metadata = self.metadata[row] if row in self.metadata else json.loads(self._item("metadata", row))
+        return Document(page_content=self._item("texts", row).decode("utf-8"), metadata=dict(metadata))
+
+    def vector(self, cid: str) -> Optional[np.ndarray]:
+        position = self._vector_rows[self.rows[cid]]
+        if position < 0:
+            return None
+        size = 4 * self._dimension
+        return np.frombuffer(self._read("vectors", position * size, (position + 1) * size), dtype=np.float32)
+
+    def remove(self, cid: str) -> Document:
+        """Unstage a chunk; returns it."""
+        doc = self.document(cid)
+        row = self.rows.pop(cid)
+        self.keep[row] = 0
+        self.metadata.pop(row, None)
+        return doc
+
+    def documents(self) -> Iterator[Document]:
+        """Staged chunks in publishing order."""
+        for cid in [cid for row, cid in enumerate(self.ids) if self.keep[row]]:
+            yield self.document(cid)
+
+    def _map(self, name: str) -> np.ndarray:
+        if self._offsets[name][-1] == 0:
+            return np.zeros(0, dtype=np.uint8)
+        self._file(name).flush()
+        return np.memmap(os.path.join(self.path, f"{name}.bin"), dtype=np.uint8, mode="r",
+                         shape=(self._offsets[name][-1],))
+
+    def store(self) -> Tuple[ChunkStore, np.ndarray, Dict[int, Dict]]:
+        """The staged chunks as a (store, keep, row -> metadata) part for ``ChunkStore.write_parts``."""
+        store = ChunkStore(self._map("texts"), np.array(self._offsets["texts"], dtype=np.int64),
+                           self._map("metadata"), np.array(self._offsets["metadata"], dtype=np.int64),
+                           np.array([cid.encode("utf-8") for cid in self.ids], dtype=bytes))
+        return store, self._keep_mask(), self.metadata
+
+    def _keep_mask(self) -> np.ndarray:
+        return np.frombuffer(self.keep, dtype=np.uint8).astype(bool)
+
+    def term_counts(self) -> Iterator[Dict[str, int]]:
+        """Term counts of the staged chunks in publishing order."""
+        terms, offsets = self._map("terms"), self._offsets["terms"]
+        for row in np.flatnonzero(self._keep_mask()):
+            yield json.loads(terms[offsets[row]:offsets[row + 1]].tobytes())
+
+    def vector_blocks(self, embed: Callable[[List[str]], List[List[float]]],
+                      block_bytes: int = Configuration.SNAPSHOT_BLOCK_BYTES) -> Iterator[np.ndarray]:
+        """Vectors of the staged chunks in publishing order, a block at a time; missing ones are embedded by ``embed``."""
+        rows = np.flatnonzero(self._keep_mask())
+        positions = np.frombuffer(self._vector_rows, dtype=np.int64)[rows]
+        vectors = None
+        if self._vectors_written:
+            self._file("vectors").flush()
+            vectors = np.memmap(os.path.join(self.path, "vectors.bin"), dtype=np.float32, mode="r",
+                                shape=(self._vectors_written, self._dimension))
+        step = max(1, block_bytes // (4 * (self._dimension or 1024)))
+        texts, text_offsets = self._map("texts"), self._offsets["texts"]
+        for start in range(0, len(rows), step):
+            block_rows, block_positions = rows[start:start + step], positions[start:start + step]
+            missing = np.flatnonzero(block_positions < 0)
+            embedded = None
+            if len(missing):
+                # Chunks migrated from Chroma or promoted from an alias; the embedding cache may still hold them
+                embedded = np.asarray(embed([texts[text_offsets[row]:text_offsets[row + 1]].tobytes().decode("utf-8")
+                                             for row in block_rows[missing]]), dtype=np.float32)
+            if embedded is not None and len(missing) == len(block_rows):
+                yield embedded
+                continue
+            block = np.array(vectors[np.maximum(block_positions, 0)])
+            if embedded is not None:
+                block[missing] = embedded
+            yield block
+
+    def close(self):
+        """Close and delete the staging files."""
+        if self._files is not None:
+            for f in self._files.values():
+                f.close()
+            self._files = None
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+def write_embeddings(path: str, blocks: Iterable[np.ndarray], shape: Tuple[int, int],
+                     method: str = Configuration.VECTOR_QUANTIZATION,
+                     block_bytes: int = Configuration.SNAPSHOT_BLOCK_BYTES):
+    """Write ``blocks`` of vectors, normalised, as ``embeddings.npy`` and then their quantized codes.
+
+    Codes are computed from the written matrix a block at a time; int8 reads it
+    once more for its per-dimension scales.
+    """
+    with NpyWriter(os.path.join(path, "embeddings.npy"), np.float32, shape) as out:
+        for block in blocks:
+            block = np.asarray(block, dtype=np.float32)
+            out.write(block / np.maximum(np.linalg.norm(block, axis=1, keepdims=True), 1e-12))
+    if method == "none":
+        return
+    vectors = np.load(os.path.join(path, "embeddings.npy"), mmap_mode="r")
+    step = max(1, block_bytes // max(1, 4 * shape[1]))
+    scale = None
+    if method == "int8":
+        peak = np.full(shape[1], 1e-12, dtype=np.float32)
+        for start in range(0, shape[0], step):
+            peak = np.maximum(peak, np.abs(vectors[start:start + step]).max(axis=0))
+        scale = (peak / 127 if shape[0] else np.ones(shape[1], dtype=np.float32)).astype(np.float32)
+        atomic_save_npy(os.path.join(path, "embeddings_scale.npy"), scale)
+    width = shape[1] if method == "int8" else (shape[1] + 7) // 8
+    with NpyWriter(os.path.join(path, f"embeddings_{method}.npy"), np.int8 if method == "int8" else np.uint8,
+                   (shape[0], width)) as out:
+        for start in range(0, shape[0], step):
+            out.write(quantize_vectors(vectors[start:start + step], method, scale)["codes"])
+
+
+class Snapshot:
+    """One published generation of a corpus, opened read-only.
+
+    The chunk store, the embedding matrix, the BM25 postings and the metadata
+    filter columns are memory-mapped; only small per-term and per-document
+    arrays (IDF, length normalisation) are computed in process. With
+    ``VECTOR_QUANTIZATION`` set, dense search scans the generation's quantized
+    codes and reads the float32 matrix only for rescoring.
+    """
+
+    def __init__(self, path: str, tenant: str, embedding_model):
+        self.path = path
+        self.tenant = tenant
+        self.generation = os.path.basename(path)
+        with open(os.path.join(path, "manifest.json")) as f:
+            self.manifest: Dict = json.load(f)
+        self.version = self.manifest["version"]
+        self.fingerprint = content_fingerprint(self.manifest)
+        self.chunks = ChunkStore.open(os.path.join(path, "chunks"))
+        self.vectors = np.load(os.path.join(path, "embeddings.npy"), mmap_mode="r")
+        self.vectorstore = self._open_vectorstore(embedding_model)
+        self.bm25_index = BM25Index.load(os.path.join(path, "bm25"), documents=self.chunks)
+        self.columns = self._open_columns()
+        self.vectorstore.columns = self.bm25_index.columns = self.columns  # One set of filter masks for both arms
+        self.statistics = CorpusStatistics.load(os.path.join(path, "stats.json"))
+
+    def __len__(self) -> int:
+        return len(self.chunks)
+
+    def _open_columns(self) -> MetadataColumns:
+        columns_path = os.path.join(self.path, "columns")
+        if os.path.exists(os.path.join(columns_path, "columns.json")):
+            return MetadataColumns.load(columns_path)
+        return MetadataColumns(documents=self.chunks)  # Published before columns were stored
+
+    def _open_vectorstore(self, embedding_model) -> DenseIndex:
+        method = Configuration.VECTOR_QUANTIZATION
+        if method == "none":
+            return DenseIndex(self.chunks, self.vectors, embedding_model)
+        codes_path = os.path.join(self.path, f"embeddings_{method}.npy")
+        if not os.path.exists(codes_path):
+            logger.warning(f"Generation {self.path} has no {method} codes; scanning float32 vectors until the next publish.")
+            return DenseIndex(self.chunks, self.vectors, embedding_model)
+        codes = np.load(codes_path, mmap_mode="r")
+        scale = np.load(os.path.join(self.path, "embeddings_scale.npy")) if method == "int8" else None
+        return QuantizedDenseIndex(self.chunks, self.vectors, codes, scale, embedding_model)
+
+
+def content_fingerprint(manifest: Dict) -> str:
+    """Hash of a generation's source names, file fingerprints and embedding model.
+
+    Corpora built from the same files with the same model get the same
+    fingerprint, whichever chat they belong to.
+    """
+    sources = sorted((name, entry["fingerprint"]) for name, entry in manifest.get("sources", {}).items())
+    payload = json.dumps({"sources": sources, "embedding_model": manifest.get("embedding_model")})
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def read_current(corpus_path: str) -> Optional[str]:
+    """Name of the current generation, or None if nothing was published yet."""
+    try:
+        with open(os.path.join(corpus_path, CURRENT)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def publish_snapshot(corpus_path: str, manifest: Dict, write_artifacts: Callable[[str], None],
+                     keep: int = Configuration.SNAPSHOT_KEEP_GENERATIONS) -> str:
+    """Write a new generation and make it current with one atomic rename; returns its name.
+
+    ``write_artifacts(path)`` writes the chunk store, embeddings, BM25 index
+    and statistics into a staging directory; the manifest is written last.
+    The caller must hold the corpus's write lock. Readers keep using the
+    generation they mapped until they see the new CURRENT, and older
+    generations stay readable through existing mappings after removal.
+    """
+    generations = os.path.join(corpus_path, GENERATIONS)
+    name = f"{manifest['version']:010d}"
+    staging = os.path.join(generations, f".{name}.{uuid.uuid4().hex}")
+    os.makedirs(staging)
+    write_artifacts(staging)
+    atomic_write(os.path.join(staging, "manifest.json"), json.dumps(manifest))
+
+    final = os.path.join(generations, name)
+    if os.path.exists(final):
+        shutil.rmtree(final)  # Left behind by a publish that failed before switching CURRENT
+    os.rename(staging, final)
+    atomic_write(os.path.join(corpus_path, CURRENT), name)
+    _remove_old_generations(generations, keep)
+    logger.info(f"Published generation {name} of {corpus_path}.")
+    return name
+
+
+def _remove_old_generations(generations: str, keep: int):
+    names = sorted(os.listdir(generations))
+    published = [name for name in names if not name.startswith(".")]
+    for name in published[:-max(1, keep)] + [name for name in names if name.startswith(".")]:
+        shutil.rmtree(os.path.join(generations, name), ignore_errors=True)
@@ -1,6 +1,8 @@
 import streamlit as st
 import requests
+import json
 import uuid
+import time
 from datetime import datetime
 from dotenv import load_dotenv
 
@@ -10,6 +12,26 @@ load_dotenv()
 # FastAPI backend URL
 BACKEND_URL = "http://localhost:8000"
 
+def error_detail(response):
+    """The API's error message, or the raw body if the response is not the API's JSON (e.g. a proxy error)."""
+    try:
+        return response.json()["detail"]
+    except (ValueError, KeyError, TypeError):
+        return response.text or f"HTTP {response.status_code}"
+
+def stream_chat(payload):
+    """POST to /chat/stream and yield (event, data) pairs from the Server-Sent Events."""
+    with requests.post(f"{BACKEND_URL}/chat/stream", json=payload, stream=True) as response:
+        if response.status_code != 200:
+            raise RuntimeError(error_detail(response))
+        event = "message"
+        for line in response.iter_lines(decode_unicode=True):
+            if line.startswith("event: "):
+                event = line[len("event: "):]
+            elif line.startswith("data: "):
+                yield event, json.loads(line[len("data: "):])
+                event = "message"
+
 # Streamlit app
 st.title("Chat with your Document Engine")
 st.write("Upload your document and interract with it !!")
@@ -73,11 +95,37 @@ if st.session_state.userID:
         uploaded_files = st.file_uploader("Upload PDFs", type="pdf", accept_multiple_files=True)
         if uploaded_files and st.button("Upload and Embed"):
             files = [("files", (file.name, file.getvalue(), "application/pdf")) for file in uploaded_files]
-            response = requests.post(f"{BACKEND_URL}/upload", files=files)
+            response = requests.post(
+                f"{BACKEND_URL}/upload",
+                data={"userID": st.session_state.userID, "chatID": st.session_state.active_chat},
+                files=files
+            )
             if response.status_code == 200:
-                st.success(response.json()["message"])
+                job_id = response.json()["job_id"]
+                # Poll the ingestion job until it finishes
+                with st.spinner("Parsing and embedding documents..."):
+                    while True:
+                        status = requests.get(f"{BACKEND_URL}/upload/{job_id}")
+                        if not status.ok:
+                            job = {"status": "failed", "error": error_detail(status)}
+                        else:
+                            try:
+                                job = status.json()
+                            except ValueError:
+                                job = {"status": "failed", "error": f"Invalid job status: {status.text[:200]}"}
+                        if job["status"] in ("completed", "failed"):
+                            break
+                        time.sleep(1)
+                if job["status"] == "completed":
+                    st.success(
+                        f"Embedded {job['embedded']} new chunks from {job['pages']} pages "
+                        f"({job['files_unchanged']} unchanged files skipped, "
+                        f"{job['chunks_collapsed']} duplicate chunks collapsed)."
+                    )
+                else:
+                    st.error(f"Failed to embed PDFs: {job['error']}")
             else:
-                st.error(f"Failed to upload PDFs: {response.json()['detail']}")
+                st.error(f"Failed to upload PDFs: {error_detail(response)}")
 
         # Display chat messages
         chat_messages = st.session_state.chats[st.session_state.active_chat]["messages"]
@@ -95,28 +143,33 @@ if st.session_state.userID:
                 "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             })
 
-            # Call FastAPI backend to get the bot's response
+            with st.chat_message("user"):
+                st.markdown(user_input)
+
+            # Stream the bot's response from the FastAPI backend, rendering tokens as they arrive
             try:
-                response = requests.post(
-                    f"{BACKEND_URL}/chat",
-                    json={
+                with st.chat_message("assistant"):
+                    placeholder = st.empty()
+                    answer = ""
+                    for event, data in stream_chat({
                         "userID": st.session_state.userID,
                         "chatID": st.session_state.active_chat,
                         "question": user_input
-                    }
-                )
-                if response.status_code == 200:
-                    result = response.json()
-                    # Add bot's response to chat
-                    st.session_state.chats[st.session_state.active_chat]["messages"].append({
-                        "role": "assistant",
-                        "content": result["answer"],
-                        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                    })
-                    # Rerun to update the chat interface
-                    st.rerun()
-                else:
-                    st.error(f"Error: {response.json()['detail']}")
+                    }):
+                        if event == "token":
+                            answer += data
+                            placeholder.markdown(answer + "▌")
+                        elif event == "done":
+                            answer = data["answer"]
+                        elif event == "error":
+                            raise RuntimeError(data["detail"])
+                    placeholder.markdown(answer)
+                # Add bot's response to chat
+                st.session_state.chats[st.session_state.active_chat]["messages"].append({
+                    "role": "assistant",
+                    "content": answer,
+                    "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                })
             except Exception as e:
                 st.error(f"An error occurred: {e}")
     else:
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The modules are imported from the repository root, as app.py and the benchmarks do
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
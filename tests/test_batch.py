@@ -0,0 +1,102 @@
+import asyncio
+
+import pytest
+from langchain.schema import Document
+
+from batch import BatchQA
+from config_file import Configuration
+from corpus import CorpusRegistry, chunk_id
+from retrieval import HybridRetriever
+from benchmarks.fakes import FakeLLM, FakeReranker, HashEmbeddings
+
+TOPICS = ["invoice payment terms", "refund policy", "contract renewal notice", "tax report deadline"]
+
+
+class BatchEmbeddings(HashEmbeddings):
+    def __init__(self):
+        super().__init__()
+        self.batches = []
+
+    def embed_queries(self, texts):
+        self.batches.append(list(texts))
+        return [self._embed(text) for text in texts]
+
+
+class TrackingLLM(FakeLLM):
+    def __init__(self, fail_on=None):
+        super().__init__(delay=0.02)
+        self.fail_on = fail_on
+        self.in_flight = self.peak = 0
+
+    async def ainvoke(self, prompt):
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        try:
+            if self.fail_on and self.fail_on in prompt:
+                raise RuntimeError("generation failed")
+            return await super().ainvoke(prompt)
+        finally:
+            self.in_flight -= 1
+
+
+@pytest.fixture(scope="module")
+def snapshot(tmp_path_factory):
+    corpus = CorpusRegistry(HashEmbeddings(), str(tmp_path_factory.mktemp("corpora"))).get("u", "c", create=True)
+    documents = [Document(page_content=f"Section {i}: {topic} details {i}",
+                          metadata={"source": f"{topic.split()[0]}.pdf", "page": i,
+                                    "chunk_id": chunk_id(topic, i, topic)})
+                 for topic in TOPICS for i in range(5)]
+    with corpus.writer() as writer:
+        writer.add_documents(documents)
+        for topic in TOPICS:
+            writer.commit_source(f"{topic.split()[0]}.pdf", topic,
+                                 [doc.metadata["chunk_id"] for doc in documents if topic in doc.page_content])
+        writer.publish()
+    return corpus.snapshot()
+
+
+def make_batch(snapshot, llm, embeddings=None, concurrency=8):
+    return BatchQA(llm, embeddings or BatchEmbeddings(), HybridRetriever(snapshot.vectorstore, snapshot.bm25_index),
+                   FakeReranker(delay=0), concurrency=concurrency)
+
+
+def test_questions_are_embedded_once_and_answered_in_order(snapshot):
+    embeddings = BatchEmbeddings()
+    questions = [f"What is the {topic}?" for topic in TOPICS]
+    answers = asyncio.run(make_batch(snapshot, TrackingLLM(), embeddings).answer_all(questions))
+    assert embeddings.batches == [questions]
+    assert [answer.index for answer in answers] == [0, 1, 2, 3]
+    assert all(answer.answer == "no" and answer.error is None for answer in answers)
+    assert answers[1].sources and all(source.startswith("refund.pdf") for source in answers[1].sources)
+
+
+def test_batch_retrieval_matches_single_questions(snapshot):
+    retriever = HybridRetriever(snapshot.vectorstore, snapshot.bm25_index)
+    questions = [f"{topic} question" for topic in TOPICS]
+    embeddings = BatchEmbeddings().embed_queries(questions)
+    batch = retriever.retrieve_batch(questions, embeddings, top_k=4)
+    for question, results in zip(questions, batch):
+        single = retriever.retrieve_with_scores(question, top_k=4)
+        assert [doc.metadata["chunk_id"] for doc, _ in results] == [doc.metadata["chunk_id"] for doc, _ in single]
+
+
+def test_generation_is_bounded_and_failures_stay_per_question(snapshot):
+    llm = TrackingLLM(fail_on="refund")
+    questions = [f"Tell me about the {TOPICS[i % 4]} ({i})" for i in range(12)]
+    answers = asyncio.run(make_batch(snapshot, llm, concurrency=3).answer_all(questions))
+    assert llm.peak == 3
+    failed = [answer.index for answer in answers if answer.error]
+    assert failed == [1, 5, 9]
+    assert all(answer.answer == "no" for answer in answers if not answer.error)
+
+
+def test_without_rerank_the_fused_order_is_kept(snapshot):
+    batch = make_batch(snapshot, TrackingLLM())
+    documents = batch.retrieve(["refund policy"], top_k=5, rerank=False)[0]
+    fused = batch.retriever.retrieve("refund policy", top_k=5)
+    assert len(documents) == Configuration.TOP_N
+    assert [doc.metadata["chunk_id"] for doc in documents] == [doc.metadata["chunk_id"] for doc in fused][:len(documents)]
+
+
+def test_empty_batch():
+    assert asyncio.run(BatchQA(None, None, None, None).answer_all([])) == []
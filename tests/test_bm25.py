@@ -0,0 +1,72 @@
+import numpy as np
+from langchain.schema import Document
+
+from retrieval import BM25Index, MetadataColumns, metadata_mask
+
+WORDS = ["invoice", "payment", "due", "contract", "renewal", "notice", "refund", "policy", "tax", "report"]
+
+
+def make_documents(n):
+    return [Document(page_content=" ".join(WORDS[(i * 7 + j) % len(WORDS)] for j in range(i % 6 + 2)),
+                     metadata={"chunk_id": f"c{i}", "source": f"s{i % 3}.pdf", "page": i % 4}) for i in range(n)]
+
+
+def assert_same_scores(left, right, queries=("invoice due", "refund policy", "tax report notice", "missing")):
+    for query in queries:
+        np.testing.assert_allclose(left.get_scores(query), right.get_scores(query), rtol=1e-5)
+    np.testing.assert_allclose(left.get_score_matrix(list(queries)), right.get_score_matrix(list(queries)), rtol=1e-5)
+
+
+def test_save_and_load_round_trip(tmp_path):
+    index = BM25Index()
+    documents = make_documents(40)
+    index.add_documents(documents[:25])
+    index.add_documents(documents[25:])
+
+    index.save(str(tmp_path))
+    loaded = BM25Index.load(str(tmp_path))
+    assert isinstance(loaded.doc_ids, np.memmap)
+    assert [doc.metadata["chunk_id"] for doc in loaded.documents] == [doc.metadata["chunk_id"] for doc in documents]
+    assert_same_scores(index, loaded)
+
+
+def test_delete_matches_a_fresh_index(tmp_path):
+    documents = make_documents(40)
+    index = BM25Index()
+    index.add_documents(documents)
+    index.save(str(tmp_path))
+    loaded = BM25Index.load(str(tmp_path))
+
+    deleted = {f"c{i}" for i in range(0, 40, 3)}
+    removed = loaded.delete(deleted)
+    assert {doc.metadata["chunk_id"] for doc in removed} == deleted
+    fresh = BM25Index()
+    fresh.add_documents([doc for doc in documents if doc.metadata["chunk_id"] not in deleted])
+    assert_same_scores(loaded, fresh)
+
+    loaded.save(str(tmp_path / "after"))
+    assert_same_scores(BM25Index.load(str(tmp_path / "after")), fresh)
+
+
+
+def test_filtered_search_only_returns_matching_documents():
+    documents = make_documents(40)
+    index = BM25Index()
+    index.add_documents(documents)
+    filters = {"source": "s1.pdf", "page": 2}
+    assert np.array_equal(index._filter_mask(filters), metadata_mask(documents, filters))
+    hits = index.search("invoice payment due contract", k=10, filters=filters)
+    assert hits and all(doc.metadata["source"] == "s1.pdf" and doc.metadata["page"] == 2 for doc, _ in hits)
+
+
+def test_metadata_columns_match_a_scan(tmp_path):
+    documents = make_documents(40)
+    documents[3].metadata["year"] = 2021
+    columns = MetadataColumns(documents=documents, cache_size=2)
+    columns.save(str(tmp_path))
+    loaded = MetadataColumns.load(str(tmp_path))
+    for filters in ({"page": 1}, {"source": "s0.pdf", "page": 3}, {"year": 2021}, {"year": None},
+                    {"missing": None}, {"missing": "x"}, {"page": "1"}, {"page": [1]}):
+        assert np.array_equal(columns.mask(filters), metadata_mask(documents, filters)), filters
+        assert np.array_equal(loaded.mask(filters), columns.mask(filters)), filters
+    assert len(columns._masks) == 2
@@ -0,0 +1,143 @@
+import numpy as np
+from langchain.schema import Document
+
+import cache
+from cache import AnswerCache, CachedEmbeddings, SQLiteEmbeddingCache
+from corpus import CorpusRegistry, chunk_id
+from benchmarks.fakes import HashEmbeddings
+
+
+class RecordingEmbeddings(HashEmbeddings):
+    def __init__(self):
+        super().__init__()
+        self.batches = []
+
+    def embed_documents(self, texts):
+        self.batches.append(list(texts))
+        return super().embed_documents(texts)
+
+
+def test_only_unseen_texts_reach_the_model():
+    model = RecordingEmbeddings()
+    cached = CachedEmbeddings(model, "fake", memory_size=100)
+    first = cached.embed_documents(["alpha", "beta"])
+    second = cached.embed_documents(["beta", "gamma", "alpha"])
+
+    assert model.batches == [["alpha", "beta"], ["gamma"]]
+    assert second[0] == first[1] and second[2] == first[0]
+    assert cached.stats() == {"memory_hits": 2, "disk_hits": 0, "misses": 3}
+
+
+def test_queries_and_documents_are_cached_separately():
+    model = RecordingEmbeddings()
+    cached = CachedEmbeddings(model, "fake")
+    cached.embed_documents(["alpha"])
+    cached.embed_query("alpha")
+    cached.embed_query("alpha")
+    assert model.calls == 2
+    assert cached.embed_queries(["alpha", "beta"])[0] == cached.embed_query("alpha")
+    assert model.calls == 3
+
+
+def test_disk_tier_survives_a_restart(tmp_path):
+    path = str(tmp_path / "cache" / "embeddings.sqlite3")
+    model = RecordingEmbeddings()
+    vectors = CachedEmbeddings(model, "fake", store=SQLiteEmbeddingCache(path)).embed_documents(["alpha", "beta"])
+
+    restarted = CachedEmbeddings(model, "fake", store=SQLiteEmbeddingCache(path))
+    again = restarted.embed_documents(["alpha", "beta"])
+    assert len(model.batches) == 1
+    np.testing.assert_allclose(again, vectors, rtol=1e-6)
+    assert restarted.stats()["disk_hits"] == 2
+    restarted.embed_documents(["alpha"])
+    assert restarted.stats()["memory_hits"] == 1
+
+
+def test_memory_tier_is_bounded():
+    model = RecordingEmbeddings()
+    cached = CachedEmbeddings(model, "fake", memory_size=2)
+    cached.embed_documents(["alpha", "beta", "gamma"])
+    cached.embed_documents(["alpha"])
+    assert model.batches[-1] == ["alpha"]
+
+
+def test_model_name_is_part_of_the_key():
+    model = RecordingEmbeddings()
+    store = SQLiteEmbeddingCache(":memory:")
+    CachedEmbeddings(model, "old-model", store=store).embed_documents(["alpha"])
+    CachedEmbeddings(model, "new-model", store=store).embed_documents(["alpha"])
+    assert len(model.batches) == 2
+
+
+class FailingEmbeddings(HashEmbeddings):
+    def embed_query(self, text):
+        raise RuntimeError("quota exceeded")
+
+
+def test_answers_match_normalised_questions_within_a_scope():
+    answers = AnswerCache()
+    answers.put("corpus-1", "What is the refund policy?", {"answer": "30 days"})
+    assert answers.get("corpus-1", "  what is the REFUND policy ") == {"answer": "30 days"}
+    assert answers.get("corpus-2", "What is the refund policy?") is None
+    assert answers.stats()["exact_hits"] == 1 and answers.stats()["misses"] == 1
+
+
+def test_semantic_hits_need_similar_questions():
+    answers = AnswerCache(HashEmbeddings(), similarity_threshold=0.8)
+    answers.put("scope", "What is the refund policy for annual plans", "30 days")
+    assert answers.get("scope", "what is the refund policy for the annual plans") == "30 days"
+    assert answers.get("scope", "Who signed the contract") is None
+    assert answers.get("other", "what is the refund policy for the annual plans") is None
+    assert answers.stats()["semantic_hits"] == 1
+
+
+def test_failed_question_embedding_is_a_miss():
+    answers = AnswerCache(FailingEmbeddings())
+    answers.put("scope", "question one", "answer")
+    assert answers.get("scope", "question one") == "answer"
+    assert answers.get("scope", "question two") is None
+
+
+def test_entries_expire_and_are_evicted(monkeypatch):
+    answers = AnswerCache(max_entries=2, ttl=10)
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, "time", lambda: now[0])
+    for question in ("one", "two", "three"):
+        answers.put("scope", question, question)
+    assert answers.get("scope", "one") is None
+    assert answers.get("scope", "three") == "three"
+    now[0] += 11
+    assert answers.get("scope", "three") is None
+
+
+def test_invalidate_drops_matching_scopes():
+    answers = AnswerCache()
+    answers.put(("corpus-1", 5), "question", "old")
+    answers.put(("corpus-2", 5), "question", "kept")
+    answers.invalidate(lambda scope: scope[0] == "corpus-1")
+    assert answers.get(("corpus-1", 5), "question") is None
+    assert answers.get(("corpus-2", 5), "question") == "kept"
+
+
+def upload(corpus, source, text):
+    document = Document(page_content=text, metadata={"source": source, "chunk_id": chunk_id(source, 0, text)})
+    with corpus.writer() as writer:
+        writer.add_documents([document])
+        writer.commit_source(source, text, [document.metadata["chunk_id"]])
+        writer.publish()
+
+
+def test_new_documents_change_the_scope(tmp_path):
+    registry = CorpusRegistry(HashEmbeddings(), str(tmp_path))
+    corpus = registry.get("user", "chat", create=True)
+    upload(corpus, "a.pdf", "alpha")
+    answers = AnswerCache()
+    answers.put(corpus.snapshot().fingerprint, "question", "answer from a.pdf")
+
+    # Another chat over the same files shares the entry
+    other = registry.get("user", "other-chat", create=True)
+    upload(other, "a.pdf", "alpha")
+    assert answers.get(other.snapshot().fingerprint, "question") == "answer from a.pdf"
+
+    upload(corpus, "b.pdf", "beta")
+    assert answers.get(corpus.snapshot().fingerprint, "question") is None
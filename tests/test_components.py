@@ -0,0 +1,73 @@
+import asyncio
+import threading
+import time
+
+from components import Components
+from config_file import Configuration
+from corpus import CorpusRegistry
+from history import ChatHistory, MemoryHistoryBackend
+from benchmarks.fakes import FakeGemini, FakeLLM, FakeReranker, HashEmbeddings
+
+LOAD_SECONDS = 0.5
+
+
+class SlowRerankerComponents(Components):
+    """Components whose reranker takes ``LOAD_SECONDS`` to load, like a real cross-encoder."""
+
+    def __init__(self, root_dir):
+        super().__init__()
+        self.override("gemini", FakeGemini(FakeLLM(delay=0), HashEmbeddings()))
+        self.override("corpora", CorpusRegistry(HashEmbeddings(), root_dir))
+        self.override("history", ChatHistory(MemoryHistoryBackend()))
+
+    @property
+    def reranker(self):
+        def load():
+            time.sleep(LOAD_SECONDS)
+            return FakeReranker(delay=0)
+
+        return self._get("reranker", load)
+
+
+def test_components_load_independently(tmp_path):
+    components = SlowRerankerComponents(str(tmp_path))
+    loading = threading.Thread(target=lambda: components.reranker)
+    loading.start()
+    time.sleep(0.05)
+    start = time.perf_counter()
+    assert components.ingestion is not None and components.answer_cache is not None
+    assert time.perf_counter() - start < LOAD_SECONDS / 2  # Not queued behind the reranker
+    loading.join()
+
+
+def test_aget_keeps_the_event_loop_free(tmp_path):
+    components = SlowRerankerComponents(str(tmp_path))
+
+    async def scenario():
+        loading = asyncio.ensure_future(components.aget("reranker"))
+        ticks, start = 0, time.perf_counter()
+        while not loading.done():
+            await asyncio.sleep(0.01)
+            ticks += 1
+        average_tick = (time.perf_counter() - start) / ticks
+        return await loading, ticks, average_tick
+
+    reranker, ticks, average_tick = asyncio.run(scenario())
+    assert isinstance(reranker, FakeReranker)
+    assert ticks >= 10 and average_tick < 0.1
+    assert asyncio.run(components.aget("reranker")) is reranker  # Built once
+
+
+def test_warm_up_builds_everything_before_ready(tmp_path, monkeypatch):
+    monkeypatch.setattr(Configuration, "STARTUP_WARMUP", True)
+    components = SlowRerankerComponents(str(tmp_path))
+
+    async def scenario():
+        await components.start()
+        assert not components.ready
+        await components._warmup
+        await components.stop()
+
+    asyncio.run(scenario())
+    assert components.ready and components.warmup_error is None
+    assert {"ingestion", "answer_cache", "reranker"} <= set(components.timings)
@@ -0,0 +1,60 @@
+from langchain.schema import Document
+
+from context import ContextBuilder
+from metrics import estimate_tokens
+
+PAGE = " ".join(f"word{i}" for i in range(400))
+
+
+def chunk(start, end, source="a.pdf", page=0, offsets=True, **metadata):
+    if offsets:
+        metadata["start_index"] = start
+    return Document(page_content=PAGE[start:end], metadata={"source": source, "page": page, **metadata})
+
+
+def test_overlapping_chunks_are_sent_once():
+    context, passages = ContextBuilder(token_budget=10000).build([chunk(0, 300), chunk(200, 500), chunk(500, 600)])
+    assert len(passages) == 1
+    assert passages[0].text == PAGE[0:600]
+    assert context.count("word30 ") == 1
+
+
+def test_overlap_is_found_without_offsets():
+    documents = [chunk(200, 500, offsets=False), chunk(0, 300, offsets=False), chunk(50, 150, offsets=False)]
+    _, passages = ContextBuilder(token_budget=10000).build(documents)
+    assert [p.text for p in passages] == [PAGE[0:500]]
+
+
+def test_separate_pages_and_gaps_stay_apart():
+    documents = [chunk(0, 100), chunk(300, 400), chunk(0, 100, page=1), chunk(0, 100, source="b.pdf")]
+    _, passages = ContextBuilder(token_budget=10000).build(documents)
+    assert [p.citation for p in passages] == ["a.pdf p.1", "a.pdf p.1", "a.pdf p.2", "b.pdf p.1"]
+
+
+def test_passages_follow_the_best_chunk_score():
+    documents = [chunk(0, 100, source="low.pdf"), chunk(0, 100, source="high.pdf"), chunk(90, 200, source="low.pdf")]
+    _, passages = ContextBuilder(token_budget=10000).build(documents, scores=[0.2, 0.5, 0.9])
+    assert [p.source for p in passages] == ["low.pdf", "high.pdf"]
+    assert passages[0].score == 0.9
+
+
+def test_context_stays_within_the_token_budget():
+    documents = [chunk(i * 600, i * 600 + 500, page=i) for i in range(5)]
+    builder = ContextBuilder(token_budget=320, min_passage_tokens=50)  # Two whole passages, then 58 tokens left
+    context, passages = builder.build(documents)
+    assert estimate_tokens(context) <= 320 + len(passages)  # Separators between passages
+    assert len(passages) == 3 and passages[-1].text.endswith(" ...")
+
+
+def test_no_truncated_fragment_below_the_minimum():
+    documents = [chunk(0, 500), chunk(0, 500, page=1)]
+    text_tokens = estimate_tokens(documents[0].page_content) + estimate_tokens("[1] a.pdf p.1\n")
+    _, passages = ContextBuilder(token_budget=text_tokens + 20, min_passage_tokens=50).build(documents)
+    assert len(passages) == 1 and not passages[0].text.endswith(" ...")
+
+
+def test_citations_mention_collapsed_duplicates():
+    context, passages = ContextBuilder().build([chunk(0, 100, duplicate_sources="b.pdf, c.pdf", chunk_id="x")])
+    assert passages[0].citation == "a.pdf p.1 (also in b.pdf, c.pdf)"
+    assert passages[0].chunk_ids == ["x"]
+    assert context.startswith("[1] a.pdf p.1 (also in b.pdf, c.pdf)\n")
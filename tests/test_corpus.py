@@ -0,0 +1,113 @@
+import os
+import random
+import tracemalloc
+
+import numpy as np
+import pytest
+from langchain.schema import Document
+
+import corpus as corpus_module
+from corpus import CorpusRegistry, chunk_id
+from benchmarks.fakes import HashEmbeddings
+
+
+class CountingEmbeddings(HashEmbeddings):
+    def __init__(self):
+        super().__init__()
+        self.texts = []
+
+    def embed_documents(self, texts):
+        self.texts.extend(texts)
+        return super().embed_documents(texts)
+
+
+@pytest.fixture
+def corpus(tmp_path):
+    return CorpusRegistry(CountingEmbeddings(), str(tmp_path)).get("user", "chat", create=True)
+
+
+def upload(corpus, source, fingerprint, texts):
+    documents = [Document(page_content=text, metadata={"source": source, "page": i, "chunk_id": chunk_id(source, i, text)})
+                 for i, text in enumerate(texts)]
+    with corpus.writer() as writer:
+        added = writer.add_documents(documents)
+        writer.commit_source(source, fingerprint, [doc.metadata["chunk_id"] for doc in documents])
+        writer.publish()
+    return added
+
+
+def texts_of(corpus):
+    return sorted(doc.page_content for doc in corpus.snapshot().chunks)
+
+
+def test_reupload_embeds_only_changed_chunks(corpus):
+    upload(corpus, "a.pdf", "v1", ["alpha invoices", "beta payments"])
+    corpus.embeddings.texts.clear()
+    upload(corpus, "a.pdf", "v2", ["alpha invoices", "gamma refunds"])
+
+    assert corpus.embeddings.texts == ["gamma refunds"]
+    assert texts_of(corpus) == ["alpha invoices", "gamma refunds"]
+    snapshot = corpus.snapshot()
+    assert not snapshot.bm25_index.search("beta payments")
+    assert snapshot.statistics.total == 2
+    assert [cid.decode() for cid in snapshot.chunks.chunk_ids()] == [doc.metadata["chunk_id"] for doc in snapshot.chunks]
+
+
+def test_delete_source(corpus):
+    upload(corpus, "a.pdf", "v1", ["alpha invoices"])
+    upload(corpus, "b.pdf", "v1", ["beta payments", "delta taxes"])
+    with corpus.writer() as writer:
+        assert writer.delete_source("b.pdf")
+        assert not writer.delete_source("missing.pdf")
+        writer.publish()
+
+    assert texts_of(corpus) == ["alpha invoices"]
+    assert set(corpus.describe()["sources"]) == {"a.pdf"}
+    assert len(corpus.snapshot().vectors) == 1
+
+
+def test_chats_are_isolated_and_reopened_from_disk(corpus, tmp_path):
+    upload(corpus, "a.pdf", "v1", ["alpha invoices"])
+    registry = CorpusRegistry(HashEmbeddings(), str(tmp_path))
+    assert registry.get("user", "other-chat") is None
+    assert registry.get("other-user", "chat") is None
+    reopened = registry.get("user", "chat")
+    assert texts_of(reopened) == ["alpha invoices"] and reopened.version == corpus.version
+
+
+def test_writer_spills_new_chunks_to_disk(tmp_path, monkeypatch):
+    monkeypatch.setattr(corpus_module.Configuration, "DEDUP_ENABLED", False)  # Its signatures are held in memory
+    corpus = CorpusRegistry(HashEmbeddings(), str(tmp_path)).get("user", "chat", create=True)
+    rng = random.Random(0)
+    words = [f"term{i}" for i in range(2000)]
+    ids, spilled = [], 0
+    tracemalloc.start()
+    try:
+        with corpus.writer() as writer:
+            held = tracemalloc.get_traced_memory()[0]
+            for batch in range(10):
+                documents = []
+                for i in range(50):
+                    text = " ".join(rng.choice(words) for _ in range(200))
+                    documents.append(Document(page_content=text, metadata={
+                        "source": "big.pdf", "page": batch, "chunk_id": chunk_id("big.pdf", batch * 50 + i, text)}))
+                writer.add_documents(documents)
+                ids.extend(doc.metadata["chunk_id"] for doc in documents)
+                spilled += sum(len(doc.page_content) for doc in documents) + len(documents) * 4 * corpus.embeddings.dim
+                del documents
+            held = tracemalloc.get_traced_memory()[0] - held
+            staging = writer._staged.path
+            assert os.path.isdir(staging)
+            writer.commit_source("big.pdf", "v1", ids)
+            writer.publish()
+    finally:
+        tracemalloc.stop()
+
+    assert held < spilled / 5, (held, spilled)  # Offsets and ids per chunk, not texts and vectors
+    assert not os.path.exists(staging)
+    snapshot = corpus.snapshot()
+    assert len(snapshot) == 500 and [cid.decode() for cid in snapshot.chunks.chunk_ids()] == ids
+    first = snapshot.chunks[0].page_content
+    expected = np.asarray(corpus.embeddings.embed_documents([first])[0], dtype=np.float32)
+    np.testing.assert_allclose(snapshot.vectors[0], expected / np.linalg.norm(expected), atol=1e-5)
+    assert snapshot.bm25_index.search(first, k=1)[0][0].metadata["chunk_id"] == ids[0]
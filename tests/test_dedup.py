@@ -0,0 +1,106 @@
+import numpy as np
+import pytest
+from langchain.schema import Document
+
+from config_file import Configuration
+from corpus import CorpusRegistry, chunk_id
+from dedup import ChunkDeduplicator
+from benchmarks.fakes import HashEmbeddings
+
+pytestmark = pytest.mark.skipif(not Configuration.DEDUP_ENABLED, reason="deduplication is disabled")
+
+POLICY = ("The onboarding policy says that the monthly subscription fee is {} dollars and is billed on the first "
+          "day of each month for all accounts in good standing with the company")
+
+
+@pytest.fixture
+def corpus(tmp_path):
+    return CorpusRegistry(HashEmbeddings(), str(tmp_path)).get("user", "chat", create=True)
+
+
+def upload(corpus, source, fingerprint, texts):
+    documents = [Document(page_content=text, metadata={"source": source, "page": i, "chunk_id": chunk_id(source, i, text)})
+                 for i, text in enumerate(texts)]
+    with corpus.writer() as writer:
+        added = writer.add_documents(documents)
+        writer.commit_source(source, fingerprint, [doc.metadata["chunk_id"] for doc in documents])
+        writer.publish()
+    return added
+
+
+def texts_of(corpus):
+    return sorted(doc.page_content for doc in corpus.snapshot().chunks)
+
+
+def test_exact_and_near_duplicates_are_found():
+    deduplicator = ChunkDeduplicator()
+    assert deduplicator.check("a", POLICY.format(100)) is None
+    assert deduplicator.check("b", "  " + POLICY.format(100).upper()) == "a"  # Normalised exact match
+    assert deduplicator.check("c", POLICY.format(100) + " today") == "a"
+    assert deduplicator.check("d", "A completely different paragraph about quarterly tax filings and audits") is None
+    assert deduplicator.check("e", POLICY.format(100) + " today", exclude={"a"}) is None
+    assert len(deduplicator) == 3
+
+
+def test_removed_and_renamed_chunks():
+    deduplicator = ChunkDeduplicator()
+    deduplicator.add("a", POLICY.format(100))
+    deduplicator.rename("a", "b")
+    assert deduplicator.find(POLICY.format(100)) == "b"
+    deduplicator.remove("b")
+    assert deduplicator.find(POLICY.format(100)) is None and not deduplicator.buckets[0]
+
+
+def test_signatures_are_reused_only_if_they_cover_the_corpus(tmp_path):
+    deduplicator = ChunkDeduplicator()
+    deduplicator.add("a", POLICY.format(100))
+    deduplicator.save(str(tmp_path))
+
+    def never():
+        raise AssertionError("documents should not be rehashed")
+        yield
+
+    loaded = ChunkDeduplicator.load_or_build(str(tmp_path), ["a"], never())
+    assert loaded.find(POLICY.format(100)) == "a"
+    rebuilt = ChunkDeduplicator.load_or_build(str(tmp_path), ["a", "b"], [
+        Document(page_content=POLICY.format(100), metadata={"chunk_id": "a"}),
+        Document(page_content=POLICY.format(200), metadata={"chunk_id": "b"})])
+    assert len(rebuilt) == 2
+
+
+def test_duplicate_is_promoted_when_its_original_is_deleted(corpus):
+    upload(corpus, "a.pdf", "v1", [POLICY.format(100)])
+    assert upload(corpus, "b.pdf", "v1", [POLICY.format(100) + " ."]) == (0, 1)
+    snapshot = corpus.snapshot()
+    assert len(snapshot) == 1
+    assert snapshot.chunks[0].metadata["duplicate_sources"] == "b.pdf"
+
+    with corpus.writer() as writer:
+        writer.delete_source("a.pdf")
+        writer.publish()
+    snapshot = corpus.snapshot()
+    assert len(snapshot) == 1 and not snapshot.manifest["duplicates"]
+    promoted = snapshot.chunks[0]
+    assert promoted.metadata["source"] == "b.pdf" and promoted.page_content == POLICY.format(100) + " ."
+    assert "duplicate_sources" not in promoted.metadata
+    expected = np.asarray(HashEmbeddings().embed_documents([promoted.page_content])[0], dtype=np.float32)
+    np.testing.assert_allclose(snapshot.vectors[0], expected / np.linalg.norm(expected), atol=1e-5)
+
+
+def test_revised_chunk_is_not_collapsed_into_its_previous_version(corpus):
+    upload(corpus, "a.pdf", "v1", [POLICY.format(100)])
+    assert upload(corpus, "a.pdf", "v2", [POLICY.format(150)]) == (1, 0)
+    assert texts_of(corpus) == [POLICY.format(150)]
+
+
+def test_deleting_an_alias_updates_duplicate_sources(corpus):
+    upload(corpus, "a.pdf", "v1", [POLICY.format(100)])
+    upload(corpus, "b.pdf", "v1", [POLICY.format(100)])
+    upload(corpus, "c.pdf", "v1", [POLICY.format(100)])
+    assert corpus.snapshot().chunks[0].metadata["duplicate_sources"] == "b.pdf, c.pdf"
+    with corpus.writer() as writer:
+        writer.delete_source("b.pdf")
+        writer.publish()
+    snapshot = corpus.snapshot()
+    assert len(snapshot) == 1 and snapshot.chunks[0].metadata["duplicate_sources"] == "c.pdf"
+    assert corpus.describe()["duplicate_chunks"] == 1
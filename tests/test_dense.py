@@ -0,0 +1,34 @@
+import numpy as np
+from langchain.schema import Document
+
+from retrieval import DenseIndex
+from benchmarks.fakes import HashEmbeddings
+
+
+def make_index(n=40, dim=16, seed=0):
+    rng = np.random.default_rng(seed)
+    vectors = rng.normal(size=(n, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    documents = [Document(page_content=f"chunk {i}", metadata={"chunk_id": str(i), "source": f"{i % 3}.pdf"})
+                 for i in range(n)]
+    return DenseIndex(documents, vectors, HashEmbeddings(dim=dim)), rng.normal(size=(7, dim)).astype(np.float32)
+
+
+def ids(hits):
+    return [doc.metadata["chunk_id"] for doc, _ in hits]
+
+
+def test_batch_is_scored_in_blocks_with_the_same_results():
+    index, queries = make_index()
+    expected = [[str(i) for i, _ in index.search_by_vector(query, k=5)] for query in queries]
+    results = index.search_batch(queries, k=5, block_size=3)
+    assert len(results) == len(queries)
+    assert [ids(hits) for hits in results] == expected
+    assert all(scores == sorted(scores, reverse=True) for scores in ([s for _, s in hits] for hits in results))
+
+
+def test_batch_filters_and_small_corpora():
+    index, queries = make_index(n=4)
+    results = index.search_batch(queries, k=10, filters={"source": "1.pdf"}, block_size=2)
+    assert all(ids(hits) == ["1"] for hits in results)
+    assert index.search_batch(queries, k=0) == [[] for _ in queries]
@@ -0,0 +1,84 @@
+import pytest
+from langchain.schema import Document
+
+from retrieval import HybridRetriever
+
+
+def doc(name):
+    return Document(page_content=f"text of {name}", metadata={"chunk_id": name})
+
+
+class RankedArm:
+    """Vector store and BM25 stand-in returning fixed (document, score) lists, truncated to k."""
+
+    def __init__(self, results):
+        self.results = [(doc(name), score) for name, score in results]
+        self.calls = []
+
+    def similarity_search_with_score(self, query, k, filter=None):
+        self.calls.append((k, filter))
+        return self.results[:k]
+
+    def search(self, query, k, filters=None):
+        self.calls.append((k, filters))
+        return self.results[:k]
+
+    def search_batch(self, queries, k, filters=None):
+        return [self.search(query, k, filters) for query in queries]
+
+
+def names(results):
+    return [document.metadata["chunk_id"] for document, _ in results]
+
+
+def test_rrf_rewards_agreement_and_deduplicates():
+    vector = RankedArm([("a", 0.9), ("b", 0.8), ("c", 0.7)])
+    bm25 = RankedArm([("c", 12.0), ("d", 9.0), ("a", 1.0)])
+    results = HybridRetriever(vector, bm25, fusion="rrf", vector_weight=0.5).retrieve_with_scores("q", top_k=3)
+    assert names(results) == ["a", "c", "b", "d"]
+    assert results[0][1] == pytest.approx(0.5 / 61 + 0.5 / 63)
+
+
+def test_top_k_and_filters_reach_both_arms():
+    vector = RankedArm([(name, 1.0 - i / 10) for i, name in enumerate("abcdef")])
+    bm25 = RankedArm([(name, 10.0 - i) for i, name in enumerate("fedcba")])
+    retriever = HybridRetriever(vector, bm25, candidate_limit=10)
+    results = retriever.retrieve("q", top_k=2, filters={"source": "a.pdf"})
+    assert vector.calls == bm25.calls == [(2, {"source": "a.pdf"})]
+    assert [d.metadata["chunk_id"] for d in results] == ["a", "f", "b", "e"]
+
+
+def test_candidate_limit_bounds_the_reranker_input():
+    vector = RankedArm([(name, 1.0) for name in "abcdef"])
+    bm25 = RankedArm([(name, 1.0) for name in "ghijkl"])
+    assert len(HybridRetriever(vector, bm25, candidate_limit=5).retrieve("q", top_k=6)) == 5
+
+
+def test_weighted_fusion_uses_normalised_scores():
+    # BM25 scores are unbounded; min-max normalisation keeps them from swamping cosine similarities
+    vector = RankedArm([("a", 0.90), ("b", 0.89), ("c", 0.10)])
+    bm25 = RankedArm([("c", 40.0), ("b", 39.0), ("a", 0.0)])
+    results = HybridRetriever(vector, bm25, fusion="weighted", vector_weight=0.5).retrieve_with_scores("q", 3)
+    scores = dict(zip(names(results), (score for _, score in results)))
+    assert names(results)[0] == "b"
+    assert scores["a"] == pytest.approx(0.5) and scores["c"] == pytest.approx(0.5)
+
+
+def test_vector_weight_shifts_the_ranking():
+    vector = RankedArm([("a", 0.9), ("b", 0.5)])
+    bm25 = RankedArm([("b", 9.0), ("a", 5.0)])
+    assert names(HybridRetriever(vector, bm25, vector_weight=0.8).retrieve_with_scores("q", 2))[0] == "a"
+    assert names(HybridRetriever(vector, bm25, vector_weight=0.2).retrieve_with_scores("q", 2))[0] == "b"
+
+
+def test_batch_matches_single_queries():
+    vector = RankedArm([("a", 0.9), ("b", 0.8), ("c", 0.7)])
+    bm25 = RankedArm([("c", 12.0), ("d", 9.0), ("a", 1.0)])
+    retriever = HybridRetriever(vector, bm25)
+    batch = retriever.retrieve_batch(["q1", "q2"], [[0.0], [0.0]], top_k=3)
+    assert [names(results) for results in batch] == [names(retriever.retrieve_with_scores("q", 3))] * 2
+
+
+def test_unknown_fusion_method():
+    with pytest.raises(ValueError):
+        HybridRetriever(RankedArm([]), RankedArm([]), fusion="max")
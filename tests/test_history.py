@@ -0,0 +1,131 @@
+import asyncio
+
+import pytest
+
+import history
+from history import ChatHistory, MemoryHistoryBackend, SQLiteHistoryBackend
+from metrics import HISTORY_DROPPED
+
+
+class CountingBackend(MemoryHistoryBackend):
+    def __init__(self):
+        super().__init__()
+        self.inserts = 0
+        self.reads = 0
+        self.down = False
+
+    async def insert_many(self, messages):
+        if self.down:
+            raise ConnectionError("history store unreachable")
+        self.inserts += 1
+        await super().insert_many(messages)
+
+    async def recent(self, userID, chatID, limit):
+        self.reads += 1
+        return await super().recent(userID, chatID, limit)
+
+
+def contents(messages):
+    return [message["content"] for message in messages]
+
+
+def test_appends_are_written_in_one_batch():
+    backend = CountingBackend()
+    chat_history = ChatHistory(backend, batch_size=100)
+
+    async def scenario():
+        for i in range(5):
+            await chat_history.append("u", "c", "user", f"m{i}")
+        assert backend.inserts == 0
+        await chat_history.flush()
+
+    asyncio.run(scenario())
+    assert backend.inserts == 1
+    assert contents(asyncio.run(backend.recent("u", "c", 10))) == ["m4", "m3", "m2", "m1", "m0"]
+
+
+def test_full_buffer_flushes_at_once():
+    backend = CountingBackend()
+    chat_history = ChatHistory(backend, batch_size=3)
+
+    async def scenario():
+        for i in range(7):
+            await chat_history.append("u", "c", "user", f"m{i}")
+
+    asyncio.run(scenario())
+    assert backend.inserts == 2 and chat_history.stats()["pending"] == 1
+
+
+def test_recent_sees_buffered_messages_and_is_cached():
+    backend = CountingBackend()
+    chat_history = ChatHistory(backend, cache_turns=4)
+
+    async def scenario():
+        await chat_history.append("u", "c", "user", "question")
+        first = await chat_history.recent("u", "c", 2)
+        await chat_history.append("u", "c", "assistant", "answer")
+        second = await chat_history.recent("u", "c", 2)
+        other = await chat_history.recent("u", "other", 2)
+        return first, second, other
+
+    first, second, other = asyncio.run(scenario())
+    assert contents(first) == ["question"]
+    assert contents(second) == ["answer", "question"]
+    assert other == []
+    assert backend.reads == 2  # The second read of the chat was served from its cached window
+    assert chat_history.stats()["cache_hits"] == 1
+
+
+def test_window_is_reread_after_the_ttl(monkeypatch):
+    backend = CountingBackend()
+    now = [100.0]
+    monkeypatch.setattr(history.time, "monotonic", lambda: now[0])
+    worker_a = ChatHistory(backend, cache_ttl=10)
+    worker_b = ChatHistory(backend, cache_ttl=10)
+
+    async def scenario():
+        assert await worker_a.recent("u", "c", 2) == []
+        await worker_b.append("u", "c", "user", "asked on worker b")
+        await worker_b.flush()
+        before = await worker_a.recent("u", "c", 2)
+        now[0] += 11
+        after = await worker_a.recent("u", "c", 2)
+        return before, after
+
+    before, after = asyncio.run(scenario())
+    assert before == [] and contents(after) == ["asked on worker b"]
+
+
+def test_outage_keeps_a_bounded_buffer():
+    backend = CountingBackend()
+    backend.down = True
+    chat_history = ChatHistory(backend, batch_size=3, max_pending=5)
+    dropped_before = HISTORY_DROPPED.value()
+
+    async def scenario():
+        for i in range(12):
+            await chat_history.append("u", "c", "user", f"m{i}")
+        await chat_history.flush()
+        assert chat_history.stats()["pending"] == 5
+        backend.down = False
+        await chat_history.flush()
+
+    asyncio.run(scenario())
+    assert chat_history.stats()["pending"] == 0 and chat_history.stats()["dropped"] == 7
+    assert HISTORY_DROPPED.value() - dropped_before == 7
+    assert contents(asyncio.run(backend.recent("u", "c", 20)))[::-1] == [f"m{i}" for i in range(7, 12)]
+
+
+@pytest.mark.parametrize("limit", [3, 30])
+def test_sqlite_backend_returns_newest_first(tmp_path, limit):
+    chat_history = ChatHistory(SQLiteHistoryBackend(str(tmp_path / "history.sqlite3")), cache_turns=20)
+
+    async def scenario():
+        await chat_history.start()
+        for i in range(25):
+            await chat_history.append("u", "c", "user" if i % 2 == 0 else "assistant", f"m{i}")
+        messages = await chat_history.recent("u", "c", limit)
+        await chat_history.close()
+        return messages
+
+    assert contents(asyncio.run(scenario())) == [f"m{i}" for i in range(24, max(24 - limit, -1), -1)]
@@ -0,0 +1,135 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from langchain.schema import Document
+
+import ingestion
+from corpus import CorpusRegistry
+from ingestion import IngestionManager, SourceFile
+from benchmarks.fakes import HashEmbeddings
+
+
+def load_text_pages(path):
+    """Stand-in for the PDF loader: one chunk per line of a text file."""
+    with open(path) as f:
+        return [Document(page_content=line.strip(), metadata={"page": i}) for i, line in enumerate(f) if line.strip()]
+
+
+@pytest.fixture
+def manager(tmp_path, monkeypatch):
+    monkeypatch.setattr(ingestion, "load_and_chunk_pdf", load_text_pages)
+    manager = IngestionManager(workers=2, batch_size=2, queue_size=2, jobs_dir=str(tmp_path / "jobs"))
+    manager._executor = ThreadPoolExecutor(max_workers=2)  # Parsing stays in-process, where the loader is patched
+    yield manager
+    manager.shutdown()
+
+
+@pytest.fixture
+def corpus(tmp_path):
+    return CorpusRegistry(HashEmbeddings(), str(tmp_path / "corpora")).get("user", "chat", create=True)
+
+
+def make_source(tmp_path, name, lines, fingerprint=None):
+    path = tmp_path / name
+    path.write_text("\n".join(lines))
+    return SourceFile(path=str(path), name=name, fingerprint=fingerprint or f"{name}-{len(lines)}")
+
+
+async def wait_for(jobs, timeout=10.0):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while any(job.finished_at is None for job in jobs):
+        assert loop.time() < deadline, [job.status for job in jobs]
+        await asyncio.sleep(0.01)
+
+
+def ingest(manager, corpus, *uploads):
+    async def scenario():
+        jobs = [manager.submit(corpus, sources) for sources in uploads]
+        assert all(job.status == "queued" for job in jobs)
+        await wait_for(jobs)
+        return jobs
+
+    return asyncio.run(scenario())
+
+
+def test_job_runs_to_completion_in_batches(manager, corpus, tmp_path):
+    lines = [f"line {i} about invoices number {i}" for i in range(5)]
+    job, = ingest(manager, corpus, [make_source(tmp_path, "a.pdf", lines)])
+
+    assert job.status == "completed" and job.error is None
+    assert (job.files_parsed, job.pages, job.chunks, job.embedded) == (1, 5, 5, 5)
+    assert len(corpus) == 5 and corpus.version == 1
+
+
+def test_status_is_readable_by_other_workers(manager, corpus, tmp_path):
+    job, = ingest(manager, corpus, [make_source(tmp_path, "a.pdf", ["alpha"])])
+    other = IngestionManager(jobs_dir=manager.jobs_dir)
+    assert other.get(job.job_id).to_dict() == job.to_dict()
+    assert other.get("not-a-job-id") is None
+    assert other.get("00000000-0000-0000-0000-000000000000") is None
+
+
+def test_unchanged_file_is_skipped(manager, corpus, tmp_path):
+    source = make_source(tmp_path, "a.pdf", ["alpha", "beta"])
+    ingest(manager, corpus, [source])
+    job, = ingest(manager, corpus, [source])
+    assert job.status == "completed"
+    assert (job.files_unchanged, job.files_parsed, job.embedded) == (1, 0, 0)
+
+
+def test_uploads_to_one_chat_are_applied_in_turn(manager, corpus, tmp_path):
+    uploads = [[make_source(tmp_path, f"{i}.pdf", [f"chunk {i} {j}" for j in range(3)])] for i in range(4)]
+    jobs = ingest(manager, corpus, *uploads)
+    assert [job.status for job in jobs] == ["completed"] * 4
+    assert len(corpus) == 12
+    assert set(corpus.describe()["sources"]) == {"0.pdf", "1.pdf", "2.pdf", "3.pdf"}
+
+
+def test_failed_job_leaves_the_corpus_unchanged(manager, corpus, tmp_path, monkeypatch):
+    ingest(manager, corpus, [make_source(tmp_path, "a.pdf", ["alpha"])])
+
+    def broken(path):
+        raise ValueError("corrupt PDF")
+
+    monkeypatch.setattr(ingestion, "load_and_chunk_pdf", broken)
+    job, = ingest(manager, corpus, [make_source(tmp_path, "b.pdf", ["beta"])])
+    assert job.status == "failed" and "corrupt PDF" in job.error
+    assert corpus.version == 1 and len(corpus) == 1
+
+    monkeypatch.setattr(ingestion, "load_and_chunk_pdf", load_text_pages)
+    job, = ingest(manager, corpus, [make_source(tmp_path, "b.pdf", ["beta"])])
+    assert job.status == "completed" and len(corpus) == 2  # The failed job released the write lock
+
+
+def test_finished_jobs_are_evicted(manager, corpus, tmp_path):
+    manager.max_jobs = 1
+    first, = ingest(manager, corpus, [make_source(tmp_path, "a.pdf", ["alpha"])])
+    second, = ingest(manager, corpus, [make_source(tmp_path, "b.pdf", ["beta"])])
+    assert first.job_id not in manager.jobs and manager.get(first.job_id) is None
+    assert manager.get(second.job_id).status == "completed"
+    assert sorted(os.listdir(manager.jobs_dir)) == [f"{second.job_id}.json"]
+
+
+def test_waiting_uploads_do_not_hold_executor_threads(manager, corpus, tmp_path):
+    manager.lock_poll = 0.01
+    uploads = [[make_source(tmp_path, f"{i}.pdf", [f"chunk {i}"])] for i in range(6)]
+
+    async def scenario():
+        asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=3))
+        busy = corpus.writer()  # Another process or a deletion holds the chat's write lock
+        try:
+            jobs = [manager.submit(corpus, sources) for sources in uploads]
+            await asyncio.sleep(0.1)
+            assert await asyncio.wait_for(asyncio.to_thread(lambda: "free"), timeout=2) == "free"
+            assert all(job.status == "queued" for job in jobs)
+        finally:
+            busy.close()
+        await wait_for(jobs)
+        return jobs
+
+    jobs = asyncio.run(scenario())
+    assert [job.status for job in jobs] == ["completed"] * 6
+    assert len(corpus) == 6 and not manager._corpus_locks
@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+from langchain.schema import Document
+
+from retrieval import HierarchicalIndex, _normalize
+
+pytest.importorskip("sklearn.cluster")
+
+K = 10
+
+
+def clustered_vectors(n, dim=32, n_topics=20, seed=0):
+    rng = np.random.default_rng(seed)
+    topics = rng.normal(size=(n_topics, dim)).astype(np.float32)
+    return _normalize(topics[rng.integers(0, n_topics, size=n)] + 0.5 * rng.normal(size=(n, dim)).astype(np.float32))
+
+
+def exact_top_k(vectors, query, k=K):
+    return set(np.argsort(-(vectors @ query))[:k].tolist())
+
+
+def recall(index, vectors, queries, nprobe):
+    found = [{i for i, _ in index.search_by_vector(query, k=K, nprobe=nprobe)} for query in queries]
+    return np.mean([len(hits & exact_top_k(vectors, query)) / K for hits, query in zip(found, queries)])
+
+
+@pytest.fixture(scope="module")
+def data():
+    vectors = clustered_vectors(2050)
+    documents = [Document(page_content=str(i), metadata={"parity": i % 2}) for i in range(2000)]
+    return documents, vectors[:2000], vectors[2000:]
+
+
+@pytest.fixture(scope="module")
+def index(data):
+    documents, vectors, _ = data
+    return HierarchicalIndex(documents, embedding_model=None, n_clusters=16, nprobe=4, embeddings=vectors)
+
+
+def test_probing_every_cluster_is_exact(index, data):
+    _, vectors, queries = data
+    assert recall(index, vectors, queries, nprobe=16) == 1.0
+
+
+def test_recall_with_a_few_probes(index, data):
+    _, vectors, queries = data
+    assert recall(index, vectors, queries, nprobe=4) >= 0.9
+    assert recall(index, vectors, queries, nprobe=1) <= recall(index, vectors, queries, nprobe=8)
+
+
+def test_scores_are_cosine_similarities(index, data):
+    _, vectors, queries = data
+    for i, score in index.search_by_vector(queries[0] * 3.0, k=K):
+        assert score == pytest.approx(float(vectors[i] @ queries[0]), abs=1e-5)
+
+
+def test_filters_apply_to_probed_documents(index, data):
+    documents, _, queries = data
+    hits = index.search_by_vector(queries[0], k=K, filters={"parity": 1})
+    assert len(hits) == K and all(documents[i].metadata["parity"] == 1 for i, _ in hits)
+
+
+def test_added_documents_are_searchable(data):
+    documents, vectors, queries = data
+    index = HierarchicalIndex(documents[:1500], embedding_model=None, n_clusters=16, embeddings=vectors[:1500])
+    index.add_documents(documents[1500:], embeddings=vectors[1500:])
+    assert sum(len(ids) for ids in index.cluster_ids) == 2000
+    assert recall(index, vectors, queries, nprobe=16) == 1.0
+
+
+def test_save_and_load(index, data, tmp_path):
+    _, vectors, queries = data
+    index.save(str(tmp_path))
+    loaded = HierarchicalIndex.load(str(tmp_path), embedding_model=None, nprobe=4)
+    for query in queries[:10]:
+        assert loaded.search_by_vector(query, k=K) == index.search_by_vector(query, k=K)
@@ -0,0 +1,96 @@
+import asyncio
+
+import pytest
+
+from metrics import InstrumentedLLM, MetricsRegistry, estimate_tokens, span, STAGE_SECONDS
+from benchmarks.fakes import FakeLLM
+
+
+def test_counter_renders_per_label_set():
+    registry = MetricsRegistry()
+    calls = registry.counter("test_calls_total", "Calls.", ["operation"])
+    calls.inc(operation="invoke")
+    calls.inc(2, operation='say "hi"')
+    assert registry.render().splitlines() == [
+        "# HELP test_calls_total Calls.",
+        "# TYPE test_calls_total counter",
+        'test_calls_total{operation="invoke"} 1',
+        'test_calls_total{operation="say \\"hi\\""} 2',
+    ]
+    assert calls.value(operation="invoke") == 1 and calls.value(operation="other") == 0
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = MetricsRegistry()
+    latency = registry.histogram("test_seconds", "Latency.", ["stage"], buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 3.0):
+        latency.observe(value, stage="rerank")
+    lines = registry.render().splitlines()[2:]
+    assert lines == [
+        'test_seconds_bucket{stage="rerank",le="0.1"} 1',
+        'test_seconds_bucket{stage="rerank",le="1.0"} 3',
+        'test_seconds_bucket{stage="rerank",le="+Inf"} 4',
+        'test_seconds_sum{stage="rerank"} 4.05',
+        'test_seconds_count{stage="rerank"} 4',
+    ]
+
+
+def test_names_are_unique():
+    registry = MetricsRegistry()
+    registry.counter("test_total", "First.")
+    with pytest.raises(ValueError):
+        registry.histogram("test_total", "Second.")
+
+
+def test_span_records_a_stage():
+    before = STAGE_SECONDS._counts.get(("test_span",), [0])
+    with span("test_span"):
+        pass
+    assert sum(STAGE_SECONDS._counts[("test_span",)]) == sum(before) + 1
+
+
+class UsageMessage:
+    def __init__(self, content, usage_metadata=None):
+        self.content = content
+        self.usage_metadata = usage_metadata
+
+
+class ReportingLLM(FakeLLM):
+    """Reports token usage like Gemini does."""
+
+    async def ainvoke(self, prompt):
+        message = await super().ainvoke(prompt)
+        return UsageMessage(message.content, {"input_tokens": 123, "output_tokens": 7})
+
+
+def test_instrumented_llm_counts_calls_and_tokens(monkeypatch):
+    import metrics
+
+    registry = MetricsRegistry()
+    calls = registry.counter("calls", "Calls.", ["operation"])
+    tokens = registry.counter("tokens", "Tokens.", ["kind"])
+    errors = registry.counter("errors", "Errors.", ["operation"])
+    monkeypatch.setattr(metrics, "LLM_CALLS", calls)
+    monkeypatch.setattr(metrics, "LLM_TOKENS", tokens)
+    monkeypatch.setattr(metrics, "LLM_ERRORS", errors)
+
+    asyncio.run(InstrumentedLLM(ReportingLLM(delay=0)).ainvoke("prompt"))
+    assert calls.value(operation="ainvoke") == 1
+    assert (tokens.value(kind="prompt"), tokens.value(kind="completion")) == (123, 7)
+
+    llm = InstrumentedLLM(FakeLLM(delay=0, answer="one two three"))
+
+    async def stream():
+        return [chunk.content async for chunk in llm.astream("a prompt of some length")]
+
+    assert "".join(asyncio.run(stream())) == "one two three"
+    assert calls.value(operation="astream") == 1
+    assert tokens.value(kind="prompt") == 123 + estimate_tokens("a prompt of some length")
+
+    class Broken(FakeLLM):
+        def invoke(self, prompt):
+            raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        InstrumentedLLM(Broken()).invoke("prompt")
+    assert errors.value(operation="invoke") == 1
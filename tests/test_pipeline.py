@@ -0,0 +1,70 @@
+import asyncio
+import time
+
+import pytest
+from langchain.schema import Document
+
+from pipeline import PipelineOptions, QueryPipeline
+from benchmarks.fakes import FakeLLM, FakeReranker, FakeRetriever
+
+DOCUMENTS = [Document(page_content=f"Passage {i} about invoices.", metadata={"source": "a.pdf", "page": i})
+             for i in range(5)]
+HISTORY = [{"role": "user", "content": "What is an invoice?"}, {"role": "assistant", "content": "A bill."}]
+
+
+def make_pipeline(llm):
+    return QueryPipeline(llm, FakeRetriever(DOCUMENTS, delay=0), FakeReranker(delay=0))
+
+
+def test_independent_llm_calls_run_concurrently():
+    llm = FakeLLM(delay=0.1)
+    start = time.perf_counter()
+    result = asyncio.run(make_pipeline(llm).run("When are invoices due?", HISTORY))
+    elapsed = time.perf_counter() - start
+    assert llm.calls == 4  # History check, metadata extraction, rewrite, generation
+    assert elapsed < 0.35  # Three concurrent calls then generation, not four in a row
+    assert result.sources and {"history_check", "metadata_extraction", "query_rewrite", "generation"} <= set(result.timings)
+
+
+def test_disabled_stages_are_skipped():
+    llm = FakeLLM(delay=0)
+    options = PipelineOptions(history_check=False, metadata_extraction=False, query_rewrite=False, rerank=False)
+    result = asyncio.run(make_pipeline(llm).run("When are invoices due?", HISTORY, options=options))
+    assert llm.calls == 1
+    assert not {"history_check", "metadata_extraction", "query_rewrite", "rerank"} & set(result.timings)
+    assert "retrieval" in result.timings
+
+
+def test_answer_from_history_skips_retrieval():
+    result = asyncio.run(make_pipeline(FakeLLM(delay=0, answer="yes")).run("And what is a bill?", HISTORY))
+    assert result.sources == ["chat_history"]
+    assert "retrieval" not in result.timings
+
+
+class FailingMetadataLLM(FakeLLM):
+    """Fails metadata extraction quickly while the other calls are slow."""
+
+    def __init__(self):
+        super().__init__(delay=0.3)
+        self.completed = 0
+
+    async def ainvoke(self, prompt: str):
+        if "Metadata (JSON)" in prompt:
+            await asyncio.sleep(0.01)
+            raise ValueError("extraction failed")
+        message = await super().ainvoke(prompt)
+        self.completed += 1
+        return message
+
+
+def test_failed_stage_cancels_its_siblings():
+    llm = FailingMetadataLLM()
+
+    async def scenario():
+        with pytest.raises(ValueError):
+            await make_pipeline(llm).run("When are invoices due?", [])
+        await asyncio.sleep(0.4)  # Long enough for a leaked rewrite call to finish
+
+    asyncio.run(scenario())
+    assert llm.completed == 0
+
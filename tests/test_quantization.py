@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+from langchain.schema import Document
+
+from retrieval import DenseIndex, QuantizedDenseIndex, quantize_vectors
+from benchmarks.fakes import HashEmbeddings
+
+K = 5
+
+
+@pytest.fixture(scope="module")
+def corpus():
+    rng = np.random.default_rng(0)
+    centers = rng.normal(size=(20, 64))
+    vectors = (centers[rng.integers(0, 20, 600)] + 0.3 * rng.normal(size=(600, 64))).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    documents = [Document(page_content=f"chunk {i}", metadata={"chunk_id": str(i), "source": f"{i % 4}.pdf"})
+                 for i in range(len(vectors))]
+    queries = (vectors[rng.integers(0, 600, 9)] + 0.2 * rng.normal(size=(9, 64))).astype(np.float32)
+    return documents, vectors, queries
+
+
+def quantized(corpus, method, **kwargs):
+    documents, vectors, _ = corpus
+    codes = quantize_vectors(vectors, method)
+    return QuantizedDenseIndex(documents, vectors, codes["codes"], codes.get("scale"), HashEmbeddings(dim=64), **kwargs)
+
+
+@pytest.mark.parametrize("method", ["int8", "binary"])
+@pytest.mark.parametrize("filters", [None, {"source": "2.pdf"}])
+def test_rescore_matches_exact_top_k(corpus, method, filters):
+    documents, vectors, queries = corpus
+    exact = DenseIndex(documents, vectors, HashEmbeddings(dim=64))
+    index = quantized(corpus, method, rescore=8, block_rows=100)  # Shortlist merged across six code blocks
+    for query in queries:
+        expected = exact.search_by_vector(query, k=K, filters=filters)
+        found = index.search_by_vector(query, k=K, filters=filters)
+        assert [i for i, _ in found] == [i for i, _ in expected]
+        np.testing.assert_allclose([s for _, s in found], [s for _, s in expected], rtol=1e-5)
+
+
+@pytest.mark.parametrize("method", ["int8", "binary"])
+def test_batch_is_scanned_in_blocks_with_the_same_results(corpus, method):
+    _, _, queries = corpus
+    index = quantized(corpus, method, block_rows=64)
+    single = [[str(i) for i, _ in index.search_by_vector(query, k=K)] for query in queries]
+    batched = index.search_batch(queries, k=K, block_size=4)
+    assert [[doc.metadata["chunk_id"] for doc, _ in hits] for hits in batched] == single
+
+
+def test_shortlist_is_bounded_and_skips_filtered_rows(corpus):
+    documents, vectors, queries = corpus
+    index = quantized(corpus, "int8", block_rows=50)
+    mask = np.zeros(len(vectors), dtype=bool)
+    mask[:3] = True
+    ids, scores = index._shortlist(queries[:2], 10, mask)
+    assert ids.shape == scores.shape == (2, 10)
+    assert all(set(row[np.isfinite(row_scores)]) == {0, 1, 2} for row, row_scores in zip(ids, scores))
+    assert index.search_by_vector(queries[0], k=K, filters={"source": "missing.pdf"}) == []
@@ -0,0 +1,107 @@
+import asyncio
+
+import pytest
+
+from metrics import SCHEDULER_RETRIES
+from scheduler import RequestScheduler, ScheduledLLM, SchedulerOverloaded, TokenBucket
+from benchmarks.fakes import FakeLLM, ResourceExhausted
+
+
+def make_scheduler(name, max_concurrency=4, max_queue=16, max_retries=3):
+    return RequestScheduler(name, max_concurrency, max_queue, requests_per_minute=0, burst=max_concurrency,
+                            max_retries=max_retries, backoff=0.01, backoff_max=0.05)
+
+
+class FlakyLLM(FakeLLM):
+    """Refuses the first ``failures`` calls with a quota error, or ``error`` if given."""
+
+    def __init__(self, failures, error=None):
+        super().__init__(delay=0)
+        self.failures = failures
+        self.error = error or ResourceExhausted("429 Resource has been exhausted")
+        self.attempts = 0
+
+    async def ainvoke(self, prompt: str):
+        self.attempts += 1
+        if self.attempts <= self.failures:
+            raise self.error
+        return await super().ainvoke(prompt)
+
+
+def test_full_queue_is_rejected_with_retry_after():
+    scheduler = make_scheduler("test-queue", max_concurrency=1, max_queue=0)
+
+    async def scenario():
+        running = asyncio.ensure_future(scheduler.acall(lambda: asyncio.sleep(0.1)))
+        await asyncio.sleep(0)  # Let the first call take the only slot
+        with pytest.raises(SchedulerOverloaded) as rejected:
+            await scheduler.acall(lambda: asyncio.sleep(0.1))
+        await running
+        return rejected.value
+
+    assert asyncio.run(scenario()).retry_after > 0
+
+
+def test_identical_prompts_in_flight_share_one_call():
+    llm = FakeLLM(delay=0.05)
+    scheduled = ScheduledLLM(llm, make_scheduler("test-coalesce"))
+
+    async def scenario():
+        same = await asyncio.gather(*(scheduled.ainvoke("rewrite this") for _ in range(5)))
+        other = await scheduled.ainvoke("something else")
+        return same, other
+
+    same, other = asyncio.run(scenario())
+    assert llm.calls == 2
+    assert {message.content for message in same} == {"no"} and other.content == "no"
+
+
+def test_quota_errors_are_retried():
+    llm = FlakyLLM(failures=2)
+    before = SCHEDULER_RETRIES.value(scheduler="test-retry")
+    message = asyncio.run(ScheduledLLM(llm, make_scheduler("test-retry")).ainvoke("hello"))
+    assert message.content == "no"
+    assert llm.attempts == 3
+    assert SCHEDULER_RETRIES.value(scheduler="test-retry") - before == 2
+
+
+def test_exhausted_retries_become_overload():
+    llm = FlakyLLM(failures=10)
+    with pytest.raises(SchedulerOverloaded):
+        asyncio.run(ScheduledLLM(llm, make_scheduler("test-exhausted", max_retries=1)).ainvoke("hello"))
+    assert llm.attempts == 2
+
+
+def test_other_errors_are_not_retried():
+    llm = FlakyLLM(failures=1, error=ValueError("bad request"))
+    with pytest.raises(ValueError):
+        asyncio.run(ScheduledLLM(llm, make_scheduler("test-fatal")).ainvoke("hello"))
+    assert llm.attempts == 1
+
+
+def test_concurrency_is_capped():
+    scheduler = make_scheduler("test-cap", max_concurrency=2)
+    state = {"in_flight": 0, "peak": 0}
+
+    async def call():
+        state["in_flight"] += 1
+        state["peak"] = max(state["peak"], state["in_flight"])
+        await asyncio.sleep(0.01)
+        state["in_flight"] -= 1
+
+    async def scenario():
+        await asyncio.gather(*(scheduler.acall(call) for _ in range(8)))
+
+    asyncio.run(scenario())
+    assert state["peak"] == 2
+
+
+def test_token_bucket_allows_a_burst_then_the_rate(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr("scheduler.time.monotonic", lambda: now[0])
+    bucket = TokenBucket(rate=2.0, capacity=3)
+    assert [bucket.reserve() for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.reserve() == pytest.approx(0.5)  # The fourth call waits for the next token
+    now[0] += 10
+    assert bucket.reserve() == 0.0  # Refilled, up to the burst capacity
+    assert TokenBucket(rate=0, capacity=1).reserve() == 0.0
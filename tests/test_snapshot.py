@@ -0,0 +1,73 @@
+import functools
+import os
+
+import pytest
+from langchain.schema import Document
+
+import corpus as corpus_module
+from corpus import CorpusRegistry, chunk_id
+from snapshot import CURRENT, GENERATIONS, publish_snapshot, read_current
+from benchmarks.fakes import HashEmbeddings
+
+
+def upload(corpus, source, texts):
+    documents = [Document(page_content=text, metadata={"source": source, "page": i, "chunk_id": chunk_id(source, i, text)})
+                 for i, text in enumerate(texts)]
+    with corpus.writer() as writer:
+        writer.add_documents(documents)
+        writer.commit_source(source, f"{source}-{len(texts)}", [doc.metadata["chunk_id"] for doc in documents])
+        return writer.publish()
+
+
+def test_publish_switches_current_and_keeps_the_last_generations(tmp_path):
+    root = str(tmp_path)
+
+    def write(path):
+        with open(os.path.join(path, "artifact"), "w") as f:
+            f.write("data")
+
+    os.makedirs(os.path.join(root, GENERATIONS, ".0000000009.stale"))  # Left behind by a crashed publish
+    names = [publish_snapshot(root, {"version": version}, write, keep=2) for version in (1, 2, 3)]
+    assert names == ["0000000001", "0000000002", "0000000003"]
+    assert read_current(root) == "0000000003"
+    assert sorted(os.listdir(os.path.join(root, GENERATIONS))) == ["0000000002", "0000000003"]
+    assert os.path.exists(os.path.join(root, GENERATIONS, "0000000003", "manifest.json"))
+
+
+def test_failed_publish_leaves_the_current_generation(tmp_path):
+    root = str(tmp_path)
+    publish_snapshot(root, {"version": 1}, lambda path: None)
+
+    def broken(path):
+        raise OSError("disk full")
+
+    with pytest.raises(OSError):
+        publish_snapshot(root, {"version": 2}, broken)
+    assert read_current(root) == "0000000001"
+
+
+def test_readers_keep_their_generation_until_they_see_the_new_one(tmp_path, monkeypatch):
+    monkeypatch.setattr(corpus_module, "publish_snapshot", functools.partial(publish_snapshot, keep=1))
+    corpus = CorpusRegistry(HashEmbeddings(), str(tmp_path)).get("user", "chat", create=True)
+    upload(corpus, "a.pdf", ["alpha invoices", "beta payments"])
+    old = corpus.snapshot()
+
+    other = CorpusRegistry(HashEmbeddings(), str(tmp_path)).get("user", "chat")  # Another worker process
+    upload(other, "b.pdf", ["gamma refunds"])
+    assert not os.path.exists(old.path)  # Removed from disk, still mapped by the first reader
+    assert [doc.page_content for doc in old.chunks] == ["alpha invoices", "beta payments"]
+    assert old.vectorstore.similarity_search("alpha invoices", k=1)[0].page_content == "alpha invoices"
+
+    current = corpus.snapshot()
+    assert current is not old and current.generation == read_current(corpus.path)
+    assert len(current) == 3 and current.version == old.version + 1
+    assert corpus.snapshot() is current  # Not remapped while CURRENT is unchanged
+    assert os.path.exists(os.path.join(corpus.path, CURRENT))
+
+
+def test_unchanged_writer_publishes_nothing(tmp_path):
+    corpus = CorpusRegistry(HashEmbeddings(), str(tmp_path)).get("user", "chat", create=True)
+    first = upload(corpus, "a.pdf", ["alpha invoices"])
+    with corpus.writer() as writer:
+        assert writer.publish() is None
+    assert corpus.snapshot().generation == first
@@ -0,0 +1,44 @@
+import asyncio
+
+import pytest
+from langchain.schema import Document
+
+from pipeline import QueryPipeline
+from benchmarks.fakes import FakeLLM, FakeReranker, FakeRetriever
+
+DOCUMENTS = [Document(page_content=f"Passage {i} about invoices.", metadata={"source": "a.pdf", "page": i})
+             for i in range(5)]
+
+
+def make_pipeline(llm):
+    return QueryPipeline(llm, FakeRetriever(DOCUMENTS, delay=0), FakeReranker(delay=0))
+
+
+async def collect(stream):
+    return [event async for event in stream]
+
+
+def test_stream_emits_sources_tokens_then_done():
+    llm = FakeLLM(delay=0, answer="Invoices are due in thirty days.")
+    events = asyncio.run(collect(make_pipeline(llm).stream("When are invoices due?", [])))
+    names = [name for name, _ in events]
+    assert names[0] == "sources" and names[-1] == "done"
+    assert set(names[1:-1]) == {"token"}
+    tokens = "".join(data for name, data in events if name == "token")
+    assert tokens == events[-1][1].answer == llm.answer
+    assert events[0][1] == events[-1][1].sources
+
+
+def test_first_token_arrives_before_generation_ends():
+    llm = FakeLLM(delay=0.01, answer="one two three four", token_delay=0.05)
+    events = asyncio.run(collect(make_pipeline(llm).stream("When are invoices due?", [])))
+    timings = events[-1][1].timings
+    assert timings["first_token"] < timings["total"] - 100  # Milliseconds; three tokens still to come
+
+
+def test_sse_event_format():
+    pytest.importorskip("fastapi")
+    from app import sse_event
+
+    assert sse_event("token", "Hi") == 'event: token\ndata: "Hi"\n\n'
+    assert sse_event("sources", ["a.pdf p.1"]) == 'event: sources\ndata: ["a.pdf p.1"]\n\n'
@@ -1,73 +1,29 @@
 import os
+import json
 import logging
-from typing import List, Dict
-from datetime import datetime
-from pymongo import MongoClient
-from pymongo.server_api import ServerApi
-from pymongo.errors import ConnectionFailure
-from langchain_community.document_loaders import PyPDFLoader
+from typing import List, Tuple
 # from langchain.document_loaders import PyPDFLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.schema import Document
 from concurrent.futures import ThreadPoolExecutor
-from config_file import Configuration
+import numpy as np
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-try:
-    # MongoDB client
-    print(f"MONGO URI >> {Configuration.MONGO_URI}")
-    print(f"MONGO DB >> {Configuration.MONGO_DB}")
-    print(f"MONGO Collections >> {Configuration.MONGO_COLLECTION}")
-    client = MongoClient(Configuration.MONGO_URI, server_api=ServerApi('1'))
-    client.admin.command('ping')  # Test connection
-    db = client[Configuration.MONGO_DB]
-    chats_collection = db[Configuration.MONGO_COLLECTION]
-    print("MongoDB connection successful!")
-except ConnectionFailure as e:
-    print(f"Failed to connect to MongoDB: {e}")
-    
-
-def store_chat_history(userID: str, chatID: str, role: str, content: str):
-    """Store a message in the chat history."""
-    try:
-        message = {
-            "userID": userID,
-            "chatID": chatID,
-            "timestamp": datetime.now(),
-            "role": role,
-            "content": content
-        }
-        chats_collection.insert_one(message)
-        logger.info(f"Stored message in chat history for user {userID}, chat {chatID}.")
-    except Exception as e:
-        logger.error(f"Error storing chat history: {e}")
-
-
-def retrieve_chat_history(userID: str, chatID: str, limit: int = 5) -> List[Dict[str, str]]:
-    """Retrieve the most recent messages from the chat history."""
-    try:
-        messages = chats_collection.find(
-            {"userID": userID, "chatID": chatID},
-            sort=[("timestamp", -1)],  # Sort by timestamp in descending order
-            limit=limit
-        )
-        return [{"role": msg["role"], "content": msg["content"]} for msg in messages]
-    except Exception as e:
-        logger.error(f"Error retrieving chat history: {e}")
-        return []
-
 def load_and_chunk_pdf(file_path: str) -> List[Document]:
     """Load and split a single PDF document."""
+    from langchain_community.document_loaders import PyPDFLoader  # Deferred: pulls in pypdf
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+
     try:
         loader = PyPDFLoader(file_path)
         text_splitter = RecursiveCharacterTextSplitter(
             chunk_size=1000,
             chunk_overlap=200,
-            separators=["\n\n", "\n", " ", ""]
+            separators=["\n\n", "\n", " ", ""],
+            add_start_index=True,  # Lets the context builder merge overlapping neighbours exactly
         )
         return loader.load_and_split(text_splitter)
     except Exception as e:
@@ -95,4 +51,62 @@ def load_and_chunk_folder(folder_path: str) -> List[Document]:
                 logger.error(f"Error processing PDF: {e}")
 
     logger.info(f"Loaded and chunked {len(all_docs)} documents from {len(pdf_files)} PDFs.")
-    return all_docs
\ No newline at end of file
+    return all_docs
+
+def atomic_write(path: str, content: str):
+    """Write a text file via a temporary file so readers never see partial data."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+def atomic_save_npy(path: str, array: np.ndarray):
+    """Save a NumPy array via a temporary file so readers never see partial data."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.save(f, array)
+    os.replace(tmp_path, path)
+
+class NpyWriter:
+    """Streams rows into a ``.npy`` file whose shape is known up front, without holding the array.
+
+    Rows go to a temporary file that replaces ``path`` on a clean exit.
+    """
+
+    def __init__(self, path: str, dtype, shape: Tuple[int, ...]):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.shape = tuple(int(n) for n in shape)
+        self.rows = 0
+        self._file = open(f"{path}.tmp", "wb")
+        np.lib.format.write_array_header_1_0(self._file, {
+            "descr": np.lib.format.dtype_to_descr(self.dtype), "fortran_order": False, "shape": self.shape})
+
+    def write(self, rows: np.ndarray):
+        rows = np.ascontiguousarray(rows, dtype=self.dtype)
+        self._file.write(rows.tobytes())
+        self.rows += len(rows)
+
+    def __enter__(self) -> "NpyWriter":
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        self._file.close()
+        if exc_type is not None:
+            os.remove(self._file.name)
+            return
+        if self.rows != self.shape[0]:
+            os.remove(self._file.name)
+            raise ValueError(f"Wrote {self.rows} rows to {self.path}, expected {self.shape[0]}")
+        os.replace(self._file.name, self.path)
+
+def save_documents(path: str, documents: List[Document]):
+    """Persist documents as JSON lines."""
+    atomic_write(path, "".join(
+        json.dumps({"page_content": doc.page_content, "metadata": doc.metadata}) + "\n" for doc in documents
+    ))
+
+def load_documents(path: str) -> List[Document]:
+    """Load documents written by ``save_documents``."""
+    with open(path) as f:
+        return [Document(**json.loads(line)) for line in f if line.strip()]